@@ -0,0 +1,13 @@
+import os
+
+def pytest_configure(config):
+    """
+    Save the results of every run if pytest-benchmark is installed, so that they can be compared
+    between releases using
+        pytest-benchmark --storage benchmarks/results compare
+    """
+    if not config.pluginmanager.hasplugin('benchmark'):
+        return
+    config.option.benchmark_autosave = True
+    if not any(arg.startswith('--benchmark-storage') for arg in config.invocation_params.args):
+        config.option.benchmark_storage = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
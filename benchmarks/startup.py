@@ -0,0 +1,66 @@
+"""
+Measure the time taken to run simple CLI commands, and the modules they import
+
+Each command is run in a new interpreter, as it would be from a shell loop. Commands which need
+the PROMINENCE server are expected to fail quickly unless PROMINENCE_URL and a token are set.
+"""
+from __future__ import print_function
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Run the CLI, then print the names of all modules which were actually loaded
+SCRIPT = '''
+import atexit, sys
+def report():
+    loaded = [name for name, module in list(sys.modules.items())
+              if module is not None and type(module).__name__ != '_LazyModule']
+    sys.stderr.write('MODULES %s\\\\n' % ' '.join(sorted(loaded)))
+atexit.register(report)
+from prominence.cli import main
+main(sys.argv[1:])
+'''
+
+COMMANDS = (['--version'], ['list'], ['describe', '1'])
+
+def run(command, repeats):
+    """
+    Return the mean wall clock time of a command and the modules imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] +
+                                                       sys.path))
+    env.setdefault('PROMINENCE_URL', 'http://127.0.0.1:9/v1')
+    start = time.time()
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', SCRIPT] + command, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    duration = (time.time() - start)/repeats
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if line.startswith('MODULES '):
+            modules = line.split()[1:]
+    return (duration, modules)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure CLI startup time')
+    parser.add_argument('--repeats', type=int, default=20, help='Number of times to run each command')
+    args = parser.parse_args()
+
+    start = time.time()
+    for _ in range(args.repeats):
+        subprocess.run([sys.executable, '-c', 'pass'])
+    baseline = (time.time() - start)/args.repeats
+
+    print('%-15s %10s %10s   %s' % ('Command', 'Time (ms)', 'Modules', 'Heavy modules imported'))
+    print('%-15s %10.1f' % ('(interpreter)', baseline*1000))
+    for command in COMMANDS:
+        duration, modules = run(command, args.repeats)
+        heavy = [name for name in ('requests', 'yaml', 'asyncio', 'sqlite3', 'prominence.client', 'prominence.job')
+                 if name in modules]
+        print('%-15s %10.1f %10d   %s' % (' '.join(command), duration*1000, len(modules), ', '.join(heavy)))
+
+if __name__ == '__main__':
+    main()
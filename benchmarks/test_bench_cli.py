@@ -0,0 +1,82 @@
+"""
+Benchmarks for the CPU cost of transforming and rendering jobs and workflows in the CLI, and of
+preparing job descriptions
+
+Run using pytest-benchmark from the top-level directory; the results are saved in benchmarks/results
+so that they can be compared between releases:
+
+    python -m pytest benchmarks
+    python -m pytest benchmarks --benchmark-compare
+"""
+import contextlib
+import io
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from prominence import cli
+from prominence.fakeserver import synthetic_job, synthetic_workflow
+
+# Number of jobs and workflows in each listing
+JOBS = 10000
+WORKFLOWS = 2000
+
+@pytest.fixture(scope='module')
+def jobs():
+    return [synthetic_job(job_id, now=1600000000) for job_id in range(1, JOBS + 1)]
+
+@pytest.fixture(scope='module')
+def workflows():
+    return [synthetic_workflow(workflow_id, now=1600000000) for workflow_id in range(1, WORKFLOWS + 1)]
+
+def _quiet(function, *args):
+    """
+    Call a function discarding anything printed
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+def test_transform_job(benchmark, jobs):
+    benchmark(lambda: [cli.transform_job(job, False) for job in jobs])
+
+def test_transform_job_detail(benchmark, jobs):
+    benchmark(lambda: [cli.transform_job(job, True) for job in jobs])
+
+def test_transform_item_list_jobs(benchmark, jobs):
+    result = benchmark(cli.transform_item_list, jobs, False, 'jobs')
+    assert len(result) == JOBS
+
+def test_transform_item_list_workflows(benchmark, workflows):
+    result = benchmark(cli.transform_item_list, workflows, True, 'workflows')
+    assert len(result) == WORKFLOWS
+
+def test_list_jobs(benchmark, jobs):
+    transformed = [cli.transform_job(job, False) for job in jobs]
+    benchmark(_quiet, cli.list_jobs, transformed)
+
+def test_list_workflows(benchmark, workflows):
+    transformed = [cli.transform_workflow(workflow, False) for workflow in workflows]
+    benchmark(_quiet, cli.list_workflows, transformed)
+
+def test_handle_multiline_commands(benchmark):
+    def setup():
+        job = {'tasks': [{'image': 'centos:7', 'cmd': '\n'.join('echo %d' % line for line in range(10000))},
+                         {'image': 'centos:7', 'cmd': '#!/bin/bash\n' + 'echo line\n'*10000}]}
+        return (job,), {}
+
+    job = benchmark.pedantic(cli.handle_multiline_commands, setup=setup, rounds=20)
+    assert len(job['tasks']) == 10001
+
+def test_load_input_files(benchmark, tmp_path):
+    filenames = []
+    for index in range(200):
+        filename = tmp_path / ('input%d.txt' % index)
+        filename.write_bytes(b'x'*(index*1000))
+        filenames.append('file://%s' % filename)
+
+    def setup():
+        return ({'inputs': list(filenames)},), {}
+
+    job = benchmark.pedantic(cli.load_input_files, setup=setup, rounds=20)
+    assert len(job['inputs']) == 200
@@ -0,0 +1,56 @@
+"""
+Benchmarks for the CPU cost of building workflow descriptions and calculating checksums in the
+Python client
+
+Run using pytest-benchmark from the top-level directory; the results are saved in benchmarks/results
+so that they can be compared between releases:
+
+    python -m pytest benchmarks
+"""
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from prominence import Dependency, Job, ProminenceClient, Resources, Task, Workflow
+from prominence.client import calculate_sha256
+
+# Number of jobs in the workflow
+JOBS = 5000
+
+# Size of the file checksummed
+FILE_SIZE = 64*1024*1024
+
+@pytest.fixture(scope='module')
+def workflow():
+    client = ProminenceClient()
+    workflow = Workflow(client=client)
+    workflow.name = 'benchmark'
+    previous = None
+    for index in range(JOBS):
+        task = Task()
+        task.image = 'centos:7'
+        task.command = 'python run.py --index %d' % index
+        job = Job(client=client)
+        job.name = 'job%d' % index
+        job.tasks.append(task)
+        job.resources = Resources(cpus=2, memory=4)
+        workflow.jobs.append(job)
+        if previous:
+            workflow.dependencies.append(Dependency(previous, [job]))
+        previous = job
+    return workflow
+
+def test_workflow_to_dict(benchmark, workflow):
+    data = benchmark(workflow.to_dict)
+    assert len(data['jobs']) == JOBS
+
+def test_calculate_sha256(benchmark, tmp_path):
+    filename = tmp_path / 'data'
+    with open(str(filename), 'wb') as fh:
+        for _ in range(FILE_SIZE//(1024*1024)):
+            fh.write(b'x'*1024*1024)
+
+    benchmark.extra_info['bytes'] = FILE_SIZE
+    benchmark.pedantic(calculate_sha256, args=(str(filename),), rounds=5)
+    if benchmark.stats:
+        benchmark.extra_info['MB/s'] = FILE_SIZE/benchmark.stats.stats.mean/1e6
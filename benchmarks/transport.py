@@ -0,0 +1,86 @@
+"""
+Compare transports for many concurrent job status calls
+
+By default a local HTTP server which responds after a fixed delay is used. Over plain HTTP httpx
+cannot negotiate HTTP/2, so to measure multiplexing use --url with a PROMINENCE server over HTTPS
+(a valid token is required) and --job with the id of an existing job.
+"""
+from __future__ import print_function
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import time
+
+from prominence import ProminenceClient
+from prominence.transport import TRANSPORTS, create_transport
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Respond to every request with a running job
+    """
+    delay = 0.02
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps([{'id': int(self.path.split('/')[-1]), 'status': 'running', 'events': {}}]).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def run(name, url, job, calls, concurrency, authenticated):
+    """
+    Time describe_job calls using the specified transport, returning calls/s and latency percentiles
+    """
+    os.environ['PROMINENCE_URL'] = url
+    client = ProminenceClient(authenticated=authenticated, session=create_transport(name, concurrency))
+
+    def describe(index):
+        start = time.time()
+        client.describe_job(job or index + 1)
+        return time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        latencies = sorted(executor.map(describe, range(calls)))
+    duration = time.time() - start
+    client.close()
+
+    return (calls/duration, latencies[len(latencies)//2], latencies[int(len(latencies)*0.99)])
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare transports for concurrent job status calls')
+    parser.add_argument('--calls', type=int, default=1000, help='Number of status calls')
+    parser.add_argument('--concurrency', type=int, default=100, help='Number of concurrent calls')
+    parser.add_argument('--delay', type=float, default=0.02, help='Response delay of the local server')
+    parser.add_argument('--url', help='URL of a PROMINENCE server instead of the local server')
+    parser.add_argument('--job', type=int, help='Id of a job to describe when using --url')
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        Handler.delay = args.delay
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d/v1' % server.server_address[1]
+
+    print('%-10s %10s %10s %10s' % ('Transport', 'Calls/s', 'p50 (ms)', 'p99 (ms)'))
+    for name in TRANSPORTS:
+        try:
+            rate, p50, p99 = run(name, url, args.job, args.calls, args.concurrency, bool(args.url))
+        except ImportError as err:
+            print('%-10s skipped: %s' % (name, err))
+            continue
+        print('%-10s %10.1f %10.1f %10.1f' % (name, rate, p50*1000, p99*1000))
+
+if __name__ == '__main__':
+    main()
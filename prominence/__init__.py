@@ -1,13 +1,42 @@
-from prominence.client import ProminenceClient
-from prominence.resources import Resources
-from prominence.policies import JobPolicies, WorkflowPolicies
-from prominence.task import Task
-from prominence.inputfile import InputFile
-from prominence.artifact import Artifact
-from prominence.job import Job
-from prominence.workflow import Workflow
-from prominence.notification import Notification
-from prominence.dependency import Dependency
-from prominence.factory import ParameterSweep, Zip, Repeat, ParameterSet
+import importlib
 
 __version__ = '0.21.0'
+
+# Public classes and functions, and the modules which provide them. Modules are only imported when
+# one of their names is first used so that importing the package, e.g. by the CLI, is fast.
+_exports = {
+    'ProminenceClient': 'prominence.client',
+    'AsyncProminenceClient': 'prominence.async_client',
+    'Resources': 'prominence.resources',
+    'JobPolicies': 'prominence.policies',
+    'WorkflowPolicies': 'prominence.policies',
+    'Task': 'prominence.task',
+    'InputFile': 'prominence.inputfile',
+    'Artifact': 'prominence.artifact',
+    'Job': 'prominence.job',
+    'Workflow': 'prominence.workflow',
+    'JobGroup': 'prominence.group',
+    'wait_all': 'prominence.group',
+    'as_completed': 'prominence.group',
+    'FIRST_COMPLETED': 'prominence.group',
+    'ALL_COMPLETED': 'prominence.group',
+    'Notification': 'prominence.notification',
+    'Listener': 'prominence.listener',
+    'Dependency': 'prominence.dependency',
+    'ParameterSweep': 'prominence.factory',
+    'Zip': 'prominence.factory',
+    'Repeat': 'prominence.factory',
+    'ParameterSet': 'prominence.factory',
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name in _exports:
+        value = getattr(importlib.import_module(_exports[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module 'prominence' has no attribute '%s'" % name)
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
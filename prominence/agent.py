@@ -0,0 +1,271 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from prominence import exceptions
+
+__all__ = ['Agent', 'AgentClient', 'connect', 'socket_path']
+
+# Client methods which can be answered by the agent. Only methods which do not change anything are
+# forwarded, so that identical concurrent requests can safely be coalesced.
+FORWARDED = ('list_jobs', 'list_workflows', 'describe_job', 'describe_workflow', 'stdout_job', 'stdout_workflow',
+             'stdout_generic', 'stderr_job', 'stderr_workflow', 'stderr_generic')
+
+# Maximum number of results kept in memory
+MAX_RESULTS = 1000
+
+def socket_path(url=None):
+    """
+    Return the path of the agent socket, which is different for each server
+    """
+    if 'PROMINENCE_AGENT_SOCKET' in os.environ:
+        return os.environ['PROMINENCE_AGENT_SOCKET']
+    suffix = ''
+    if url:
+        suffix = '-%s' % hashlib.sha1(url.rstrip('/').encode('utf-8')).hexdigest()[:16]
+    return os.path.expanduser('~/.prominence/agent%s.sock' % suffix)
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+def _receive(sock):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise IOError('connection closed by agent')
+        data += chunk
+    return json.loads(data.decode('utf-8'))
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Handle a single request from a client
+    """
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            method, args, kwargs = request['method'], request.get('args', []), request.get('kwargs', {})
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            response = {'error': {'type': 'ProminenceError', 'message': 'Invalid request to agent: %s' % err}}
+        else:
+            try:
+                response = {'result': self.server.agent.dispatch(method, args, kwargs)}
+            except exceptions.ProminenceError as err:
+                response = {'error': {'type': type(err).__name__, 'message': str(err)}}
+            except Exception as err:
+                response = {'error': {'type': 'ProminenceError', 'message': 'Error in agent: %s' % err}}
+        try:
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        except (IOError, OSError):
+            pass
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class Agent(object):
+    """
+    Local agent holding an authenticated client, with its connection pool and caches, which answers
+    requests from CLI processes over a Unix domain socket. Identical concurrent requests are coalesced
+    into a single request to the server, and results are reused for ttl seconds.
+    """
+    def __init__(self, client=None, path=None, ttl=1.0):
+        if not client:
+            from prominence.client import ProminenceClient
+            client = ProminenceClient(authenticated=True, cache=True)
+        self._client = client
+        self._path = path or socket_path(client._url)
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._results = OrderedDict()
+        self._server = None
+        self._start = time.time()
+        self.requests = 0
+        self.upstream = 0
+        self.coalesced = 0
+
+    def dispatch(self, method, args, kwargs):
+        """
+        Handle a request
+        """
+        if method == 'status':
+            return {'pid': os.getpid(),
+                    'url': self._client._url,
+                    'uptime': time.time() - self._start,
+                    'requests': self.requests,
+                    'upstream': self.upstream,
+                    'coalesced': self.coalesced}
+        elif method == 'stop':
+            threading.Thread(target=self._server.shutdown).start()
+            return True
+        elif method not in FORWARDED:
+            raise exceptions.ProminenceError('Method %s cannot be used via the agent' % method)
+
+        key = json.dumps([method, args, kwargs], sort_keys=True)
+        with self._lock:
+            self.requests += 1
+            entry = self._results.get(key)
+            if entry and time.time() - entry[0] < self._ttl:
+                return entry[1]
+
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.upstream += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            # Whatever happens the request must be resolved, otherwise identical requests wait forever
+            try:
+                result = getattr(self._client, method)(*args, **kwargs)
+            except BaseException as err:
+                with self._lock:
+                    del self._inflight[key]
+                future.set_exception(err)
+            else:
+                with self._lock:
+                    del self._inflight[key]
+                    self._results[key] = (time.time(), result)
+                    self._results.move_to_end(key)
+                    while len(self._results) > MAX_RESULTS:
+                        self._results.popitem(last=False)
+                future.set_result(result)
+
+        return future.result()
+
+    def serve(self):
+        """
+        Listen for requests until stopped
+        """
+        if os.path.exists(self._path):
+            if connect(self._path):
+                raise exceptions.ProminenceError('An agent is already running using %s' % self._path)
+            os.unlink(self._path)
+
+        directory = os.path.dirname(self._path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Only the current user can connect to the socket
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self._path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.agent = self
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self._path):
+                os.unlink(self._path)
+            self._client.close()
+
+    def stop(self):
+        """
+        Stop listening for requests
+        """
+        if self._server:
+            self._server.shutdown()
+
+class AgentClient(object):
+    """
+    Client which forwards requests to a running agent. Methods which cannot be answered by the agent
+    are not available.
+    """
+    def __init__(self, path=None, timeout=300):
+        self._path = path or socket_path()
+        self._timeout = timeout
+
+    def _call(self, method, *args, **kwargs):
+        """
+        Send a request to the agent and return the result
+        """
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            try:
+                sock.connect(self._path)
+                _send(sock, {'method': method, 'args': args, 'kwargs': kwargs})
+                response = _receive(sock)
+            finally:
+                sock.close()
+        except (IOError, OSError, ValueError) as err:
+            raise exceptions.ConnectionError('Unable to communicate with the agent: %s' % err)
+
+        if 'error' in response:
+            raise getattr(exceptions, response['error']['type'], exceptions.ProminenceError)(response['error']['message'])
+        return response['result']
+
+    def __getattr__(self, name):
+        if name in FORWARDED:
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def iter_jobs(self, status=None, num=1, constraint=None, name_constraint=None, workflow_id=None, detail=False,
+                  page_size=None, **kwargs):
+        """
+        Iterate over running/idle jobs or completed jobs
+        """
+        return iter(self._call('list_jobs', status, num, constraint, name_constraint, workflow_id, detail, **kwargs))
+
+    def iter_workflows(self, status=None, num=1, constraint=None, name_constraint=None, page_size=None, **kwargs):
+        """
+        Iterate over running/idle workflows or completed workflows
+        """
+        return iter(self._call('list_workflows', status, num, constraint, name_constraint, **kwargs))
+
+    def status(self):
+        """
+        Return the status of the agent
+        """
+        return self._call('status')
+
+    def stop(self):
+        """
+        Stop the agent
+        """
+        return self._call('stop')
+
+    def close(self):
+        pass
+
+def connect(path=None, url=None):
+    """
+    Return a client for the agent if it is running, otherwise None. If url is specified None is also
+    returned if the agent is using a different server.
+    """
+    path = path or socket_path(url)
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(1)
+    try:
+        sock.connect(path)
+    except (IOError, OSError):
+        return None
+    finally:
+        sock.close()
+
+    client = AgentClient(path)
+    if url:
+        try:
+            if client.status().get('url', '').rstrip('/') != url.rstrip('/'):
+                return None
+        except exceptions.ProminenceError:
+            return None
+    return client
@@ -4,7 +4,8 @@ class Artifact(object):
     """
     Artifact
     """
-    def __init__(self, name, directory_name=None, mount_point=None):
+    def __init__(self, name, directory_name=None, mount_point=None, client=None):
+        self._client = client
         self._name = name
         self._directory_name = directory_name
         self._mount_point = mount_point
@@ -13,8 +14,9 @@ class Artifact(object):
         """
         Upload file
         """
-        client = ProminenceClient(authenticated=True)
-        client.upload(self._name, filename)
+        if not self._client:
+            self._client = ProminenceClient(authenticated=True)
+        self._client.upload(self._name, filename)
 
     def to_dict(self):
         """
@@ -0,0 +1,317 @@
+import asyncio
+import functools
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from prominence import exceptions
+from prominence.client import PAGE_SIZE, ProminenceClient
+
+__all__ = ['AsyncProminenceClient']
+
+class AsyncProminenceClient(object):
+    """
+    PROMINENCE asyncio client class
+
+    Each method runs the equivalent ProminenceClient method in a thread pool which shares a single
+    HTTP connection pool, so the same exceptions are raised as for the blocking client. At most
+    `concurrency` requests are in flight at once.
+    """
+    def __init__(self, authenticated=False, timeout=150, concurrency=100, client=None, **kwargs):
+        self._owns_client = client is None
+        if client:
+            self._client = client
+        else:
+            self._client = ProminenceClient(authenticated=authenticated,
+                                            timeout=timeout,
+                                            pool_size=concurrency,
+                                            **kwargs)
+        self._concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def client(self):
+        """
+        Return the underlying blocking client
+        """
+        return self._client
+
+    async def _run(self, function, *args, **kwargs):
+        """
+        Run a blocking function in the thread pool
+        """
+        # The semaphore is created lazily so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def _call(self, method, *args, **kwargs):
+        """
+        Run a blocking client method in the thread pool
+        """
+        return await self._run(getattr(self._client, method), *args, **kwargs)
+
+    async def _iterate(self, iterator, size):
+        """
+        Iterate over a blocking iterator, advancing it in the thread pool up to size items at a time
+        """
+        while True:
+            items = await self._run(lambda: list(itertools.islice(iterator, size)))
+            if not items:
+                return
+            for item in items:
+                yield item
+
+    async def close(self):
+        """
+        Shutdown the thread pool and close all pooled connections unless the blocking client was supplied
+        """
+        # Wait for running requests without blocking the event loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+        if self._owns_client:
+            self._client.close()
+
+    async def authenticate_user(self):
+        """
+        Obtain token from OIDC provider
+        """
+        return await self._call('authenticate_user')
+
+    async def list_jobs(self, status=None, num=1, constraint=None, name_constraint=None, workflow_id=None, detail=False,
+                        fields=None, statuses=None, created_after=None, created_before=None, labels=None):
+        """
+        List running/idle jobs or completed jobs, optionally with only the specified fields and filtered
+        """
+        return await self._call('list_jobs', status, num, constraint, name_constraint, workflow_id, detail,
+                                fields, statuses, created_after, created_before, labels)
+
+    async def list_workflows(self, status=None, num=1, constraint=None, name_constraint=None, fields=None,
+                             statuses=None, created_after=None, created_before=None, labels=None):
+        """
+        List running/idle workflows or completed workflows, optionally with only the specified fields and filtered
+        """
+        return await self._call('list_workflows', status, num, constraint, name_constraint, fields, statuses,
+                                created_after, created_before, labels)
+
+    async def iter_jobs(self, status=None, num=1, constraint=None, name_constraint=None, workflow_id=None,
+                        detail=False, page_size=PAGE_SIZE, fields=None, statuses=None, created_after=None,
+                        created_before=None, labels=None):
+        """
+        Iterate over running/idle jobs or completed jobs, fetching them in pages
+        """
+        iterator = await self._call('iter_jobs', status, num, constraint, name_constraint, workflow_id, detail,
+                                    page_size, fields, statuses, created_after, created_before, labels)
+        async for job in self._iterate(iterator, page_size):
+            yield job
+
+    async def iter_workflows(self, status=None, num=1, constraint=None, name_constraint=None, page_size=PAGE_SIZE,
+                             fields=None, statuses=None, created_after=None, created_before=None, labels=None):
+        """
+        Iterate over running/idle workflows or completed workflows, fetching them in pages
+        """
+        iterator = await self._call('iter_workflows', status, num, constraint, name_constraint, page_size, fields,
+                                    statuses, created_after, created_before, labels)
+        async for workflow in self._iterate(iterator, page_size):
+            yield workflow
+
+    async def execute_command(self, job_id, command):
+        """
+        Execute a command inside a job
+        """
+        return await self._call('execute_command', job_id, command)
+
+    async def get_snapshot_url(self, job_id):
+        """
+        Get the URL of the current snapshot
+        """
+        return await self._call('get_snapshot_url', job_id)
+
+    async def create_snapshot(self, job_id, path):
+        """
+        Create a snapshot of a file or directory in a running job
+        """
+        return await self._call('create_snapshot', job_id, path)
+
+    async def create_job(self, job):
+        """
+        Create a job from a JSON description
+        """
+        return await self._call('create_job', job)
+
+    async def create_jobs(self, jobs, rate=None):
+        """
+        Create jobs from an iterable of JSON descriptions concurrently, optionally limiting the
+        number of submissions per second. Returns a list of (id, error) in the original order.
+        """
+        async def create(job, delay):
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                return (await self.create_job(job), None)
+            except exceptions.ProminenceError as err:
+                return (None, err)
+
+        interval = 0
+        if rate:
+            interval = 1.0/rate
+        return await asyncio.gather(*[create(job, index*interval) for index, job in enumerate(jobs)])
+
+    async def create_workflow(self, workflow):
+        """
+        Create a workflow from a JSON description
+        """
+        return await self._call('create_workflow', workflow)
+
+    async def rerun(self, resource_id):
+        """
+        Rerun any failed jobs from a completed workflow
+        """
+        return await self._call('rerun', resource_id)
+
+    async def clone(self, resource_type, resource_id):
+        """
+        Clone a job or workflow
+        """
+        return await self._call('clone', resource_type, resource_id)
+
+    async def remove(self, resource_type, resource_id):
+        """
+        Remove a completed job or workflow from the queue
+        """
+        return await self._call('remove', resource_type, resource_id)
+
+    async def delete_job(self, job_id):
+        """
+        Delete the specified job
+        """
+        return await self._call('delete_job', job_id)
+
+    async def delete_workflow(self, workflow_id):
+        """
+        Delete the specified workflow
+        """
+        return await self._call('delete_workflow', workflow_id)
+
+    async def delete_generic(self, id, resource):
+        """
+        Delete the specified job or workflow
+        """
+        return await self._call('delete_generic', id, resource)
+
+    async def describe_job(self, job_id, input_only=False, fields=None):
+        """
+        Describe a specific job
+        """
+        return await self._call('describe_job', job_id, input_only, fields)
+
+    async def describe_workflow(self, workflow_id, input_only=False, fields=None):
+        """
+        Describe a specific workflow
+        """
+        return await self._call('describe_workflow', workflow_id, input_only, fields)
+
+    async def stdout_job(self, job_id, node, offset=0):
+        """
+        Get standard output from a job
+        """
+        return await self._call('stdout_job', job_id, node, offset=offset)
+
+    async def stdout_workflow(self, job_id, job, node, instance=-1, offset=0):
+        """
+        Get standard output from a workflow
+        """
+        return await self._call('stdout_workflow', job_id, job, node, instance, offset=offset)
+
+    async def stdout_generic(self, type, id, node, job=None, instance=-1, offset=0):
+        """
+        Get standard output from a job or workflow
+        """
+        return await self._call('stdout_generic', type, id, node, job, instance, offset=offset)
+
+    async def stderr_job(self, job_id, node, offset=0):
+        """
+        Get standard error from a job
+        """
+        return await self._call('stderr_job', job_id, node, offset=offset)
+
+    async def stderr_workflow(self, job_id, node, job, instance=-1, offset=0):
+        """
+        Get standard error from a workflow
+        """
+        return await self._call('stderr_workflow', job_id, node, job, instance, offset=offset)
+
+    async def stderr_generic(self, type, id, node, job=None, instance=-1, offset=0):
+        """
+        Get standard error from a job
+        """
+        return await self._call('stderr_generic', type, id, node, job, instance, offset=offset)
+
+    async def upload(self, file, filename, checksum=None, concurrency=4):
+        """
+        Upload a file to transient cloud storage
+        """
+        return await self._call('upload', file, filename, checksum, concurrency)
+
+    async def upload_content(self, filename, checksum=None, suffix=''):
+        """
+        Upload a file to transient cloud storage using a name derived from its content, returning the name
+        """
+        return await self._call('upload_content', filename, checksum, suffix)
+
+    async def list_objects(self, path):
+        """
+        List objects in cloud storage
+        """
+        return await self._call('list_objects', path)
+
+    async def delete_object(self, object):
+        """
+        Delete an object in cloud storage
+        """
+        return await self._call('delete_object', object)
+
+    async def get_usage(self, start_date, end_date, by_group, show_all_users):
+        """
+        Return historical usage
+        """
+        return await self._call('get_usage', start_date, end_date, by_group, show_all_users)
+
+    async def resources(self):
+        """
+        List resources
+        """
+        return await self._call('resources')
+
+    async def kv_list(self, path=None):
+        """
+        Return a list of keys
+        """
+        return await self._call('kv_list', path)
+
+    async def kv_get(self, key):
+        """
+        Get the value of the specified key
+        """
+        return await self._call('kv_get', key)
+
+    async def kv_set(self, key, value):
+        """
+        Set the specified key
+        """
+        return await self._call('kv_set', key, value)
+
+    async def kv_delete(self, key, prefix):
+        """
+        Delete the specified key
+        """
+        return await self._call('kv_delete', key, prefix)
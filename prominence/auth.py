@@ -3,11 +3,13 @@ import errno
 import json
 import jwt
 import os
+import threading
 import time
 import uuid
 import requests
 
 from prominence import exceptions
+from prominence.transport import create_transport
 
 DEFAULT_PROMINENCE_OIDC_URL = 'https://host-130-246-215-158.nubes.stfc.ac.uk'
 
@@ -21,10 +23,13 @@ def create_config_dir():
     except IOError as err:
         raise exceptions.IOError(err)
 
-def register_client():
+def register_client(session=None):
     """
     Obtain a client id and secret from the OIDC provider
     """
+    if not session:
+        session = create_transport(retries=0)
+
     if os.path.isfile(os.path.expanduser('~/.prominence/client')):
         return True
 
@@ -44,7 +49,7 @@ def register_client():
 
     # Create OIDC client
     try:
-        response = requests.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/register',
+        response = session.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/register',
                                  data=json.dumps(data),
                                  timeout=10,
                                  headers=headers,
@@ -56,7 +61,7 @@ def register_client():
         try:
             with open(os.path.expanduser('~/.prominence/client'), 'w') as client_file:
                 json.dump(response.json(), client_file)
-            os.chmod(os.path.expanduser('~/.prominence/client'), 384)
+            os.chmod(os.path.expanduser('~/.prominence/client'), 0o600)
         except IOError as err:
             raise exceptions.ClientRegistrationError(err)
 
@@ -65,10 +70,13 @@ def register_client():
     
     raise exceptions.ClientRegistrationError('Client registration failed with status code %d' % response.status_code)
 
-def authenticate_user(create_client_if_needed=True, token_in_file=True):
+def authenticate_user(create_client_if_needed=True, token_in_file=True, session=None):
     """
     Obtain token from OIDC provider
     """
+    if not session:
+        session = create_transport(retries=0)
+
     # Create .prominence directory if necessary: this is done automatically if the user registers as a client, but for
     # the case of reading the client credentials from environment variables this step will be missed
     create_config_dir()
@@ -80,7 +88,7 @@ def authenticate_user(create_client_if_needed=True, token_in_file=True):
 
     if not client_id:
         if create_client_if_needed:
-            if register_client():
+            if register_client(session):
                 (client_id, client_secret) = get_client()
                 if not client_id:
                     raise exceptions.ClientCredentialsError('Unable to get a client id and client secret')
@@ -94,7 +102,7 @@ def authenticate_user(create_client_if_needed=True, token_in_file=True):
     data['client_id'] = client_id
 
     try:
-        response = requests.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/devicecode',
+        response = session.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/devicecode',
                                  data=data,
                                  timeout=10,
                                  auth=(client_id, client_secret),
@@ -119,7 +127,7 @@ def authenticate_user(create_client_if_needed=True, token_in_file=True):
     while time.time() < current_time + int(device_code_response['expires_in']) and not authenticated:
         time.sleep(5)
         try:
-            response = requests.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/token',
+            response = session.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/token',
                                      data=data,
                                      timeout=10,
                                      auth=(client_id, client_secret),
@@ -133,7 +141,7 @@ def authenticate_user(create_client_if_needed=True, token_in_file=True):
                 try:
                     with open(os.path.expanduser('~/.prominence/token'), 'w') as token_file:
                         json.dump(response.json(), token_file)
-                    os.chmod(os.path.expanduser('~/.prominence/token'), 384)
+                    os.chmod(os.path.expanduser('~/.prominence/token'), 0o600)
                 except IOError:
                     raise exceptions.AuthenticationError('Unable to write to ~/.prominence/token')
             else:
@@ -166,25 +174,7 @@ def get_token():
     """
     Load saved token
     """
-    if 'PROMINENCE_TOKEN' in os.environ:
-        return os.environ['PROMINENCE_TOKEN']
-
-    if os.path.isfile(os.path.expanduser('~/.prominence/token')):
-        try:
-            # token file is JSON
-            with open(os.path.expanduser('~/.prominence/token')) as fh:
-                data = json.load(fh)
-        except:
-            # token file is not JSON
-            with open(os.path.expanduser('~/.prominence/token')) as fh:
-                return fh.read()
-
-        if 'access_token' in data:
-            return data['access_token']
-        else:
-            raise exceptions.TokenError('The saved token file does not contain access_token')
-
-    raise exceptions.TokenError('Unable to find token in either the file ~/.prominence/token or environment variable PROMINENCE_TOKEN')
+    return get_token_manager().get(check_expiry=False)
 
 def get_expiry(token):
     """
@@ -196,3 +186,136 @@ def get_expiry(token):
     except:
         pass
     return expiry
+
+class TokenManager(object):
+    """
+    Cache of the access token shared by all clients in a process. The token file is only read again
+    if its modification time changes, and if it contains a refresh token the access token is refreshed
+    using the OIDC token endpoint shortly before it expires. Refreshes are attempted at most once
+    every refresh_interval seconds, so a failing token endpoint is not contacted on every request.
+    """
+    def __init__(self, refresh_margin=300, session=None, refresh_interval=60):
+        self._refresh_margin = refresh_margin
+        self._refresh_interval = refresh_interval
+        self._last_refresh = 0
+        self._session = session
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._data = {}
+        self._expiry = 0
+        self._env_token = None
+
+    @staticmethod
+    def _filename():
+        return os.path.expanduser('~/.prominence/token')
+
+    def _load(self):
+        """
+        Read the token file if it has changed
+        """
+        try:
+            mtime = os.stat(self._filename()).st_mtime_ns
+        except OSError:
+            self._mtime = None
+            self._data = {}
+            raise exceptions.TokenError('Unable to find token in either the file ~/.prominence/token or environment variable PROMINENCE_TOKEN')
+
+        if mtime == self._mtime:
+            return
+
+        with open(self._filename()) as fh:
+            content = fh.read()
+        try:
+            # token file is JSON
+            data = json.loads(content)
+        except ValueError:
+            # token file is not JSON
+            data = {'access_token': content}
+
+        if not isinstance(data, dict) or 'access_token' not in data:
+            raise exceptions.TokenError('The saved token file does not contain access_token')
+
+        self._data = data
+        self._expiry = get_expiry(data['access_token'])
+        self._mtime = mtime
+
+    def _refresh(self):
+        """
+        Obtain a new access token using the refresh token and save it
+        """
+        (client_id, client_secret) = get_client()
+        session = self._session
+        if not session:
+            session = create_transport(retries=0)
+
+        data = {}
+        data['grant_type'] = 'refresh_token'
+        data['refresh_token'] = self._data['refresh_token']
+
+        try:
+            response = session.post(os.environ.get('PROMINENCE_OIDC_URL', DEFAULT_PROMINENCE_OIDC_URL)+'/token',
+                                    data=data,
+                                    timeout=10,
+                                    auth=(client_id, client_secret),
+                                    allow_redirects=True)
+        except requests.exceptions.RequestException as err:
+            raise exceptions.TokenError('Unable to refresh token: %s' % err)
+
+        if response.status_code != 200:
+            raise exceptions.TokenError('Unable to refresh token: got status code %d' % response.status_code)
+
+        try:
+            result = response.json()
+            token = dict(self._data)
+            token.update(result)
+            expiry = get_expiry(token['access_token'])
+        except (ValueError, TypeError, KeyError) as err:
+            raise exceptions.TokenError('Unable to refresh token: invalid response: %s' % err)
+
+        try:
+            with open('%s.tmp' % self._filename(), 'w') as token_file:
+                json.dump(token, token_file)
+            os.chmod('%s.tmp' % self._filename(), 0o600)
+            os.replace('%s.tmp' % self._filename(), self._filename())
+        except (IOError, OSError) as err:
+            raise exceptions.TokenError('Unable to write to ~/.prominence/token: %s' % err)
+
+        self._data = token
+        self._expiry = expiry
+        self._mtime = os.stat(self._filename()).st_mtime_ns
+
+    def get(self, check_expiry=True):
+        """
+        Return the access token, refreshing it first if it will expire soon
+        """
+        with self._lock:
+            if 'PROMINENCE_TOKEN' in os.environ:
+                token = os.environ['PROMINENCE_TOKEN']
+                if token != self._env_token:
+                    self._env_token = token
+                    self._env_expiry = get_expiry(token)
+                expiry = self._env_expiry
+            else:
+                self._load()
+                if self._data.get('refresh_token') and self._expiry - time.time() < self._refresh_margin and \
+                   time.time() - self._last_refresh >= self._refresh_interval:
+                    self._last_refresh = time.time()
+                    try:
+                        self._refresh()
+                    except (exceptions.TokenError, exceptions.ClientCredentialsError):
+                        # The current token can still be used until it expires
+                        pass
+                token = self._data['access_token']
+                expiry = self._expiry
+
+        if check_expiry and time.time() - expiry > 0:
+            raise exceptions.TokenExpiredError('Token has expired')
+        return token
+
+_token_manager = TokenManager()
+
+def get_token_manager():
+    """
+    Return the token manager shared by all clients
+    """
+    return _token_manager
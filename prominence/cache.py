@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+__all__ = ['StateCache', 'TERMINAL_STATES']
+
+TERMINAL_STATES = ('completed', 'failed', 'deleted', 'killed')
+
+class StateCache(object):
+    """
+    On-disk cache of job and workflow descriptions keyed by id. Records in a terminal state never
+    change, so once cached they are frozen and never need to be fetched from the server again.
+    Ids are only unique for a server, so by default there is a separate database for each URL.
+    """
+    def __init__(self, filename=None, url=None):
+        if not filename:
+            suffix = ''
+            if url:
+                suffix = '-%s' % hashlib.sha1(url.rstrip('/').encode('utf-8')).hexdigest()[:16]
+            filename = os.path.expanduser('~/.prominence/cache%s.db' % suffix)
+        self._filename = filename
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Open the database, creating it if necessary
+        """
+        if self._db is None:
+            directory = os.path.dirname(self._filename)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self._db = sqlite3.connect(self._filename, timeout=10, check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS records (resource TEXT NOT NULL, '
+                             'id INTEGER NOT NULL, status TEXT, detail INTEGER NOT NULL, data TEXT NOT NULL, '
+                             'updated REAL NOT NULL, PRIMARY KEY (resource, id))')
+            self._db.commit()
+            os.chmod(self._filename, 0o600)
+        return self._db
+
+    def get(self, resource, id, detail=False):
+        """
+        Return a cached job or workflow, or None. If detail is True only a record obtained with
+        full details will be returned.
+        """
+        with self._lock:
+            try:
+                row = self._connect().execute('SELECT data, detail FROM records WHERE resource=? AND id=?',
+                                              (resource, id)).fetchone()
+            except sqlite3.Error:
+                return None
+
+        if row and (row[1] or not detail):
+            return json.loads(row[0])
+        return None
+
+    def get_frozen(self, resource, id, detail=False):
+        """
+        Return a cached job or workflow only if it is in a terminal state
+        """
+        data = self.get(resource, id, detail)
+        if data and data.get('status') in TERMINAL_STATES:
+            return data
+        return None
+
+    def put(self, resource, item, detail=False):
+        """
+        Add or update a job or workflow
+        """
+        self.put_many(resource, [item], detail)
+
+    def put_many(self, resource, items, detail=False):
+        """
+        Add or update a list of jobs or workflows. Frozen records are only replaced by records
+        with more detail.
+        """
+        now = time.time()
+        rows = [(resource, item['id'], item.get('status'), int(detail), json.dumps(item), now)
+                for item in items if 'id' in item]
+
+        with self._lock:
+            try:
+                db = self._connect()
+                db.executemany('INSERT INTO records (resource, id, status, detail, data, updated) '
+                               'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (resource, id) DO UPDATE SET '
+                               'status=excluded.status, detail=excluded.detail, data=excluded.data, '
+                               'updated=excluded.updated WHERE records.status NOT IN (%s) '
+                               'OR excluded.detail > records.detail' % ','.join(['?']*len(TERMINAL_STATES)),
+                               [row + TERMINAL_STATES for row in rows])
+                db.commit()
+            except sqlite3.Error:
+                pass
+
+    def invalidate(self, resource, id):
+        """
+        Remove a job or workflow from the cache
+        """
+        with self._lock:
+            try:
+                db = self._connect()
+                db.execute('DELETE FROM records WHERE resource=? AND id=?', (resource, id))
+                db.commit()
+            except sqlite3.Error:
+                pass
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,8 +1,8 @@
 from __future__ import print_function
 import argparse
+import atexit
 import base64
 from collections import OrderedDict
-from concurrent.futures import ProcessPoolExecutor, as_completed
 import errno
 import json
 import os
@@ -12,16 +12,22 @@ import shutil
 from string import Template
 import sys
 import time
-import requests
-import yaml
-import uuid
 
-from prominence import auth
+import prominence
 from prominence import exceptions
 from prominence import __version__
-from prominence import ProminenceClient
+from prominence import profile
+from prominence import render
+from prominence.render import datetime_format, elapsed, image_name
+from prominence.lazy import lazy_import
 
-CMD_MAX_WIDTH = 100
+# Modules which are slow to import are only loaded when used by the command being run
+requests = lazy_import('requests')
+yaml = lazy_import('yaml')
+uuid = lazy_import('uuid')
+
+# Number of rows used to determine column widths when listing jobs and workflows
+LIST_LOOKAHEAD = 500
 
 def load_input_files(job):
     """
@@ -81,28 +87,6 @@ def handle_multiline_commands(job):
     job['tasks'] = new_tasks
     return job
 
-def elapsed(job):
-    """
-    Print elapsed job runtime in a nice way
-    """
-    if 'startTime' in job['events']:
-        if 'endTime' in job['events']:
-            elapsed_time = job['events']['endTime'] - job['events']['startTime']
-        else:
-            elapsed_time = time.time() - job['events']['startTime']
-        days = int(elapsed_time/86400)
-        time_fmt = '%H:%M:%S'
-        return '%d+%s' % (days, time.strftime(time_fmt, time.gmtime(elapsed_time)))
-
-    return ''
-
-def datetime_format(epoch):
-    """
-    Convert a unix epoch in a formatted date/time string
-    """
-    datetime_fmt = '%Y-%m-%d %H:%M:%S'
-    return time.strftime(datetime_fmt, time.gmtime(epoch))
-
 def print_json(content, transform=False, detail=False, resource='job'):
     """
     Print JSON in a nice way
@@ -112,135 +96,22 @@ def print_json(content, transform=False, detail=False, resource='job'):
             content = transform_item_list(content, detail, resource)
         else:
             content = transform_item(content, detail, resource)
-    print(json.dumps(content, indent=2))
-
-def image_name(name):
-    """
-    Extract container image name for display purposes
-    """
-    if name.startswith('http'):
-        name = os.path.basename(name)
-        name = name[:name.find('?')]
-    return name
-
-def list_jobs(jobs):
-    """
-    Print list of jobs
-    """
-    width_id = 2
-    width_name = 4
-    width_created = 19
-    width_status = 6
-    width_elapsed = 10
-    width_container = 5
-    width_cmd = 3
-
-    for job in jobs:
-        my_cmd = ''
-        if 'cmd' in job['tasks'][0]:
-            my_cmd = job['tasks'][0]['cmd']
-        my_name = ''
-        if 'name' in job:
-            my_name = job['name']
-
-        width_id_current = len(str(job['id']))
-        width_name_current = len(my_name)
-        width_status_current = len(job['status'])
-        width_container_current = len(image_name(job['tasks'][0]['image']))
-        width_cmd_current = len(my_cmd)
-
-        if width_cmd_current > CMD_MAX_WIDTH:
-            width_cmd_current = CMD_MAX_WIDTH + 3
-            my_cmd = '%s...' % my_cmd[0:CMD_MAX_WIDTH]
-
-        if width_id_current > width_id:
-            width_id = width_id_current
-        if width_name_current > width_name:
-            width_name = width_name_current
-        if width_status_current > width_status:
-            width_status = width_status_current
-        if width_container_current > width_container:
-            width_container = width_container_current
-        if width_cmd_current > width_cmd:
-            width_cmd = width_cmd_current
-
-    print('%s   %s   %s   %s   %s   %s   %s' % ('ID'.ljust(width_id),
-                                                'NAME'.ljust(width_name),
-                                                'CREATED'.ljust(width_created),
-                                                'STATUS'.ljust(width_status),
-                                                'ELAPSED'.ljust(width_elapsed),
-                                                'IMAGE'.ljust(width_container),
-                                                'CMD'.ljust(width_cmd)))
-
-    for job in jobs:
-        my_cmd = ''
-        if 'cmd' in job['tasks'][0]:
-            my_cmd = job['tasks'][0]['cmd']
-            if len(my_cmd) > CMD_MAX_WIDTH:
-                my_cmd = '%s...' % my_cmd[0:CMD_MAX_WIDTH]
-        my_name = ''
-        if 'name' in job:
-            my_name = job['name']
-        print('%s   %s   %s   %s   %s   %s   %s' % (str(job['id']).ljust(width_id),
-                                                    my_name.ljust(width_name),
-                                                    datetime_format(job['events']['createTime']).ljust(width_created),
-                                                    job['status'].ljust(width_status),
-                                                    elapsed(job).ljust(width_elapsed),
-                                                    image_name(job['tasks'][0]['image']).ljust(width_container),
-                                                    my_cmd.ljust(width_cmd)))
-
-def list_workflows(workflows):
-    """
-    Print list of workflows
-    """
-    width_id = 2
-    width_name = 4
-    width_created = 19
-    width_status = 6
-    width_elapsed = 10
-    width_success = 8
-    width_failed = 8
-    width_total = 8
-
-    for workflow in workflows:
-        width_id_current = len(str(workflow['id']))
-        width_name_current = len(workflow['name'])
-        width_status_current = len(workflow['status'])
-        width_success_current = len('%d' % workflow['progress']['done'])
-        width_failed_current = len('%d' % workflow['progress']['failed'])
-        width_total_current = len('%d' % workflow['progress']['total'])
-
-        if width_id_current > width_id:
-            width_id = width_id_current
-        if width_name_current > width_name:
-            width_name = width_name_current
-        if width_status_current > width_status:
-            width_status = width_status_current
-        if width_success_current > width_success:
-            width_success = width_success_current
-        if width_failed_current > width_failed:
-            width_failed = width_failed_current
-        if width_total_current > width_total:
-            width_total = width_total_current
-
-    print('%s   %s   %s   %s   %s   %s   %s   %s' % ('ID'.ljust(width_id),
-                                                     'NAME'.ljust(width_name),
-                                                     'CREATED'.ljust(width_created),
-                                                     'STATUS'.ljust(width_status),
-                                                     'ELAPSED'.ljust(width_elapsed),
-                                                     'SUCCESS'.ljust(width_success),
-                                                     'FAILED'.ljust(width_failed),
-                                                     'TOTAL'.ljust(width_total)))
-
-    for workflow in workflows:
-        print('%s   %s   %s   %s   %s   %s   %s   %s' % (str(workflow['id']).ljust(width_id),
-                                                         workflow['name'].ljust(width_name),
-                                                         datetime_format(workflow['events']['createTime']).ljust(width_created),
-                                                         workflow['status'].ljust(width_status),
-                                                         elapsed(workflow).ljust(width_elapsed),
-                                                         ('%d' % workflow['progress']['done']).ljust(width_success),
-                                                         ('%d' % workflow['progress']['failed']).ljust(width_failed),
-                                                         ('%d' % workflow['progress']['total']).ljust(width_total)))
+    with profile.phase('render'):
+        print(json.dumps(content, indent=2))
+
+def list_jobs(jobs, columns=None):
+    """
+    Print list of jobs as they are received. Column widths are determined from the first jobs.
+    """
+    columns = render.parse_columns(columns or render.DEFAULT_JOB_COLUMNS, render.JOB_COLUMNS)
+    render.Table(columns, LIST_LOOKAHEAD, lambda job: int(job['id'])).render(jobs)
+
+def list_workflows(workflows, columns=None):
+    """
+    Print list of workflows as they are received. Column widths are determined from the first workflows.
+    """
+    columns = render.parse_columns(columns or render.DEFAULT_WORKFLOW_COLUMNS, render.WORKFLOW_COLUMNS)
+    render.Table(columns, LIST_LOOKAHEAD, lambda workflow: int(workflow['id'])).render(workflows)
 
 def transform_job(job, detail):
     """
@@ -406,17 +277,19 @@ def transform_item_list(result, detail, resource):
     """
     Transform a job/workflow list into the required format ordered by id
     """
-    if 'job' in resource:
-        items = [transform_job(job, detail) for job in result]
-    else:
-        items = [transform_workflow(workflow, detail) for workflow in result]
-    return sorted(items, key=lambda k: int(k['id']))
+    with profile.phase('transform'):
+        if 'job' in resource:
+            items = [transform_job(job, detail) for job in result]
+        else:
+            items = [transform_workflow(workflow, detail) for workflow in result]
+        return sorted(items, key=lambda k: int(k['id']))
 
 def command_register(args):
     """
     Obtain a client id and secret from the OIDC provider
     """
     try:
+        from prominence import auth
         auth.register_client()
     except exceptions.ClientRegistrationError as err:
         print('Error:', err)
@@ -427,6 +300,7 @@ def command_login(args):
     Obtain token from OIDC provider
     """
     try:
+        from prominence import auth
         if auth.authenticate_user(create_client_if_needed=False, token_in_file=True):
             print('Successfully retrieved token')
     except exceptions.ClientCredentialsError as err:
@@ -436,6 +310,211 @@ def command_login(args):
         print('Error:', err)
         exit(1)
 
+def agent_url():
+    """
+    Return the URL of the server used by the local agent
+    """
+    from prominence.client import DEFAULT_URL
+    return os.environ.get('PROMINENCE_URL', DEFAULT_URL)
+
+def get_client(**kwargs):
+    """
+    Return a client which forwards requests to the local agent if it is running and using the same
+    server, otherwise an authenticated client
+    """
+    if os.environ.get('PROMINENCE_AGENT') != 'False':
+        from prominence.agent import connect
+        agent = connect(url=agent_url())
+        if agent:
+            return agent
+    return prominence.ProminenceClient(authenticated=True, **kwargs)
+
+def command_agent_start(args):
+    """
+    Run the local agent
+    """
+    from prominence.agent import Agent, connect
+    if connect(url=agent_url()):
+        print('Error: the agent is already running')
+        exit(1)
+
+    try:
+        agent = Agent(ttl=args.ttl)
+    except exceptions.TokenExpiredError:
+        print('Error: access token has expired')
+        exit(1)
+    except (exceptions.AuthenticationError, exceptions.TokenError) as err:
+        print('Error:', err)
+        exit(1)
+
+    if args.detach:
+        if os.fork():
+            return
+        os.setsid()
+        with open(os.devnull, 'r+') as devnull:
+            for stream in (sys.stdin, sys.stdout, sys.stderr):
+                os.dup2(devnull.fileno(), stream.fileno())
+
+    try:
+        agent.serve()
+    except exceptions.ProminenceError as err:
+        print('Error:', err)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(0)
+
+def command_agent_stop(args):
+    """
+    Stop the local agent
+    """
+    from prominence.agent import connect
+    agent = connect(url=agent_url())
+    if not agent:
+        print('Error: the agent is not running')
+        exit(1)
+    try:
+        agent.stop()
+    except exceptions.ConnectionError as err:
+        print('Error:', err)
+        exit(1)
+
+def command_agent_status(args):
+    """
+    Show the status of the local agent
+    """
+    from prominence.agent import connect
+    agent = connect(url=agent_url())
+    if not agent:
+        print('The agent is not running')
+        exit(1)
+    try:
+        status = agent.status()
+    except exceptions.ConnectionError as err:
+        print('Error:', err)
+        exit(1)
+
+    uptime = '%d+%s' % (int(status['uptime']/86400), time.strftime('%H:%M:%S', time.gmtime(status['uptime'])))
+    print('The agent is running with pid %d (uptime %s)' % (status['pid'], uptime))
+    print('Requests: %d, upstream: %d, coalesced: %d' % (status['requests'], status['upstream'], status['coalesced']))
+
+def command_listen(args):
+    """
+    Receive job and workflow state change events, printing each one
+    """
+    from prominence.listener import Listener
+
+    def print_event(event):
+        print(json.dumps(event))
+        sys.stdout.flush()
+
+    def print_polled(item, event):
+        # Events received are already printed
+        if event.get('polled'):
+            print_event(event)
+
+    try:
+        listener = Listener(args.host, args.port, args.url, poll_interval=args.interval, callback=print_event)
+    except (IOError, OSError) as err:
+        print('Error: unable to listen on %s:%d: %s' % (args.host, args.port, err))
+        exit(1)
+    print('Listening for events at %s' % listener.url, file=sys.stderr)
+
+    if not args.id:
+        try:
+            listener.serve()
+        except KeyboardInterrupt:
+            exit(0)
+        return
+
+    # Wait for the specified jobs or workflows to finish, polling if no events arrive
+    try:
+        client = prominence.ProminenceClient(authenticated=True, cache=True)
+        for item_id in args.id:
+            if args.workflow:
+                item = prominence.Workflow(id=item_id, client=client)
+            else:
+                item = prominence.Job(id=item_id, client=client)
+            # The current status is obtained when the job or workflow is created, so any which have
+            # already finished are reported straight away
+            if item.done():
+                print_event({'type': 'workflow' if args.workflow else 'job', 'id': item_id, 'status': item.status,
+                             'polled': True})
+            item.on_status_change(print_polled, listener)
+        listener.start()
+        listener.wait()
+        listener.stop()
+    except KeyboardInterrupt:
+        exit(0)
+    except exceptions.AuthenticationError:
+        print('Error: authentication failed')
+        exit(1)
+    except exceptions.TokenExpiredError:
+        print('Error: access token has expired')
+        exit(1)
+    except (exceptions.ConnectionError, exceptions.JobGetError, exceptions.WorkflowGetError,
+            exceptions.TokenError) as err:
+        print('Error:', err)
+        exit(1)
+
+def _field_value(item, field):
+    """
+    Return the value of a possibly nested field for CSV or TSV output
+    """
+    from prominence.query import get_field
+    value = get_field(item, field)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+def watch_listing(list_items, describe, status=None, statuses=None):
+    """
+    Yield the current jobs or workflows each time the listing is polled. Jobs/workflows in a
+    terminal state never change, so after the first poll only idle and running ones are listed and
+    any which have disappeared from that listing are described individually.
+    """
+    from prominence.cache import TERMINAL_STATES
+
+    def visible(item):
+        if status == 'completed' and item['status'] not in TERMINAL_STATES:
+            return False
+        return not statuses or item['status'] in statuses
+
+    tracked = dict((item['id'], item) for item in list_items(status, statuses))
+    while True:
+        yield [tracked[key] for key in sorted(tracked) if visible(tracked[key])]
+
+        if status not in ('completed', 'all'):
+            tracked = dict((item['id'], item) for item in list_items(status, statuses))
+            continue
+
+        active = dict((item['id'], item) for item in list_items(None, None))
+        for key, item in list(tracked.items()):
+            if key in active or item['status'] in TERMINAL_STATES:
+                continue
+            try:
+                tracked[key] = describe(key)
+            except (exceptions.JobGetError, exceptions.WorkflowGetError):
+                del tracked[key]
+        tracked.update(active)
+
+        # Items which are finished and not shown will never be shown
+        tracked = dict((key, item) for key, item in tracked.items()
+                       if item['status'] not in TERMINAL_STATES or visible(item))
+
+def _watch(args, columns, listing):
+    """
+    Redraw a listing of jobs or workflows at an interval until interrupted
+    """
+    table = render.LiveTable(columns)
+    try:
+        for items in listing:
+            table.update(items, 'Every %gs: prominence list %s   %s' % (args.interval,
+                                                                       args.resource,
+                                                                       time.strftime('%Y-%m-%d %H:%M:%S')))
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        exit(0)
+
 def command_list(args):
     """
     List running/idle or completed jobs or workflows
@@ -463,33 +542,97 @@ def command_list(args):
     if args.id:
         workflow = args.id
 
+    # Listing a set of statuses includes completed jobs/workflows unless otherwise specified
+    statuses = None
+    if args.statuses:
+        statuses = args.statuses.split(',')
+        if not status:
+            status = 'all'
+    fields = None
+    if args.fields:
+        fields = args.fields.split(',')
+        if not args.output:
+            print('Error: --fields can only be used with --output')
+            exit(1)
+    if args.watch and args.output:
+        print('Error: --watch cannot be used with --output')
+        exit(1)
+
+    from prominence.query import parse_selector, parse_time
     try:
-        client = ProminenceClient(authenticated=True)
         if args.resource == 'jobs':
-            data = client.list_jobs(status, num, constraint, name_constraint, workflow)
+            columns = render.parse_columns(args.columns or render.DEFAULT_JOB_COLUMNS, render.JOB_COLUMNS)
         else:
-            data = client.list_workflows(status, num, constraint, name_constraint)
+            columns = render.parse_columns(args.columns or render.DEFAULT_WORKFLOW_COLUMNS, render.WORKFLOW_COLUMNS)
+        created_after = parse_time(args.created_after)
+        created_before = parse_time(args.created_before)
+        for selector in args.labels or []:
+            parse_selector(selector)
+    except ValueError as err:
+        print('Error:', err)
+        exit(1)
+
+    filters = dict((name, value) for name, value in (('fields', fields),
+                                                       ('statuses', statuses),
+                                                       ('created_after', created_after),
+                                                       ('created_before', created_before),
+                                                       ('labels', args.labels)) if value is not None)
+
+    try:
+        client = get_client(cache=True)
+        if args.watch:
+            filters.pop('statuses', None)
+            if args.resource == 'jobs':
+                listing = watch_listing(lambda status, statuses: client.list_jobs(status, num, constraint, name_constraint,
+                                                                                  workflow, statuses=statuses, **filters),
+                                        client.describe_job, status, statuses)
+            else:
+                listing = watch_listing(lambda status, statuses: client.list_workflows(status, num, constraint,
+                                                                                       name_constraint,
+                                                                                       statuses=statuses, **filters),
+                                        client.describe_workflow, status, statuses)
+            _watch(args, columns, listing)
+            return
+
+        if args.resource == 'jobs':
+            items = client.iter_jobs(status, num, constraint, name_constraint, workflow, **filters)
+            transform = transform_job
+        else:
+            items = client.iter_workflows(status, num, constraint, name_constraint, **filters)
+            transform = transform_workflow
+
+        # Items are fetched and decoded while being rendered, so time the two separately
+        start = time.time()
+        items = profile.iterate('fetch', items)
+
+        if fields and args.output in ('json', 'jsonl'):
+            render.write_records(items, args.output)
+        elif fields:
+            render.write_records(items, args.output, [(field, lambda item, field=field: _field_value(item, field))
+                                                      for field in fields])
+        elif args.output in ('json', 'jsonl'):
+            render.write_records((transform(item, False) for item in items), args.output)
+        elif args.output:
+            render.write_records(items, args.output, [column.field() for column in columns])
+        else:
+            render.Table(columns, LIST_LOOKAHEAD, lambda item: int(item['id'])).render(items)
+        profile.add('render', time.time() - start - items.elapsed)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
         exit(1)
     except exceptions.TokenExpiredError:
         print('Error: access token has expired')
         exit(1)
-    except (exceptions.ConnectionError, exceptions.JobGetError, exceptions.TokenError) as err:
+    except (exceptions.ConnectionError, exceptions.JobGetError, exceptions.WorkflowGetError, exceptions.TokenError) as err:
         print('Error:', err)
         exit(1)
 
-    if args.resource == 'jobs':
-        list_jobs(transform_item_list(data, False, 'job'))
-    else:
-        list_workflows(transform_item_list(data, False, 'workflow'))
-
 def command_exec(args):
     """
     Execute a command inside a running job
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         output = client.execute_command(args.id, shlex.split(str(args.command)))
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -512,7 +655,7 @@ def command_snapshot(args):
     """
     print('Creating snapshot...')
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         output = client.create_snapshot(args.id, args.path)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -528,7 +671,6 @@ def command_snapshot(args):
         exit(1)
 
     try:
-        client = ProminenceClient(authenticated=True)
         data = client.get_snapshot_url(args.id)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -550,7 +692,7 @@ def command_snapshot(args):
         exit(1)
 
     try:
-        response = requests.get(url, stream=True, timeout=30)
+        response = client.session.get(url, stream=True, timeout=30)
     except requests.exceptions.RequestException as err:
         print('Error getting file due to: %s' % err)
         exit(1)
@@ -581,11 +723,14 @@ def command_describe(args):
     Describe a specific job or workflow
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        fields = None
+        if args.fields:
+            fields = args.fields.split(',')
+        client = get_client(cache=True)
         if args.resource == 'job':
-            data = client.describe_job(args.id, args.input)
+            data = client.describe_job(args.id, args.input, fields=fields)
         else:
-            data = client.describe_workflow(args.id, args.input)
+            data = client.describe_workflow(args.id, args.input, fields=fields)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
         exit(1)
@@ -596,7 +741,22 @@ def command_describe(args):
         print('Error:', err)
         exit(1)
 
-    if args.input:
+    if fields and args.output in ('csv', 'tsv'):
+        render.write_records([data], args.output, [(field, lambda item, field=field: _field_value(item, field))
+                                                   for field in fields])
+    elif fields:
+        render.write_records([data], args.output or 'json', single=True)
+    elif args.output in ('csv', 'tsv') and not args.input:
+        if args.resource == 'job':
+            columns = render.parse_columns(render.DEFAULT_JOB_COLUMNS, render.JOB_COLUMNS)
+        else:
+            columns = render.parse_columns(render.DEFAULT_WORKFLOW_COLUMNS, render.WORKFLOW_COLUMNS)
+        render.write_records([data], args.output, [column.field() for column in columns])
+    elif args.output and args.output != 'json':
+        if not args.input:
+            data = transform_item(data, True, args.resource)
+        render.write_records([data], args.output, single=True)
+    elif args.input:
         print(json.dumps(data, indent=2))
     else:
         print_json(data, transform=True, detail=True, resource=args.resource)
@@ -613,7 +773,7 @@ def command_upload(args):
         exit(1)
 
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         response = client.upload(args.name, args.filename, args.checksum)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -627,23 +787,41 @@ def command_upload(args):
 
     print('Success')
 
-def downloader(job):
+def format_size(size):
     """
-    Download the specified file to the specified directory
+    Format a number of bytes in a human readable way
     """
-    try:
-        response = requests.get(job['url'], stream=True, timeout=30)
-    except requests.exceptions.RequestException as err:
-        return
-
-    total_length = response.headers.get('content-length')
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1000:
+            return '%.1f %s' % (size, unit)
+        size /= 1000.0
+    return '%.1f TB' % size
 
-    with open('%s/%s' % (job['path'], job['filename']), 'wb') as fh:
-        if total_length is None:
-            fh.write(response.content)
-        else:
-            for data in response.iter_content(chunk_size=8192):
-                fh.write(data)
+def print_download_status(manager):
+    """
+    Print a status line showing the aggregate and per-file progress of downloads
+    """
+    files = manager.files
+    complete = len([progress for progress in files if progress.status in ('done', 'skipped', 'failed')])
+    eta = manager.eta()
+    if eta is None:
+        eta = '--:--:--'
+    else:
+        eta = time.strftime('%H:%M:%S', time.gmtime(eta))
+
+    line = 'Files %d/%d   %s/%s   %s/s   ETA %s' % (complete,
+                                                   len(files),
+                                                   format_size(sum(progress.done for progress in files)),
+                                                   format_size(sum(progress.size or 0 for progress in files)),
+                                                   format_size(manager.rate()),
+                                                   eta)
+    for progress in files:
+        if progress.status == 'downloading' and progress.size:
+            line += '   %s %d%%' % (os.path.basename(progress.filename), 100*progress.done/progress.size)
+
+    width = shutil.get_terminal_size().columns - 1
+    print(line[:width].ljust(width), end='\r')
+    sys.stdout.flush()
 
 def command_download(args):
     """
@@ -652,11 +830,11 @@ def command_download(args):
     jobs = []
     print('Preparing downloads...')
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         if args.resource == 'job':
             jobs.append(client.describe_job(args.id, False))
         else:
-            jobs = client.list_jobs('completed', 1, '', '', args.id, True)
+            jobs = client.iter_jobs('completed', 1, '', '', args.id, True)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
         exit(1)
@@ -667,52 +845,67 @@ def command_download(args):
         print('Error:', err)
         exit(1)
 
+    # Jobs from a workflow are received as they are listed
     downloads = []
-    for job in jobs:
-        if ('outputFiles' in job or 'outputDirs' in job) and job['status'] in ('completed', 'failed', 'deleted', 'killed'):
-            files_and_dirs = []
-            if 'outputFiles' in job:
-                files_and_dirs += job['outputFiles']
-            if 'outputDirs' in job:
-                files_and_dirs += job['outputDirs']
-
-            if args.dir:
-                path = '%s/%d/' % (os.getcwd(), job['id'])
-                try:
-                    os.mkdir(path)
-                except:
-                    return
-            else:
-                path = os.getcwd()
-
-            for pair in files_and_dirs:
-                job_download = {}
-                job_download['id'] = job['id']
-                job_download['path'] = path
-
-                file_name = os.path.basename(pair['name'])
+    try:
+        for job in jobs:
+            if ('outputFiles' in job or 'outputDirs' in job) and job['status'] in ('completed', 'failed', 'deleted', 'killed'):
+                files_and_dirs = []
+                if 'outputFiles' in job:
+                    files_and_dirs += job['outputFiles']
                 if 'outputDirs' in job:
-                    if pair in job['outputDirs']:
-                        file_name = file_name + '.tgz'
-
-                if 'parameters' in job:
-                    for parameter in job['parameters']:
-                        file_name = Template(file_name).safe_substitute({parameter:job['parameters'][parameter]})
-
-                job_download['url'] = pair['url']
-                job_download['filename'] = file_name
-                downloads.append(job_download)
+                    files_and_dirs += job['outputDirs']
+
+                if args.dir:
+                    path = '%s/%d/' % (os.getcwd(), job['id'])
+                    try:
+                        if not os.path.isdir(path):
+                            os.mkdir(path)
+                    except OSError as err:
+                        print('Error: unable to create directory: %s' % err)
+                        exit(1)
+                else:
+                    path = os.getcwd()
+
+                for pair in files_and_dirs:
+                    job_download = {}
+                    job_download['id'] = job['id']
+                    job_download['path'] = path
+
+                    file_name = os.path.basename(pair['name'])
+                    if 'outputDirs' in job:
+                        if pair in job['outputDirs']:
+                            file_name = file_name + '.tgz'
+
+                    if 'parameters' in job:
+                        for parameter in job['parameters']:
+                            file_name = Template(file_name).safe_substitute({parameter:job['parameters'][parameter]})
+
+                    job_download['url'] = pair['url']
+                    job_download['filename'] = file_name
+                    job_download['checksum'] = pair.get('checksum')
+                    downloads.append(job_download)
+    except exceptions.AuthenticationError:
+        print('Error: authentication failed')
+        exit(1)
+    except (exceptions.JobGetError, exceptions.ConnectionError) as err:
+        print('Error:', err)
+        exit(1)
 
     print('Starting downloads...')
-    with ProcessPoolExecutor(args.num) as executor:
-        futures = [executor.submit(downloader, item) for item in downloads]
-        count = 0
-        print('Current status (complete/total) = %d/%d' % (count, len(downloads)), end='\r')
-        for future in as_completed(futures):
-            count = count + 1
-            print('Current status (complete/total) = %d/%d' % (count, len(downloads)), end='\r')
+    from prominence.download import DownloadManager
+    from prominence.transport import create_transport
+    manager = DownloadManager(create_transport(None, args.num*args.streams, 0), args.num, args.streams, args.force)
+    for item in downloads:
+        manager.add(item['url'], os.path.join(item['path'], item['filename']), item['checksum'])
+    failures = manager.run(print_download_status)
     print()
 
+    for progress in failures:
+        print('Error: unable to download %s: %s' % (progress.filename, progress.error))
+    if failures:
+        exit(1)
+
 def command_ls(args):
     """
     List objects in cloud storage
@@ -722,7 +915,7 @@ def command_ls(args):
         path = args.path
 
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         objects = client.list_objects(path)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -734,7 +927,11 @@ def command_ls(args):
         print('Error:', err)
         exit(1)
 
-    if objects:
+    if args.output:
+        render.write_records(objects, args.output, [('name', lambda obj: obj['name']),
+                                                    ('size', lambda obj: obj['size']),
+                                                    ('lastModified', lambda obj: obj['lastModified'])])
+    elif objects:
         p1 = max([len('%d' % obj['size']) for obj in objects])
         p2 = max([len('%s' % obj['lastModified']) for obj in objects])
         p3 = max([len('%s' % obj['name']) for obj in objects])
@@ -755,7 +952,7 @@ def command_rm(args):
         exit(1)
 
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         client.delete_object(args.object)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -774,7 +971,7 @@ def command_remove(args):
     Remove a job or workflow from the queue
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         client.remove(args.resource, args.id)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -796,7 +993,7 @@ def command_delete(args):
     Delete a job or workflow
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         if args.resource == 'job':
             client.delete_job(args.id)
         else:
@@ -818,46 +1015,65 @@ def _get_stdout(client, args, offset=0):
     """
     if args.job:
         return client.stdout_workflow(args.id, args.job, args.node, args.instance, offset)
-    elif args.job:
-        return client.stdout_workflow(args.id, args.job, args.node, offset)
     else:
         return client.stdout_job(args.id, args.node, offset)
 
-def _get_status(client, args):
+def _get_stderr(client, args, offset=0):
     """
     """
-    if not args.job:
-        data = client.describe_job(args.id, False)
-        if 'status' in data:
-            return data['status']
-    return None
+    if args.job:
+        return client.stderr_workflow(args.id, args.node, args.job, args.instance, offset)
+    else:
+        return client.stderr_job(args.id, args.node, offset)
 
-def command_stdout(args):
+def _follow(client, args, streams):
     """
-    Get standard output for a specific job/workflow
+    Print output from a job or workflow as it is produced until it has finished. Output from
+    standard error is written to stderr.
+    """
+    nodes = [args.node]
+    if args.all_nodes and not args.job:
+        nodes = list(range(client.describe_job(args.id).get('resources', {}).get('nodes', 1)))
+
+    resource = 'job'
+    if args.job:
+        resource = 'workflow'
+
+    from prominence.logs import LogFollower
+    follower = LogFollower(client, resource, args.id, nodes, streams, args.job, args.instance)
+
+    # Complete lines are prefixed by the node when following multiple nodes
+    partial = {}
+    for node, stream, text in follower.follow():
+        output = sys.stdout
+        if stream == 'stderr':
+            output = sys.stderr
+        if len(nodes) > 1:
+            lines = (partial.pop((node, stream), '') + text).split('\n')
+            partial[(node, stream)] = lines.pop()
+            text = ''.join('[node %d] %s\n' % (node, line) for line in lines)
+        output.write(text)
+        output.flush()
+
+    for (node, stream), text in partial.items():
+        if text:
+            print('[node %d] %s' % (node, text), file=sys.stderr if stream == 'stderr' else sys.stdout)
+
+def _command_std_stream(args, stream):
+    """
+    Get or follow standard output or standard error for a specific job/workflow
     """
-    client = ProminenceClient(authenticated=True)
+    client = get_client()
     try:
-        if not args.tail:
+        if args.follow:
+            streams = [stream]
+            if args.both:
+                streams = ['stdout', 'stderr']
+            _follow(client, args, streams)
+        elif stream == 'stdout':
             print(_get_stdout(client, args))
-            exit(0)
-
-        # Wait for job to enter the running state if necessary
-        status = _get_status(client, args)
-        if status in ('idle', 'pending'):
-            while status not in ('running', 'deleted', 'failed', 'completed', 'killed'):
-                time.sleep(2)
-                status = _get_status(client, args)
-
-        # Print the stdout
-        offset = 0
-        while status == 'running':
-            stdout = _get_stdout(client, args, offset)
-            offset = offset + len(stdout)
-            if len(stdout) > 0:
-                print(stdout, end='')
-            time.sleep(2)
-            status = _get_status(client, args)
+        else:
+            print(_get_stderr(client, args))
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
         exit(1)
@@ -867,59 +1083,27 @@ def command_stdout(args):
     except (exceptions.ConnectionError, exceptions.StdStreamsError, exceptions.TokenError) as err:
         print('Error:', err)
         exit(1)
+    except KeyboardInterrupt:
+        exit(0)
 
-def _get_stderr(client, args, offset=0):
+def command_stdout(args):
     """
+    Get standard output for a specific job/workflow
     """
-    if args.job:
-        return client.stderr_workflow(args.id, args.job, args.node, args.instance, offset)
-    elif args.job:
-        return client.stderr_workflow(args.id, args.job, args.node, offset)
-    else:
-        return client.stderr_job(args.id, args.node, offset)
+    _command_std_stream(args, 'stdout')
 
 def command_stderr(args):
     """
     Get standard error for a specific job/workflow
     """
-    client = ProminenceClient(authenticated=True)
-    try:
-        if not args.tail:
-            print(_get_stderr(client, args))
-            exit(0)
-
-        # Wait for job to enter the running state if necessary
-        status = _get_status(client, args)
-        if status in ('idle', 'pending'):
-            while status not in ('running', 'deleted', 'failed', 'completed', 'killed'):
-                time.sleep(2)
-                status = _get_status(client, args)
-
-        # Print the stderr
-        offset = 0
-        while status == 'running':
-            stderr = _get_stderr(client, args, offset)
-            offset = offset + len(stderr)
-            if len(stderr) > 0:
-                print(stderr, end='')
-            time.sleep(2)
-            status = _get_status(client, args)
-    except exceptions.AuthenticationError:
-        print('Error: authentication failed')
-        exit(1)
-    except exceptions.TokenExpiredError:
-        print('Error: access token has expired')
-        exit(1)
-    except (exceptions.ConnectionError, exceptions.StdStreamsError, exceptions.TokenError) as err:
-        print('Error:', err)
-        exit(1)
+    _command_std_stream(args, 'stderr')
 
 def command_rerun(args):
     """
     Re-run any failed jobs from a completed workflow
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         resource_id = client.rerun(args.id)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -938,7 +1122,7 @@ def command_clone(args):
     Clone a job or workflow
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         resource_id = client.clone(args.resource, args.id)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -955,13 +1139,81 @@ def command_clone(args):
     else:
         print('Job created with id %d' % resource_id)
 
+def load_documents(stream):
+    """
+    Read a stream of documents, either JSON lines or multiple YAML documents
+    """
+    for line in stream:
+        if line.strip():
+            break
+    else:
+        return
+
+    try:
+        document = json.loads(line)
+    except ValueError:
+        for document in yaml.safe_load_all(line + stream.read()):
+            if document is not None:
+                yield document
+        return
+
+    yield document
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+def prepare_batch(stream):
+    """
+    Prepare jobs read from a stream for submission
+    """
+    for index, job in enumerate(load_documents(stream)):
+        if not isinstance(job, dict) or 'jobs' in job:
+            raise ValueError('document %d: only jobs can be submitted in batch mode' % (index + 1))
+        yield load_input_files(handle_multiline_commands(job))
+
+def command_run_batch(args):
+    """
+    Create jobs in parallel from a stream of JSON lines or YAML documents
+    """
+    failures = 0
+    try:
+        client = prominence.ProminenceClient(authenticated=True, pool_size=args.concurrency)
+        if args.file == '-':
+            stream = sys.stdin
+        else:
+            stream = open(args.file)
+        with stream:
+            for index, job_id, error in client.iter_create_jobs(prepare_batch(stream), args.concurrency, args.rate):
+                if error:
+                    failures += 1
+                    print('Error: document %d: %s' % (index + 1, error))
+                else:
+                    print('Job created with id %d from document %d' % (job_id, index + 1))
+    except exceptions.TokenExpiredError:
+        print('Error: access token has expired')
+        exit(1)
+    except exceptions.TokenError as err:
+        print('Error:', err)
+        exit(1)
+    except (IOError, ValueError, yaml.YAMLError) as err:
+        print('Error: %s' % err)
+        exit(1)
+
+    if failures:
+        exit(1)
+
 def command_run(args):
     """
     Create a job from a JSON file, YAML file or URL
     """
+    if args.batch:
+        command_run_batch(args)
+        return
+
     if args.file.startswith('http://') or args.file.startswith('https://'):
         try:
-            response = requests.get(args.file)
+            from prominence.transport import create_transport
+            response = create_transport(retries=0).get(args.file, timeout=30)
         except requests.exceptions.RequestException as err:
             print('Error getting URL due to: %s' % err)
             exit(1)
@@ -1005,7 +1257,7 @@ def command_run(args):
         data = load_input_files(data)
 
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         if 'jobs' in data:
             res_id = client.create_workflow(data)
             resource = 'Workflow'
@@ -1157,15 +1409,16 @@ def command_create(args):
         if 'artifacts' not in job:
             job['artifacts'] = []
         try:
-            shutil.make_archive('/tmp/%s' % tarball, 'gztar', args.directory)
+            from prominence.upload import create_tarball
+            checksum = create_tarball(args.directory, '/tmp/%s.tar.gz' % tarball)
         except Exception as err:
             print('Error: Unable to create directory tarball:', err)
             exit(1)
-        job['artifacts'].append({'url': '%s.tar.gz' % tarball})
 
+        # The tarball is named by its checksum so that an unchanged directory is only uploaded once
         try:
-            client = ProminenceClient(authenticated=True)
-            response = client.upload('%s.tar.gz' % tarball, '/tmp/%s.tar.gz' % tarball)
+            client = prominence.ProminenceClient(authenticated=True)
+            job['artifacts'].append({'url': client.upload_content('/tmp/%s.tar.gz' % tarball, checksum, '.tar.gz')})
         except exceptions.AuthenticationError:
             print('Error: authentication failed')
             exit(1)
@@ -1264,7 +1517,7 @@ def command_create(args):
         exit(0)
 
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         job_id = client.create_job(job)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1288,7 +1541,7 @@ def command_usage(args):
     Return historical usage information
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         usage = client.get_usage(args.start, args.end, args.group, args.all)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1300,7 +1553,17 @@ def command_usage(args):
         print('Error:', err)
         exit(1)
 
-    if 'usage' in usage:
+    if args.output:
+        records = []
+        for kind in ('users', 'groups'):
+            for name, stats in usage.get('usage', {}).get(kind, {}).items():
+                records.append(OrderedDict((('type', kind[:-1]),
+                                            ('name', name),
+                                            ('numberOfJobs', stats['numberOfJobs']),
+                                            ('cpuTime', stats['cpuTime']),
+                                            ('wallTime', stats['wallTime']))))
+        render.write_records(records, args.output)
+    elif 'usage' in usage:
         if 'users' in usage['usage']:
             for user in usage['usage']['users']:
                 print(user)
@@ -1319,7 +1582,7 @@ def command_resources(args):
     List resources
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         resources = client.resources()
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1349,7 +1612,7 @@ def command_kv_list(args):
     List keys
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         keys = client.kv_list(args.path)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1361,15 +1624,18 @@ def command_kv_list(args):
         print('Error:', err)
         exit(1)
 
-    for key in keys:
-        print(key)
+    if args.output:
+        render.write_records(({'key': key} for key in keys), args.output, [('key', lambda record: record['key'])])
+    else:
+        for key in keys:
+            print(key)
 
 def command_kv_delete(args):
     """
     Delete keys
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         client.kv_delete(args.key, args.prefix)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1391,7 +1657,7 @@ def command_kv_set(args):
             value = fh.read()
 
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         client.kv_set(args.key, value)
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1408,7 +1674,7 @@ def command_kv_get(args):
     Get value of a key
     """
     try:
-        client = ProminenceClient(authenticated=True)
+        client = prominence.ProminenceClient(authenticated=True)
         print(client.kv_get(args.key))
     except exceptions.AuthenticationError:
         print('Error: authentication failed')
@@ -1423,13 +1689,65 @@ def command_kv_get(args):
         print('Error: No such key')
         exit(1)
 
-def create_parser():
+# Names of all commands
+COMMANDS = ('register', 'login', 'run', 'rerun', 'clone', 'create', 'list', 'describe', 'delete', 'remove',
+            'stdout', 'stderr', 'exec', 'snapshot', 'upload', 'download', 'ls', 'rm', 'resources', 'usage', 'kv',
+            'agent', 'listen')
+
+class _SkippedParser(object):
     """
-    Create the argument parser
+    Stand-in for the parser of a command which is not being run
+    """
+    def add_argument(self, *args, **kwargs):
+        pass
+
+    def set_defaults(self, **kwargs):
+        pass
+
+    def add_subparsers(self, **kwargs):
+        return self
+
+    def add_parser(self, name, **kwargs):
+        return self
+
+class _LazySubParsers(object):
+    """
+    Wrapper around the subparsers action which, if a command is specified, only creates the parser
+    for that command. If names_only is set the commands are listed but their arguments are not added.
+    """
+    def __init__(self, subparsers, command=None, names_only=False):
+        self._subparsers = subparsers
+        self._command = command
+        self._names_only = names_only
+
+    def add_parser(self, name, **kwargs):
+        if self._command and name != self._command:
+            return _SkippedParser()
+        parser = self._subparsers.add_parser(name, **kwargs)
+        if self._names_only:
+            return _SkippedParser()
+        return parser
+
+def find_command(argv):
+    """
+    Return the command in a list of arguments if it is known. The options which can be given before
+    the command, such as --profile, do not take values.
+    """
+    for arg in argv:
+        if not arg.startswith('-'):
+            if arg in COMMANDS:
+                return arg
+            return None
+    return None
+
+def create_parser(command=None, names_only=False):
+    """
+    Create the argument parser, only including the parser for the specified command if given. If
+    names_only is set the commands are included without their arguments, which is enough for help.
     """
     parser = argparse.ArgumentParser(description='PROMINENCE - \
                                                   run jobs in containers across clouds')
-    subparsers = parser.add_subparsers(help='sub-command help')
+    subparsers = _LazySubParsers(parser.add_subparsers(help='sub-command help'), command, names_only)
 
     # Create the parser for the "register" command
     parser_register = subparsers.add_parser('register',
@@ -1444,6 +1762,23 @@ def create_parser():
     # Create the parser for the "run" command
     parser_run = subparsers.add_parser('run',
                                        help='Create a job or workflow from JSON in a file or URL')
+    parser_run.add_argument('--batch',
+                            dest='batch',
+                            default=False,
+                            action='store_true',
+                            help='Submit a stream of jobs in parallel. The file, or standard input if "-" is \
+                                  specified, must contain either one JSON job description per line or multiple \
+                                  YAML documents.')
+    parser_run.add_argument('--concurrency',
+                            dest='concurrency',
+                            default=10,
+                            type=int,
+                            help='Number of concurrent job submissions in batch mode (default is 10)')
+    parser_run.add_argument('--rate',
+                            dest='rate',
+                            default=None,
+                            type=float,
+                            help='Maximum number of job submissions per second in batch mode')
     parser_run.add_argument('file',
                             help='JSON filename or URL containing JSON')
     parser_run.set_defaults(func=command_run)
@@ -1691,6 +2026,49 @@ def create_parser():
                              default=False,
                              action='store_true',
                              help='List jobs/workflows in all states')
+    parser_list.add_argument('-o',
+                             '--output',
+                             dest='output',
+                             choices=render.OUTPUT_FORMATS,
+                             help='Write machine-readable output in the specified format')
+    parser_list.add_argument('--status',
+                             dest='statuses',
+                             help='Comma-separated list of statuses of jobs/workflows to list, e.g. \
+                                   running,failed. Completed jobs/workflows are included unless \
+                                   otherwise specified')
+    parser_list.add_argument('--label',
+                             dest='labels',
+                             action='append',
+                             help='Label selector of the form key=value, key!=value or key. This option \
+                                   can be specified multiple times')
+    parser_list.add_argument('--created-after',
+                             dest='created_after',
+                             help='Only list jobs/workflows created at or after this time, a unix \
+                                   epoch or YYYY-MM-DD [HH:MM:SS] in UTC')
+    parser_list.add_argument('--created-before',
+                             dest='created_before',
+                             help='Only list jobs/workflows created before this time')
+    parser_list.add_argument('--fields',
+                             dest='fields',
+                             help='Comma-separated list of fields to fetch, e.g. id,status,events.createTime. \
+                                   Requires --output')
+    parser_list.add_argument('-w',
+                             '--watch',
+                             dest='watch',
+                             default=False,
+                             action='store_true',
+                             help='Keep the listing up to date, redrawing only the rows which have changed')
+    parser_list.add_argument('--interval',
+                             dest='interval',
+                             default=5,
+                             type=float,
+                             help='Number of seconds between updates when using --watch')
+    parser_list.add_argument('--columns',
+                             dest='columns',
+                             help='Comma-separated list of columns to show, each optionally followed by \
+                                   :width to set its maximum width, e.g. id,name:20,status,cmd:40. Jobs \
+                                   have the columns %s and workflows %s' % (', '.join(render.JOB_COLUMNS),
+                                                                            ', '.join(render.WORKFLOW_COLUMNS)))
     parser_list.add_argument('resource',
                              help='Resource type',
                              default='jobs',
@@ -1705,6 +2083,14 @@ def create_parser():
     # Create the parser for the "describe" command
     parser_describe = subparsers.add_parser('describe',
                                             help='Describe a job or workflow')
+    parser_describe.add_argument('-o',
+                                 '--output',
+                                 dest='output',
+                                 choices=render.OUTPUT_FORMATS,
+                                 help='Write machine-readable output in the specified format')
+    parser_describe.add_argument('--fields',
+                                 dest='fields',
+                                 help='Comma-separated list of fields to fetch, e.g. status,execution.site')
     parser_describe.add_argument('resource',
                                  help='Resource type',
                                  default='job',
@@ -1767,12 +2153,26 @@ def create_parser():
                                default=0,
                                type=int,
                                help='Display stdout from this node for the case of multi-node jobs')
-    parser_stdout.add_argument('-t',
+    parser_stdout.add_argument('-f',
+                             '--follow',
+                             '-t',
                              '--tail',
-                             dest='tail',
+                             dest='follow',
+                             default=False,
+                             action='store_true',
+                             help='Follow the standard output until the job has finished')
+    parser_stdout.add_argument('-b',
+                             '--both',
+                             dest='both',
                              default=False,
                              action='store_true',
-                             help='Tail the standard output')
+                             help='Follow both standard output and standard error')
+    parser_stdout.add_argument('-a',
+                             '--all-nodes',
+                             dest='all_nodes',
+                             default=False,
+                             action='store_true',
+                             help='Follow all nodes of a multi-node job')
     parser_stdout.set_defaults(func=command_stdout)
 
     # Create the parser for the "stderr" command
@@ -1795,12 +2195,26 @@ def create_parser():
                                default=0,
                                type=int,
                                help='Display stderr from this node for the case of multi-node jobs')
-    parser_stderr.add_argument('-t',
+    parser_stderr.add_argument('-f',
+                             '--follow',
+                             '-t',
                              '--tail',
-                             dest='tail',
+                             dest='follow',
+                             default=False,
+                             action='store_true',
+                             help='Follow the standard error until the job has finished')
+    parser_stderr.add_argument('-b',
+                             '--both',
+                             dest='both',
                              default=False,
                              action='store_true',
-                             help='Tail the standard error')
+                             help='Follow both standard output and standard error')
+    parser_stderr.add_argument('-a',
+                             '--all-nodes',
+                             dest='all_nodes',
+                             default=False,
+                             action='store_true',
+                             help='Follow all nodes of a multi-node job')
     parser_stderr.set_defaults(func=command_stderr)
 
     # Create the parser for the "exec" command
@@ -1846,8 +2260,15 @@ def create_parser():
     parser_download.add_argument('--force',
                                  dest='force',
                                  default=False,
-                                 help='Force overwrite of existing file',
+                                 help='Force overwrite of existing file. By default complete files are skipped \
+                                       and partial downloads are resumed.',
                                  action='store_true')
+    parser_download.add_argument('--streams',
+                                 dest='streams',
+                                 default=4,
+                                 type=int,
+                                 help='Number of parallel streams used for each file of at least 64 MB \
+                                       (default is 4)')
     parser_download.add_argument('--dir',
                                  dest='dir',
                                  default=False,
@@ -1879,6 +2300,11 @@ def create_parser():
                            action='store_true',
                            help='Show object sizes and last modification times.')
 
+    parser_ls.add_argument('-o',
+                           '--output',
+                           dest='output',
+                           choices=render.OUTPUT_FORMATS,
+                           help='Write machine-readable output in the specified format')
     parser_ls.add_argument('path',
                            nargs='?',
                            help='Path')
@@ -1909,6 +2335,11 @@ def create_parser():
                                  default=False,
                                  help='Show all users in the group',
                                  action='store_true')
+    parser_usage.add_argument('-o',
+                              '--output',
+                              dest='output',
+                              choices=render.OUTPUT_FORMATS,
+                              help='Write machine-readable output in the specified format')
     parser_usage.add_argument('start',
                               help='Start date in the form YYYY-MM-DD')
     parser_usage.add_argument('end',
@@ -1923,6 +2354,11 @@ def create_parser():
     #  Create the parser for the "kv list" command
     parser_kv_list = kv_subparsers.add_parser('list',
                                         help='List keys')
+    parser_kv_list.add_argument('-o',
+                                '--output',
+                                dest='output',
+                                choices=render.OUTPUT_FORMATS,
+                                help='Write machine-readable output in the specified format')
     parser_kv_list.add_argument('path',
                                 help='Path',
                                 nargs='?')
@@ -1956,6 +2392,76 @@ def create_parser():
                                help='Key')
     parser_kv_get.set_defaults(func=command_kv_get)
 
+    # Create the parser for the "agent" command
+    parser_agent = subparsers.add_parser('agent',
+                                         help='Manage the local agent, which holds warm connections and caches for other commands')
+    agent_subparsers = parser_agent.add_subparsers()
+
+    #  Create the parser for the "agent start" command
+    parser_agent_start = agent_subparsers.add_parser('start',
+                                                     help='Start the agent')
+    parser_agent_start.add_argument('--detach',
+                                    dest='detach',
+                                    default=False,
+                                    action='store_true',
+                                    help='Run the agent in the background')
+    parser_agent_start.add_argument('--ttl',
+                                    dest='ttl',
+                                    default=1.0,
+                                    type=float,
+                                    help='Number of seconds for which results are reused')
+    parser_agent_start.set_defaults(func=command_agent_start)
+
+    #  Create the parser for the "agent stop" command
+    parser_agent_stop = agent_subparsers.add_parser('stop',
+                                                    help='Stop the agent')
+    parser_agent_stop.set_defaults(func=command_agent_stop)
+
+    #  Create the parser for the "agent status" command
+    parser_agent_status = agent_subparsers.add_parser('status',
+                                                      help='Show the status of the agent')
+    parser_agent_status.set_defaults(func=command_agent_status)
+
+    #  Create the parser for the "listen" command
+    parser_listen = subparsers.add_parser('listen',
+                                          help='Receive job and workflow state change events sent by webhook notifications')
+    parser_listen.add_argument('--host',
+                               dest='host',
+                               default='127.0.0.1',
+                               help='Address to listen on')
+    parser_listen.add_argument('--port',
+                               dest='port',
+                               default=0,
+                               type=int,
+                               help='Port to listen on, by default any free port')
+    parser_listen.add_argument('--url',
+                               dest='url',
+                               default=None,
+                               help='URL at which the sender reaches the listener, if different from the local address. '
+                                    'A random token is always added to the path')
+    parser_listen.add_argument('--interval',
+                               dest='interval',
+                               default=60,
+                               type=float,
+                               help='Number of seconds without events after which the jobs or workflows are polled')
+    parser_listen.add_argument('--workflow',
+                               dest='workflow',
+                               default=False,
+                               action='store_true',
+                               help='The ids are workflow ids')
+    parser_listen.add_argument('id',
+                               nargs='*',
+                               type=int,
+                               help='Exit once these jobs or workflows have finished')
+    parser_listen.set_defaults(func=command_listen)
+
+    # Profiling
+    parser.add_argument('--profile',
+                        dest='profile',
+                        default=False,
+                        action='store_true',
+                        help='Print a summary of the time spent in each phase of the command and in each HTTP request')
+
     # Version
     parser.add_argument('--version',
                         action='version',
@@ -1969,10 +2475,25 @@ def main(argv=None):
     if 'PROMINENCE_URL' not in os.environ:
         os.environ['PROMINENCE_URL'] = 'https://host-130-246-215-158.nubes.stfc.ac.uk/prominence/v1'
 
-    # Parse the arguments
-    parser = create_parser()
+    # Parse the arguments, only creating the parser for the command being run
+    if argv is None:
+        argv = sys.argv[1:]
+    command = find_command(argv)
+    if not command and '--version' in argv:
+        print('%s %s' % (os.path.basename(sys.argv[0]), __version__))
+        exit(0)
+
+    # Without a known command nothing can be run, so the parsers for the commands are not needed
+    parser = create_parser(command, names_only=not command)
     args = parser.parse_args(argv)
 
+    # Report timings on exit, including when a command exits with an error
+    if args.profile:
+        profile.enable()
+        from prominence.client import add_default_hook
+        add_default_hook(profile.record_request)
+        atexit.register(profile.report)
+
     # Run the required function
     try:
         a = getattr(args, "func")
@@ -1,13 +1,42 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import codecs
+import gzip
 import hashlib
 import json
 import os
+import threading
 import time
 import requests
 
 from prominence import auth
 from prominence import exceptions
+from prominence import profile
+from prominence import query
+from prominence.upload import MAX_CHECKSUM_SIZE, MULTIPART_THRESHOLD, UploadManifest, upload_blocks, upload_stream
+from prominence.cache import StateCache
+from prominence.retry import CircuitBreaker, RetryBudget, RetryPolicy
+from prominence.transport import create_session, create_transport
 
-__all__ = ['ProminenceClient']
+__all__ = ['ProminenceClient', 'add_default_hook']
+
+# Server used unless PROMINENCE_URL is set
+DEFAULT_URL = 'https://host-130-246-215-158.nubes.stfc.ac.uk/prominence/v1'
+
+# Hooks added to every client
+_default_hooks = []
+
+# Request bodies at least this large are compressed if enabled
+GZIP_THRESHOLD = 64*1024
+
+# Maximum number of responses stored for conditional requests
+MAX_VALIDATORS = 256
+
+# Number of jobs or workflows requested per page when iterating over listings
+PAGE_SIZE = 1000
+
+# Size of chunks read when decoding listings
+CHUNK_SIZE = 64*1024
 
 def filter_job(data, input_only):
     """
@@ -49,6 +78,43 @@ def filter_workflow(data, input_only):
 
     return data
 
+def iter_json_array(chunks):
+    """
+    Yield the items of a JSON array from an iterable of byte strings as soon as each is complete
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break
+            # An item at the end of the buffer may be incomplete, e.g. a number
+            if end == len(buffer):
+                break
+            yield item
+            pos = end
+        buffer = buffer[pos:]
+
+    raise ValueError('incomplete JSON array')
+
 def calculate_sha256(filename):
     """
     Calculate sha256 checksum of the specified file
@@ -56,7 +122,7 @@ def calculate_sha256(filename):
     sha256_hash = hashlib.sha256()
     try:
         with open(filename, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096),b""):
+            for byte_block in iter(lambda: f.read(1024*1024),b""):
                 sha256_hash.update(byte_block)
             return sha256_hash.hexdigest()
     except:
@@ -64,45 +130,329 @@ def calculate_sha256(filename):
 
     return None
 
+def add_default_hook(callback):
+    """
+    Add a hook to every client created subsequently
+    """
+    _default_hooks.append(callback)
+
+class RateLimiter(object):
+    """
+    Limit the rate of an operation to a maximum number of calls per second
+    """
+    def __init__(self, rate):
+        self._interval = 1.0/rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next call is permitted
+        """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
 class ProminenceClient(object):
     """
     PROMINENCE client class
     """
-    def __init__(self, authenticated=False, timeout=150):
-        self._url = os.environ.get('PROMINENCE_URL', 'https://host-130-246-215-158.nubes.stfc.ac.uk/prominence/v1')
+    def __init__(self, authenticated=False, timeout=150, pool_size=10, retries=3, backoff_factor=0.5, session=None,
+                 cache=None, hooks=None, compress=None):
+        self._url = os.environ.get('PROMINENCE_URL', DEFAULT_URL)
         self._timeout = timeout
+        self._headers = {}
+
+        # Local cache of job and workflow descriptions, can be disabled using an environment variable
+        self._cache = None
+        if cache is True:
+            if os.environ.get('PROMINENCE_CACHE') != 'False':
+                self._cache = StateCache(url=self._url)
+        elif cache:
+            self._cache = cache
+
+        # Callbacks fired before and after every HTTP request
+        self._hooks = list(_default_hooks)
+        if hooks:
+            self._hooks.extend(hooks)
+
+        # Last response for each URL polled using conditional requests
+        self._validators = OrderedDict()
+        self._validators_lock = threading.Lock()
+
+        # Large request bodies are only compressed if enabled as not all servers support it
+        self._compress = compress
+        if compress is None:
+            self._compress = os.environ.get('PROMINENCE_COMPRESS_REQUESTS') == 'True'
+
+        # Record of uploaded content
+        self._manifest = UploadManifest()
+
+        # HTTP session shared by all requests made by this client, and by any jobs or workflows using it.
+        # Any transport with the interface of a requests session can be used
+        if session:
+            self._session = session
+        else:
+            self._session = create_transport(None, pool_size, 0)
+
+        # Retries are made by the client rather than the transport so that they are limited by a budget
+        # and a circuit breaker which are shared by all requests
+        self._retry = RetryPolicy(retries, backoff_factor)
+        self._budget = RetryBudget()
+        self._breaker = CircuitBreaker()
 
         self._verify = True
         if 'PROMINENCE_SSL_VERIFY' in os.environ:
             if os.environ['PROMINENCE_SSL_VERIFY'] == 'False':
                 self._verify = False
 
+        # The token is added to each request so that a refreshed token is used by long-lived clients
+        self._token_manager = None
         if authenticated:
-            token = auth.get_token()
-            # Check if we could get a token
-            if not token:
-                raise exceptions.TokenError('Unable to obtain a token')
+            self._token_manager = auth.get_token_manager()
+            with profile.phase('token'):
+                # Check if we could get a token which has not expired
+                if not self._token_manager.get():
+                    raise exceptions.TokenError('Unable to obtain a token')
 
-            # Check if the token has expired
-            if time.time() - auth.get_expiry(token) > 0:
-                raise exceptions.TokenExpiredError('Token has expired')
+    def __enter__(self):
+        return self
 
-            self._headers = {"Authorization":"Bearer %s" % token}
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def session(self):
+        """
+        Return the HTTP session
+        """
+        return self._session
+
+    @property
+    def cache(self):
+        """
+        Return the job and workflow state cache, if any
+        """
+        return self._cache
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        self._session.close()
+        if self._cache:
+            self._cache.close()
+
+    def add_hook(self, callback):
+        """
+        Add a callback fired before and after every HTTP request. It is called with the event ('before'
+        or 'after') and a dict containing the endpoint, method, status, bytes in and out, latency
+        breakdown and any error.
+        """
+        self._hooks.append(callback)
+
+    def remove_hook(self, callback):
+        """
+        Remove a callback
+        """
+        self._hooks.remove(callback)
+
+    def _request(self, method, url, conditional=False, **kwargs):
+        """
+        Make an HTTP request. Compressed responses are accepted and, if enabled, large request bodies
+        sent to the PROMINENCE server are compressed. Conditional GET requests are validated against
+        the last response for the same URL, and a 304 response is replaced by the stored response.
+        """
+        headers = dict(kwargs.get('headers') or {})
+        headers.setdefault('Accept-Encoding', 'gzip')
+        if self._token_manager and url.startswith(self._url):
+            with profile.phase('token'):
+                headers['Authorization'] = 'Bearer %s' % self._token_manager.get()
+
+        data = kwargs.get('data')
+        if self._compress and isinstance(data, (str, bytes)) and len(data) >= GZIP_THRESHOLD and \
+           url.startswith(self._url):
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            kwargs['data'] = gzip.compress(data)
+            headers['Content-Encoding'] = 'gzip'
+
+        key = None
+        if conditional and method == 'GET':
+            key = (url, tuple(sorted((name, str(value)) for name, value in (kwargs.get('params') or {}).items())))
+            with self._validators_lock:
+                stored = self._validators.get(key)
+            if stored:
+                if stored.headers.get('ETag'):
+                    headers['If-None-Match'] = stored.headers['ETag']
+                if stored.headers.get('Last-Modified'):
+                    headers['If-Modified-Since'] = stored.headers['Last-Modified']
+
+        kwargs['headers'] = headers
+        response = self._send_with_retries(method, url, **kwargs)
+
+        if key:
+            with self._validators_lock:
+                if response.status_code == 304 and key in self._validators:
+                    self._validators.move_to_end(key)
+                    return self._validators[key]
+                elif response.status_code == 200 and \
+                     (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+                    self._validators[key] = response
+                    while len(self._validators) > MAX_VALIDATORS:
+                        self._validators.popitem(last=False)
+
+        return response
+
+    def _send_with_retries(self, method, url, **kwargs):
+        """
+        Make an HTTP request, retrying according to the retry policy and budget. Requests to the
+        PROMINENCE server fail immediately while its circuit breaker is open.
+        """
+        breaker = None
+        if url.startswith(self._url):
+            breaker = self._breaker
+            breaker.allow()
+        self._budget.deposit()
+
+        # Request bodies read from files cannot be sent again
+        retries = not kwargs.get('files')
+
+        attempt = 0
+        while True:
+            response = None
+            error = None
+            try:
+                response = self._send(method, url, **kwargs)
+            except requests.exceptions.RequestException as err:
+                error = err
+            except BaseException:
+                # Don't leave the circuit waiting for the result of a trial request forever
+                if breaker:
+                    breaker.release()
+                raise
+
+            failed = error is not None or response.status_code in (429, 502, 503, 504)
+            if breaker:
+                if failed:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+            if not failed or not retries or not self._retry.should_retry(method, attempt, response, error) or \
+               not self._budget.withdraw():
+                if error is not None:
+                    raise error
+                return response
+
+            if response is not None:
+                response.close()
+            time.sleep(self._retry.delay(attempt, response))
+            attempt += 1
+
+            if breaker:
+                breaker.allow()
+
+    def _send(self, method, url, **kwargs):
+        """
+        Make an HTTP request using the session, firing any hooks
+        """
+        call = getattr(self._session, method.lower())
+        if not self._hooks:
+            return call(url, **kwargs)
+
+        endpoint = url.split('?')[0]
+        if endpoint.startswith(self._url):
+            endpoint = endpoint[len(self._url):]
+        data = kwargs.get('data')
+        info = {'endpoint': endpoint,
+                'method': method,
+                'status': None,
+                'bytes_out': len(data) if isinstance(data, (str, bytes)) else 0,
+                'bytes_in': 0,
+                'latency': {'total': 0, 'server': 0, 'transfer': 0},
+                'error': None}
+        for hook in self._hooks:
+            hook('before', info)
+
+        start = time.time()
+        try:
+            response = call(url, **kwargs)
+        except requests.exceptions.RequestException as err:
+            info['error'] = err
+            raise
+        else:
+            # The elapsed time is measured until the response headers have been parsed
+            info['status'] = response.status_code
+            if not kwargs.get('stream'):
+                info['bytes_in'] = int(response.headers.get('Content-Length', len(response.content)))
+            if response.elapsed:
+                info['latency']['server'] = response.elapsed.total_seconds()
+        finally:
+            info['latency']['total'] = time.time() - start
+            info['latency']['transfer'] = max(info['latency']['total'] - info['latency']['server'], 0)
+            for hook in self._hooks:
+                hook('after', info)
+
+        return response
+
+    @staticmethod
+    def _json(response):
+        """
+        Decode a JSON response
+        """
+        with profile.phase('json decode'):
+            return response.json()
+
+    @staticmethod
+    def _query(params, fields, statuses, created_after, created_before, labels):
+        """
+        Add the query parameters for field projection and filters to the parameters of a listing.
+        Returns a function applying the filters to the results, as the server may not support them,
+        and the number of completed jobs or workflows to keep. The server may apply the number
+        before filtering, so in this case all are requested, and so are any fields needed for filtering.
+        """
+        if isinstance(labels, dict):
+            labels = ['%s=%s' % item for item in sorted(labels.items())]
+        filters = query.compile_filter(statuses, created_after, created_before, labels)
+        limit = None
+        if filters and (params.get('completed') or params.get('all')) and params.get('num', -1) > 0:
+            limit = params['num']
+            params['num'] = -1
+
+        if filters and fields:
+            needed = []
+            if statuses or limit:
+                needed.append('status')
+            if limit:
+                needed.append('id')
+            if created_after is not None or created_before is not None:
+                needed.append('events.createTime')
+            if labels:
+                needed.append('labels')
+            fields = list(fields) + [field for field in needed if field not in fields]
+        params.update(query.query_params(fields, statuses, created_after, created_before, labels))
+        return (filters, limit)
 
     def authenticate_user(self):
         """
         Obtain token from OIDC provider
         """
-        token = auth.authenticate_user(create_client_if_needed=True, token_in_file=False)
+        token = auth.authenticate_user(create_client_if_needed=True, token_in_file=False, session=self._session)
         if token:
             print('Successfully retrieved token')
+            self._token_manager = None
             self._headers = {"Authorization":"Bearer %s" % token}
         else:
             raise exceptions.TokenError('Unable to obtain a token')
 
-    def list_jobs(self, status=None, num=1, constraint=None, name_constraint=None, workflow_id=None, detail=False):
+    @staticmethod
+    def _list_jobs_params(status, num, constraint, name_constraint, workflow_id, detail):
         """
-        List running/idle jobs or completed jobs
+        Return the query parameters for listing jobs
         """
         params = {}
 
@@ -127,26 +477,46 @@ class ProminenceClient(object):
         if status == 'idle':
             params['status'] = 'idle'
 
+        return params
+
+    def list_jobs(self, status=None, num=1, constraint=None, name_constraint=None, workflow_id=None, detail=False,
+                  fields=None, statuses=None, created_after=None, created_before=None, labels=None):
+        """
+        List running/idle jobs or completed jobs. Only the specified fields of each job are returned
+        if fields is given, and jobs can be filtered by a list of statuses, creation time and label
+        selectors of the form key=value, key!=value or key.
+        """
+        params = self._list_jobs_params(status, num, constraint, name_constraint, workflow_id, detail)
+        filters, limit = self._query(params, fields, statuses, created_after, created_before, labels)
+
         try:
-            response = requests.get(self._url + '/jobs', params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/jobs', conditional=True, params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            jobs = self._json(response)
+            if self._cache and not fields:
+                self._cache.put_many('job', jobs, detail)
+            if filters:
+                jobs = list(query.last_completed(filter(filters, jobs), limit) if limit else filter(filters, jobs))
+            if fields:
+                jobs = [query.project(job, fields) for job in jobs]
+            return jobs
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.JobGetError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.JobGetError(self._json(response)['error'])
 
         raise exceptions.JobGetError('Unknown error')
 
-    def list_workflows(self, status=None, num=1, constraint=None, name_constraint=None):
+    @staticmethod
+    def _list_workflows_params(status, num, constraint, name_constraint):
         """
-        List running/idle workflows or completed workflows
+        Return the query parameters for listing workflows
         """
         params = {}
 
@@ -165,23 +535,141 @@ class ProminenceClient(object):
         if name_constraint:
             params['name'] = name_constraint
 
+        return params
+
+    def list_workflows(self, status=None, num=1, constraint=None, name_constraint=None, fields=None, statuses=None,
+                       created_after=None, created_before=None, labels=None):
+        """
+        List running/idle workflows or completed workflows, optionally with only the specified fields
+        and filtered in the same way as list_jobs
+        """
+        params = self._list_workflows_params(status, num, constraint, name_constraint)
+        filters, limit = self._query(params, fields, statuses, created_after, created_before, labels)
+
         try:
-            response = requests.get(self._url + '/workflows', params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/workflows', conditional=True, params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            workflows = self._json(response)
+            if self._cache and not fields:
+                self._cache.put_many('workflow', workflows)
+            if filters:
+                workflows = list(query.last_completed(filter(filters, workflows), limit) if limit
+                                 else filter(filters, workflows))
+            if fields:
+                workflows = [query.project(workflow, fields) for workflow in workflows]
+            return workflows
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.WorkflowGetError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.WorkflowGetError(self._json(response)['error'])
 
         raise exceptions.WorkflowGetError('Unknown error')
 
+    def iter_jobs(self, status=None, num=1, constraint=None, name_constraint=None, workflow_id=None, detail=False,
+                  page_size=PAGE_SIZE, fields=None, statuses=None, created_after=None, created_before=None,
+                  labels=None):
+        """
+        Iterate over running/idle jobs or completed jobs, fetching them in pages, optionally with only
+        the specified fields and filtered in the same way as list_jobs
+        """
+        params = self._list_jobs_params(status, num, constraint, name_constraint, workflow_id, detail)
+        filters, limit = self._query(params, fields, statuses, created_after, created_before, labels)
+        return self._iter_list('/jobs', params, 'job', detail, exceptions.JobGetError, page_size, fields, filters,
+                               limit)
+
+    def iter_workflows(self, status=None, num=1, constraint=None, name_constraint=None, page_size=PAGE_SIZE,
+                       fields=None, statuses=None, created_after=None, created_before=None, labels=None):
+        """
+        Iterate over running/idle workflows or completed workflows, fetching them in pages, optionally
+        with only the specified fields and filtered in the same way as list_jobs
+        """
+        params = self._list_workflows_params(status, num, constraint, name_constraint)
+        filters, limit = self._query(params, fields, statuses, created_after, created_before, labels)
+        return self._iter_list('/workflows', params, 'workflow', False, exceptions.WorkflowGetError, page_size,
+                               fields, filters, limit)
+
+    def _iter_list(self, path, params, resource, detail, error, page_size, fields=None, filters=None, limit=None):
+        """
+        Return an iterator over jobs or workflows from a listing, applying filters and keeping only
+        the last limit completed ones, before projecting the requested fields
+        """
+        items = self._iter_pages(path, params, resource, detail, error, page_size, not fields, filters)
+        if limit:
+            items = query.last_completed(items, limit)
+        if fields:
+            items = (query.project(item, fields) for item in items)
+        return items
+
+    def _iter_pages(self, path, params, resource, detail, error, page_size, cache=True, filters=None):
+        """
+        Yield jobs or workflows from a listing. Pages are requested using an offset and limit, and
+        each page is decoded incrementally as it is received so that memory use does not depend on
+        the number of items. If the server returns more items than requested, or a page contains no
+        new items, paging is not supported and the listing is complete.
+        """
+        offset = 0
+        previous = set()
+        while True:
+            try:
+                response = self._request('GET',
+                                         self._url + path,
+                                         params=dict(params, offset=offset, limit=page_size),
+                                         stream=True,
+                                         timeout=self._timeout,
+                                         headers=self._headers,
+                                         verify=self._verify)
+            except requests.exceptions.RequestException as err:
+                raise exceptions.ConnectionError(err)
+
+            if response.status_code == 401:
+                raise exceptions.AuthenticationError()
+            elif response.status_code == 404:
+                raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
+            elif response.status_code != 200:
+                if response.status_code < 500 and 'error' in self._json(response):
+                    raise error(self._json(response)['error'])
+                raise error('Unknown error')
+
+            count = 0
+            new = 0
+            ids = set()
+            batch = []
+            try:
+                for item in iter_json_array(response.iter_content(chunk_size=CHUNK_SIZE)):
+                    count += 1
+                    ids.add(item.get('id'))
+                    if item.get('id') in previous:
+                        continue
+                    new += 1
+                    if self._cache and cache:
+                        batch.append(item)
+                        if len(batch) == 100:
+                            self._cache.put_many(resource, batch, detail)
+                            batch = []
+                    if filters and not filters(item):
+                        continue
+                    yield item
+            except requests.exceptions.RequestException as err:
+                raise exceptions.ConnectionError(err)
+            except ValueError as err:
+                raise error('Invalid response from the PROMINENCE server: %s' % err)
+            finally:
+                response.close()
+
+            if self._cache and batch:
+                self._cache.put_many(resource, batch, detail)
+
+            if count != page_size or new == 0:
+                return
+            offset += count
+            previous = ids
+
     def execute_command(self, job_id, command):
         """
         Execute a command inside a job
@@ -193,7 +681,7 @@ class ProminenceClient(object):
         params['command'] = ','.join(command)
 
         try:
-            response = requests.post(self._url + '/jobs/%d/exec' % job_id, timeout=self._timeout, headers=headers, params=params, verify=self._verify)
+            response = self._request('POST', self._url + '/jobs/%d/exec' % job_id, timeout=self._timeout, headers=headers, params=params, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -203,8 +691,8 @@ class ProminenceClient(object):
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
-        elif 'error' in response.json():
-            raise exceptions.ExecError(response.json()['error'])
+        elif 'error' in self._json(response):
+            raise exceptions.ExecError(self._json(response)['error'])
 
         raise exceptions.ExecError('Unknown error')
 
@@ -213,19 +701,19 @@ class ProminenceClient(object):
         Get the URL of the current snapshot
         """
         try:
-            response = requests.get(self._url + '/jobs/%d/snapshot' % job_id, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/jobs/%d/snapshot' % job_id, timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            return self._json(response)
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.SnapshotGetError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.SnapshotGetError(self._json(response)['error'])
 
         raise exceptions.SnapshotGetError('Unknown error')
 
@@ -240,7 +728,7 @@ class ProminenceClient(object):
         params['path'] = path
 
         try:
-            response = requests.put(self._url + '/jobs/%d/snapshot' % job_id, timeout=self._timeout, headers=headers, params=params, verify=self._verify)
+            response = self._request('PUT', self._url + '/jobs/%d/snapshot' % job_id, timeout=self._timeout, headers=headers, params=params, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -250,8 +738,8 @@ class ProminenceClient(object):
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
-        elif 'error' in response.json():
-            raise exceptions.SnapshotCreateError(response.json()['error'])
+        elif 'error' in self._json(response):
+            raise exceptions.SnapshotCreateError(self._json(response)['error'])
 
         raise exceptions.SnapshotCreateError('Unknown error')
 
@@ -272,23 +760,80 @@ class ProminenceClient(object):
                             task['runtime'] = 'udocker'
 
         try:
-            response = requests.post(self._url + '/jobs', data=json.dumps(job), timeout=self._timeout, headers=headers, verify=self._verify)
+            response = self._request('POST', self._url + '/jobs', data=json.dumps(job), timeout=self._timeout, headers=headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 201:
-            if 'id' in response.json():
-                return response.json()['id']
+            if 'id' in self._json(response):
+                return self._json(response)['id']
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.JobCreationError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.JobCreationError(self._json(response)['error'])
 
         raise exceptions.JobCreationError('Unknown error')
 
+    def iter_create_jobs(self, jobs, concurrency=10, rate=None):
+        """
+        Create jobs from an iterable of JSON descriptions, yielding (index, id, error) as each
+        submission completes. At most 2 x concurrency jobs are read ahead of the completed ones. If
+        reading the descriptions fails, the results of jobs already submitted are yielded first.
+        """
+        limiter = None
+        if rate:
+            limiter = RateLimiter(rate)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            pending = {}
+            try:
+                for index, job in enumerate(jobs):
+                    while len(pending) >= 2*concurrency:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield self._create_jobs_result(pending.pop(future), future)
+                    if limiter:
+                        limiter.wait()
+                    pending[executor.submit(self.create_job, job)] = index
+            except Exception:
+                # Report the jobs already submitted before the error reading the descriptions
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._create_jobs_result(pending.pop(future), future)
+                raise
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._create_jobs_result(pending.pop(future), future)
+
+    @staticmethod
+    def _create_jobs_result(index, future):
+        """
+        Convert a job creation future into an (index, id, error) tuple. Any other error, e.g. from a
+        malformed description, is reported as a JobCreationError for that job only.
+        """
+        try:
+            return (index, future.result(), None)
+        except exceptions.ProminenceError as err:
+            return (index, None, err)
+        except Exception as err:
+            return (index, None, exceptions.JobCreationError('Invalid job description: %s: %s' % (type(err).__name__, err)))
+
+    def create_jobs(self, jobs, concurrency=10, rate=None):
+        """
+        Create jobs from an iterable of JSON descriptions concurrently, optionally limiting the
+        number of submissions per second. Returns a list of (id, error) in the original order.
+        """
+        results = {}
+        for index, job_id, error in self.iter_create_jobs(jobs, concurrency, rate):
+            results[index] = (job_id, error)
+        return [results[index] for index in range(len(results))]
+
     def create_workflow(self, workflow):
         """
         Create a workflow from a JSON description
@@ -297,20 +842,20 @@ class ProminenceClient(object):
         headers['Content-type'] = 'application/json'
 
         try:
-            response = requests.post(self._url + '/workflows', data=json.dumps(workflow), timeout=self._timeout, headers=headers, verify=self._verify)
+            response = self._request('POST', self._url + '/workflows', data=json.dumps(workflow), timeout=self._timeout, headers=headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 201:
-            if 'id' in response.json():
-                return response.json()['id']
+            if 'id' in self._json(response):
+                return self._json(response)['id']
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.WorkflowCreationError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.WorkflowCreationError(self._json(response)['error'])
 
         raise exceptions.WorkflowCreationError('Unknown error')
 
@@ -318,21 +863,24 @@ class ProminenceClient(object):
         """
         Rerun any failed jobs from a completed workflow
         """
+        if self._cache:
+            self._cache.invalidate('workflow', resource_id)
+
         try:
-            response = requests.put(self._url + '/workflows/%d' % resource_id, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('PUT', self._url + '/workflows/%d' % resource_id, timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            if 'id' in response.json():
-                return response.json()['id']
+            if 'id' in self._json(response):
+                return self._json(response)['id']
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.WorkflowCreationError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.WorkflowCreationError(self._json(response)['error'])
 
         raise exceptions.WorkflowCreationError('Unknown error')
 
@@ -341,23 +889,23 @@ class ProminenceClient(object):
         Clone a job or workflow
         """
         try:
-            response = requests.put(self._url + '/%ss/%d/clone' % (resource_type, resource_id), timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('PUT', self._url + '/%ss/%d/clone' % (resource_type, resource_id), timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 201:
-            if 'id' in response.json():
-                return response.json()['id']
+            if 'id' in self._json(response):
+                return self._json(response)['id']
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
+            if 'error' in self._json(response):
                 if resource_type == 'workflow':
-                    raise exceptions.WorkflowCreationError(response.json()['error'])
+                    raise exceptions.WorkflowCreationError(self._json(response)['error'])
                 else:
-                    raise exceptions.JobCreationError(response.json()['error'])
+                    raise exceptions.JobCreationError(self._json(response)['error'])
 
         if resource_type == 'workflow':
             raise exceptions.WorkflowCreationError('Unknown error')
@@ -369,7 +917,7 @@ class ProminenceClient(object):
         Remove a completed job or workflow from the queue
         """
         try:
-            response = requests.put(self._url + '/%ss/%d/remove' % (resource_type, resource_id), timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('PUT', self._url + '/%ss/%d/remove' % (resource_type, resource_id), timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -380,8 +928,8 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.RemoveFromQueueError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.RemoveFromQueueError(self._json(response)['error'])
 
         raise exceptions.RemoveFromQueueError('Unknown error')
 
@@ -402,7 +950,7 @@ class ProminenceClient(object):
         Delete the specified job or workflow
         """
         try:
-            response = requests.delete(self._url + '/%s/%d' % (resource, id), timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('DELETE', self._url + '/%s/%d' % (resource, id), timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -415,23 +963,32 @@ class ProminenceClient(object):
         elif response.status_code == 500:
             raise exceptions.DeletionError('Got a 500 internal server error from PROMINENCE')
         else:
-            if 'error' in response.json():
-                raise exceptions.DeletionError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.DeletionError(self._json(response)['error'])
 
         raise exceptions.DeletionError('Unknown error')
 
-    def describe_job(self, job_id, input_only=False):
+    def describe_job(self, job_id, input_only=False, fields=None):
         """
-        Describe a specific job
+        Describe a specific job, optionally returning only the specified fields
         """
+        # Jobs in a terminal state never change so can be returned from the cache
+        if self._cache:
+            job = self._cache.get_frozen('job', job_id, detail=True)
+            if job:
+                return query.project(filter_job(job, input_only), fields)
+
         try:
-            response = requests.get(self._url + '/jobs/%d' % job_id, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/jobs/%d' % job_id, conditional=True, params=query.query_params(fields), timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            if response.json():
-                return filter_job(response.json()[0], input_only)
+            if self._json(response):
+                job = self._json(response)[0]
+                if self._cache and not fields:
+                    self._cache.put('job', job, detail=True)
+                return query.project(filter_job(job, input_only), fields)
             else:
                 raise exceptions.JobGetError('No such job')
         elif response.status_code == 401:
@@ -439,23 +996,32 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.JobGetError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.JobGetError(self._json(response)['error'])
 
         raise exceptions.JobGetError('Unknown error')
 
-    def describe_workflow(self, workflow_id, input_only):
+    def describe_workflow(self, workflow_id, input_only=False, fields=None):
         """
-        Describe a specific workflow
+        Describe a specific workflow, optionally returning only the specified fields
         """
+        # Workflows in a terminal state never change so can be returned from the cache
+        if self._cache:
+            workflow = self._cache.get_frozen('workflow', workflow_id, detail=True)
+            if workflow:
+                return query.project(filter_workflow(workflow, input_only), fields)
+
         try:
-            response = requests.get(self._url + '/workflows/%d' % workflow_id, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/workflows/%d' % workflow_id, conditional=True, params=query.query_params(fields), timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            if response.json():
-                return filter_workflow(response.json()[0], input_only)
+            if self._json(response):
+                workflow = self._json(response)[0]
+                if self._cache and not fields:
+                    self._cache.put('workflow', workflow, detail=True)
+                return query.project(filter_workflow(workflow, input_only), fields)
             else:
                 raise exceptions.JobGetError('No such workflow')
         elif response.status_code == 401:
@@ -463,8 +1029,8 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         elif response.status_code < 500:
-            if 'error' in response.json():
-                raise exceptions.WorkflowGetError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.WorkflowGetError(self._json(response)['error'])
 
         raise exceptions.WorkflowGetError('Unknown error')
 
@@ -495,7 +1061,7 @@ class ProminenceClient(object):
         params = {'node': node, 'offset': offset}
 
         try:
-            response = requests.get(self._url + path, params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + path, params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -506,8 +1072,8 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.StdStreamsError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.StdStreamsError(self._json(response)['error'])
 
         raise exceptions.StdStreamsError('Unknown error')
 
@@ -538,7 +1104,7 @@ class ProminenceClient(object):
         params = {'node': node, 'offset': offset}
 
         try:
-            response = requests.get(self._url + path, params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + path, params=params, timeout=self._timeout, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -549,45 +1115,35 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.StdStreamsError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.StdStreamsError(self._json(response)['error'])
 
         raise exceptions.StdStreamsError('Unknown error')
 
-    def upload(self, file, filename, checksum=None):
+    def upload(self, file, filename, checksum=None, concurrency=4):
         """
-        Upload a file to transient cloud storage
-        """            
-        # Calculate checksum if not supplied and file size is not too big (Python requests & urllib3
-        # don't support streaming uploads of files > 2 GB when additional data is specified)
-        if not checksum and os.path.getsize(filename) < 2147483647:
-            checksum = calculate_sha256(filename)
-
-        data = {'filename':file,
-                'checksum': checksum}
-
-        headers = dict(self._headers)
-        headers['Content-type'] = 'application/json'
-        
-        try:
-            response = requests.post(self._url + '/data/upload', data=json.dumps(data), headers=headers, verify=self._verify)
-        except requests.exceptions.RequestException as err:
-            raise exceptions.ConnectionError(err)
-
-        fields = None
-        if response.status_code == 201:
-            if 'url' in response.json():
-                url = response.json()['url']
-            if 'fields' in response.json():
-                fields = response.json()['fields']
-        elif response.status_code == 401:
-            raise exceptions.AuthenticationError()
-        elif response.status_code == 404:
-            raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
-        else:
-            if 'error' in response.json():
-                raise exceptions.FileUploadError(response.json()['error'])
-            raise exceptions.FileUploadError('Unknown error when querying the PROMINENCE server')
+        Upload a file to transient cloud storage, unless identical content has already been uploaded
+        with the same name
+        """
+        # Large files are not checksummed in advance so that uploads to blob storage, which calculate
+        # the checksum while uploading, only read them once. Otherwise calculate the checksum if not
+        # supplied and the file is not too big
+        size = os.path.getsize(filename)
+        large = size >= MULTIPART_THRESHOLD
+        if not checksum and not large:
+            checksum = self._manifest.file_checksum(filename) or calculate_sha256(filename)
+
+        known_checksum = checksum or self._manifest.file_checksum(filename)
+        if known_checksum and self._manifest.object_checksum(file) == known_checksum:
+            if self._object_exists(file, size):
+                return True
+
+        url, fields = self._upload_url(file, checksum)
+
+        # Other storage needs the checksum up front, so ask again including it
+        if large and 'windows' not in url and not checksum and size <= MAX_CHECKSUM_SIZE:
+            checksum = self._manifest.file_checksum(filename) or calculate_sha256(filename)
+            url, fields = self._upload_url(file, checksum)
 
         # Upload
         headers = {}
@@ -595,26 +1151,32 @@ class ProminenceClient(object):
             # Header required for Azure blob storage
             headers['x-ms-blob-type'] = 'BlockBlob'
 
-        if fields:
+        if large and 'windows' in url:
+            # Upload blocks in parallel to Azure blob storage
+            try:
+                checksum = upload_blocks(self._session, url, filename, concurrency=concurrency)
+            except IOError as err:
+                raise exceptions.FileUploadError(err)
+            self._manifest.record(file, filename, checksum)
+            return True
+        elif fields:
             # Used for S3 when supplying checksum
             try:
                 with open(filename, 'rb') as fh:
                     files = {'file': (file, fh)}
-                    response = requests.post(url, data=fields, files=files)
+                    response = self._request('POST', url, data=fields, files=files)
             except requests.exceptions.RequestException as err:
                 raise exceptions.ConnectionError(err)
             except IOError as err:
                 raise exceptions.FileUploadError(err)
         else:
             try:
-                with open(filename, 'rb') as file_obj:
-                    response = requests.put(url, data=file_obj, headers=headers, timeout=30)
-            except requests.exceptions.RequestException as err:
-                raise exceptions.ConnectionError(err)
+                response, checksum = upload_stream(self._session, url, filename, headers=headers, timeout=30)
             except IOError as err:
                 raise exceptions.FileUploadError(err)
 
         if response.status_code == 200 or response.status_code == 201 or response.status_code == 204:
+            self._manifest.record(file, filename, checksum)
             return True
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
@@ -623,6 +1185,71 @@ class ProminenceClient(object):
 
         raise exceptions.FileUploadError('Got status code', response.status_code, 'from cloud storage')
 
+    def _upload_url(self, file, checksum):
+        """
+        Return the URL and any form fields to use for uploading a file to cloud storage
+        """
+        data = {'filename':file,
+                'checksum': checksum}
+
+        headers = dict(self._headers)
+        headers['Content-type'] = 'application/json'
+
+        try:
+            response = self._request('POST', self._url + '/data/upload', data=json.dumps(data), headers=headers, verify=self._verify)
+        except requests.exceptions.RequestException as err:
+            raise exceptions.ConnectionError(err)
+
+        url = None
+        fields = None
+        if response.status_code == 201:
+            if 'url' in self._json(response):
+                url = self._json(response)['url']
+            if 'fields' in self._json(response):
+                fields = self._json(response)['fields']
+        elif response.status_code == 401:
+            raise exceptions.AuthenticationError()
+        elif response.status_code == 404:
+            raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
+        else:
+            if 'error' in self._json(response):
+                raise exceptions.FileUploadError(self._json(response)['error'])
+            raise exceptions.FileUploadError('Unknown error when querying the PROMINENCE server')
+
+        if not url:
+            raise exceptions.FileUploadError('Unknown error when querying the PROMINENCE server')
+        return (url, fields)
+
+    def upload_content(self, filename, checksum=None, suffix=''):
+        """
+        Upload a file to transient cloud storage using a name derived from its content, returning
+        the name. Nothing is uploaded if an object with this name already exists.
+        """
+        if not checksum:
+            checksum = self._manifest.file_checksum(filename) or calculate_sha256(filename)
+        name = '%s%s' % (checksum, suffix)
+
+        if self._object_exists(name, os.path.getsize(filename)):
+            self._manifest.record(name, filename, checksum)
+        else:
+            self.upload(name, filename, checksum)
+
+        return name
+
+    def _object_exists(self, name, size):
+        """
+        Check if an object with the specified name and size exists in cloud storage
+        """
+        try:
+            objects = self.list_objects(None)
+        except exceptions.ObjectError:
+            return False
+
+        for item in objects:
+            if item.get('name') == name and item.get('size') == size:
+                return True
+        return False
+
     def list_objects(self, path):
         """
         List objects in cloud storage
@@ -632,19 +1259,19 @@ class ProminenceClient(object):
             url += '/%s' % path
 
         try:
-            response = requests.get(url, headers=self._headers, verify=self._verify)
+            response = self._request('GET', url, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            return self._json(response)
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.ObjectError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.ObjectError(self._json(response)['error'])
             raise exceptions.ObjectError('Unknown error when querying the PROMINENCE server')
 
     def delete_object(self, object):
@@ -653,7 +1280,7 @@ class ProminenceClient(object):
         """
         url = self._url + '/data/' + object
         try:
-            response = requests.delete(url, headers=self._headers, verify=self._verify)
+            response = self._request('DELETE', url, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -664,8 +1291,8 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.ObjectError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.ObjectError(self._json(response)['error'])
             raise exceptions.ObjectError('Unknown error when querying the PROMINENCE server')
 
         return False
@@ -683,12 +1310,12 @@ class ProminenceClient(object):
             params['show_all_users'] = 'true'
 
         try:
-            response = requests.get(self._url + '/accounting', params=params, headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/accounting', params=params, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            return self._json(response)
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
@@ -696,8 +1323,8 @@ class ProminenceClient(object):
         elif response.status_code == 500:
             raise exceptions.UsageError('Unknown error when querying the PROMINENCE server')
         else:
-            if 'error' in response.json():
-                raise exceptions.UsageError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.UsageError(self._json(response)['error'])
             raise exceptions.UsageError('Unknown error when querying the PROMINENCE server')
 
         return {}
@@ -707,19 +1334,19 @@ class ProminenceClient(object):
         List resources
         """
         try:
-            response = requests.get(self._url + '/resources', headers=self._headers, verify=self._verify)
+            response = self._request('GET', self._url + '/resources', headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            return self._json(response)
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.KeyValueError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.KeyValueError(self._json(response)['error'])
             raise exceptions.KeyValueError('Unknown error when querying the PROMINENCE server')
 
     def kv_list(self, path=None):
@@ -739,19 +1366,19 @@ class ProminenceClient(object):
         params['list'] = 'true'
 
         try:
-            response = requests.get(url, headers=self._headers, params=params, verify=self._verify)
+            response = self._request('GET', url, headers=self._headers, params=params, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 200:
-            return response.json()
+            return self._json(response)
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.KeyValueError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.KeyValueError(self._json(response)['error'])
             raise exceptions.KeyValueError('Unknown error when querying the PROMINENCE server')
 
     def kv_get(self, key):
@@ -761,7 +1388,7 @@ class ProminenceClient(object):
         url = '%s/kv/%s' % (self._url, key)
 
         try:
-            response = requests.get(url, headers=self._headers, verify=self._verify)
+            response = self._request('GET', url, conditional=True, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -770,13 +1397,13 @@ class ProminenceClient(object):
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
-            if 'error' in response.json():
-                if 'No such key' in response.json()['error']:
+            if 'error' in self._json(response):
+                if 'No such key' in self._json(response)['error']:
                     raise exceptions.NoSuchKey()
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.KeyValueError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.KeyValueError(self._json(response)['error'])
             raise exceptions.KeyValueError('Unknown error when querying the PROMINENCE server')
 
     def kv_set(self, key, value):
@@ -786,19 +1413,19 @@ class ProminenceClient(object):
         url = '%s/kv/%s' % (self._url, key)
 
         try:
-            response = requests.post(url, headers=self._headers, verify=self._verify, data=value)
+            response = self._request('POST', url, headers=self._headers, verify=self._verify, data=value)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
         if response.status_code == 201:
-            return response.json()
+            return self._json(response)
         elif response.status_code == 401:
             raise exceptions.AuthenticationError()
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.KeyValueError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.KeyValueError(self._json(response)['error'])
             raise exceptions.KeyValueError('Unknown error when querying the PROMINENCE server')
 
     def kv_delete(self, key, prefix):
@@ -815,7 +1442,7 @@ class ProminenceClient(object):
             params['prefix'] = True
 
         try:
-            response = requests.delete(url, params=params, headers=self._headers, verify=self._verify)
+            response = self._request('DELETE', url, params=params, headers=self._headers, verify=self._verify)
         except requests.exceptions.RequestException as err:
             raise exceptions.ConnectionError(err)
 
@@ -826,8 +1453,8 @@ class ProminenceClient(object):
         elif response.status_code == 404:
             raise exceptions.ConnectionError('Invalid PROMINENCE URL, got a 404 not found error')
         else:
-            if 'error' in response.json():
-                raise exceptions.KeyValueError(response.json()['error'])
+            if 'error' in self._json(response):
+                raise exceptions.KeyValueError(self._json(response)['error'])
             raise exceptions.KeyValueError('Unknown error when querying the PROMINENCE server')
 
         return False
@@ -0,0 +1,329 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+
+from prominence import exceptions
+
+__all__ = ['download_file', 'DownloadManager', 'FileProgress']
+
+# Size of chunks read from the network
+CHUNK_SIZE = 1024*1024
+
+# Files at least this large are downloaded using multiple byte-range streams
+PARALLEL_THRESHOLD = 64*1024*1024
+
+def _probe(session, url, timeout):
+    """
+    Find the size of a remote file and whether byte-range requests are supported. If byte ranges
+    are not supported the response is returned so that its content can be used directly.
+    """
+    response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=timeout)
+    etag = response.headers.get('etag')
+
+    if response.status_code in (206, 416):
+        response.close()
+        content_range = response.headers.get('content-range', '')
+        if '/' in content_range and not content_range.endswith('*'):
+            return (int(content_range.split('/')[-1]), True, etag, None)
+        return (None, False, etag, None)
+    elif response.status_code == 200:
+        size = response.headers.get('content-length')
+        if size is not None:
+            size = int(size)
+        return (size, False, etag, response)
+
+    response.close()
+    raise exceptions.DownloadError('Got status code %d when downloading file' % response.status_code)
+
+def _sha256(filename):
+    """
+    Calculate sha256 checksum of the specified file
+    """
+    sha256_hash = hashlib.sha256()
+    with open(filename, 'rb') as fh:
+        for block in iter(lambda: fh.read(CHUNK_SIZE), b''):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
+
+class FileProgress(object):
+    """
+    Progress of a single file download
+    """
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self.filename = filename
+        self.size = None
+        self.done = 0
+        self.transferred = 0
+        self.status = 'pending'
+        self.error = None
+
+    def set_size(self, size):
+        """
+        Set the total size of the file, if known
+        """
+        self.size = size
+
+    def add(self, length, transferred=True):
+        """
+        Record bytes downloaded, or found to have been downloaded previously
+        """
+        with self._lock:
+            self.done += length
+            if transferred:
+                self.transferred += length
+
+class _State(object):
+    """
+    Progress of a partial download, stored next to the partial file so that it can be resumed
+    """
+    def __init__(self, filename, size, etag, streams, resume=True, progress=None):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._progress = progress
+        self.size = size
+        self.etag = etag
+        self.segments = []
+
+        if resume:
+            try:
+                with open(filename) as fh:
+                    data = json.load(fh)
+                if data['size'] == size and (not etag or not data['etag'] or data['etag'] == etag):
+                    self.segments = data['segments']
+            except (IOError, ValueError, KeyError):
+                pass
+
+        if not self.segments:
+            length = -(-size // streams)
+            self.segments = [{'start': start, 'end': min(start + length, size) - 1, 'done': 0}
+                             for start in range(0, size, length)]
+
+    @property
+    def resumable(self):
+        """
+        Return True if a previous partial download can be continued
+        """
+        return any(segment['done'] > 0 for segment in self.segments)
+
+    def add(self, segment, length):
+        """
+        Record bytes written to a segment
+        """
+        with self._lock:
+            segment['done'] += length
+        if self._progress:
+            self._progress.add(length)
+
+    def save(self):
+        """
+        Write the current progress to disk
+        """
+        with self._lock:
+            data = json.dumps({'size': self.size, 'etag': self.etag, 'segments': self.segments})
+        with open(self._filename, 'w') as fh:
+            fh.write(data)
+
+    def remove(self):
+        """
+        Delete the progress file
+        """
+        if os.path.exists(self._filename):
+            os.unlink(self._filename)
+
+def _fetch_segment(session, url, part, segment, state, timeout, retries):
+    """
+    Download a byte range into the partial file, retrying from the last byte written
+    """
+    failures = 0
+    while segment['start'] + segment['done'] <= segment['end']:
+        offset = segment['start'] + segment['done']
+        try:
+            response = session.get(url,
+                                   headers={'Range': 'bytes=%d-%d' % (offset, segment['end'])},
+                                   stream=True,
+                                   timeout=timeout)
+            if response.status_code != 206:
+                raise exceptions.DownloadError('Got status code %d for byte-range request' % response.status_code)
+
+            with open(part, 'r+b') as fh:
+                fh.seek(offset)
+                for count, data in enumerate(response.iter_content(chunk_size=CHUNK_SIZE)):
+                    fh.write(data)
+                    state.add(segment, len(data))
+                    if count % 16 == 15:
+                        fh.flush()
+                        state.save()
+            state.save()
+            if segment['start'] + segment['done'] == offset:
+                raise exceptions.DownloadError('No data received for byte-range request')
+        except (requests.exceptions.RequestException, exceptions.DownloadError) as err:
+            failures += 1
+            if failures > retries:
+                raise exceptions.DownloadError(err)
+
+def _fetch_whole(response, part, progress):
+    """
+    Download an entire file in a single stream into the partial file
+    """
+    with open(part, 'wb') as fh:
+        for data in response.iter_content(chunk_size=CHUNK_SIZE):
+            fh.write(data)
+            if progress:
+                progress.add(len(data))
+
+def download_file(url, filename, session=None, streams=4, force=False, checksum=None, timeout=30, retries=3,
+                  progress=None):
+    """
+    Download a URL to a file. A partial download left by a previous attempt is resumed, files of at
+    least 64 MB are downloaded using parallel byte-range streams, and the file is only renamed into
+    place once its size, and sha256 checksum if given, has been verified. Returns False if a complete
+    file already exists and force is not set, otherwise True. Progress is reported to the optional
+    FileProgress.
+    """
+    if not session:
+        session = requests
+
+    part = '%s.part' % filename
+
+    try:
+        size, ranges, etag, response = _probe(session, url, timeout)
+    except requests.exceptions.RequestException as err:
+        raise exceptions.DownloadError(err)
+
+    if progress:
+        progress.set_size(size)
+
+    # Keep an existing complete file
+    if not force and size is not None and os.path.isfile(filename) and os.path.getsize(filename) == size:
+        if not checksum or _sha256(filename) == checksum:
+            if response:
+                response.close()
+            if progress:
+                progress.add(size, transferred=False)
+            return False
+
+    try:
+        if ranges and size > 0:
+            if size < PARALLEL_THRESHOLD:
+                streams = 1
+            state = _State('%s.json' % part, size, etag, max(streams, 1), os.path.isfile(part), progress)
+            if not state.resumable:
+                with open(part, 'wb') as fh:
+                    fh.truncate(size)
+            elif progress:
+                progress.add(sum(segment['done'] for segment in state.segments), transferred=False)
+
+            with ThreadPoolExecutor(len(state.segments)) as executor:
+                futures = [executor.submit(_fetch_segment, session, url, part, segment, state, timeout, retries)
+                           for segment in state.segments]
+                for future in futures:
+                    future.result()
+            state.remove()
+        else:
+            if not response:
+                response = session.get(url, stream=True, timeout=timeout)
+                if response.status_code != 200:
+                    raise exceptions.DownloadError('Got status code %d when downloading file' % response.status_code)
+            _fetch_whole(response, part, progress)
+    except requests.exceptions.RequestException as err:
+        raise exceptions.DownloadError(err)
+    except (IOError, OSError) as err:
+        raise exceptions.IOError(err)
+
+    # Check integrity before moving the file into place
+    if size is not None and os.path.getsize(part) != size:
+        raise exceptions.DownloadError('Downloaded file has size %d but expected %d' % (os.path.getsize(part), size))
+    if checksum and _sha256(part) != checksum:
+        os.unlink(part)
+        raise exceptions.DownloadError('Checksum of downloaded file does not match')
+
+    try:
+        os.replace(part, filename)
+    except OSError as err:
+        raise exceptions.IOError(err)
+    return True
+
+class DownloadManager(object):
+    """
+    Download many files concurrently using threads which share a single connection pool, keeping
+    track of the progress and any failure of each file
+    """
+    def __init__(self, session=None, concurrency=10, streams=4, force=False):
+        self._session = session
+        self._concurrency = concurrency
+        self._streams = streams
+        self._force = force
+        self._downloads = []
+        self._start = None
+
+    @property
+    def files(self):
+        """
+        Return the progress of each file
+        """
+        return [progress for _, progress, _ in self._downloads]
+
+    @property
+    def failures(self):
+        """
+        Return the files which could not be downloaded
+        """
+        return [progress for progress in self.files if progress.status == 'failed']
+
+    def add(self, url, filename, checksum=None):
+        """
+        Add a file to be downloaded
+        """
+        self._downloads.append((url, FileProgress(filename), checksum))
+
+    def _download(self, url, progress, checksum):
+        """
+        Download a single file, recording the outcome
+        """
+        progress.status = 'downloading'
+        try:
+            if download_file(url, progress.filename, self._session, self._streams, self._force, checksum,
+                             progress=progress):
+                progress.status = 'done'
+            else:
+                progress.status = 'skipped'
+        except Exception as err:
+            # Any error must be recorded, as nothing else sees exceptions raised in the thread pool
+            progress.status = 'failed'
+            progress.error = err
+
+    def rate(self):
+        """
+        Return the aggregate download rate in bytes per second
+        """
+        if not self._start or time.time() <= self._start:
+            return 0
+        return sum(progress.transferred for progress in self.files) / (time.time() - self._start)
+
+    def eta(self):
+        """
+        Return the estimated number of seconds remaining, or None if unknown
+        """
+        rate = self.rate()
+        if rate == 0 or any(progress.size is None for progress in self.files):
+            return None
+        return sum(progress.size - progress.done for progress in self.files) / rate
+
+    def run(self, report=None, interval=1):
+        """
+        Download all files, calling report with this manager periodically. Returns the failed files.
+        """
+        self._start = time.time()
+        with ThreadPoolExecutor(self._concurrency) as executor:
+            futures = [executor.submit(self._download, *download) for download in self._downloads]
+            while futures:
+                _, futures = wait(futures, timeout=interval)
+                if report:
+                    report(self)
+
+        return self.failures
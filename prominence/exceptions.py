@@ -40,6 +40,12 @@ class ConnectionError(ProminenceError):
     """
     pass
 
+class CircuitOpenError(ConnectionError):
+    """
+    Raised without making a request while the PROMINENCE server is considered to be unavailable
+    """
+    pass
+
 class RemoveFromQueueError(ProminenceError):
     """
     Raised when removing a job or workflow from the queue
@@ -82,6 +88,12 @@ class FileUploadError(ProminenceError):
     """
     pass
 
+class DownloadError(ProminenceError):
+    """
+    Raised when a file download fails
+    """
+    pass
+
 class StdStreamsError(ProminenceError):
     """
     Raised when there is a problem getting the standard output or error
@@ -0,0 +1,534 @@
+"""
+Local stand-in for the PROMINENCE REST API, for tests and benchmarks
+
+Implements the /jobs, /workflows, /data, /kv, /accounting and /resources endpoints used by the
+client, backed by a configurable number of synthetic jobs and workflows, with optional latency and
+error injection. Run it from the command line using
+
+    python -m prominence.fakeserver --jobs 100000 --port 8080
+
+and set PROMINENCE_URL to the URL printed.
+"""
+from __future__ import print_function
+import argparse
+import gzip
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from prominence import query
+from prominence.cache import TERMINAL_STATES
+
+__all__ = ['FakeServer', 'synthetic_job', 'synthetic_workflow']
+
+# Relative frequency of each status of synthetic jobs
+STATUSES = (('idle', 10), ('running', 20), ('completed', 55), ('failed', 8), ('deleted', 5), ('killed', 2))
+
+IMAGES = ('centos:7', 'ubuntu:20.04', 'alpine', 'python:3.9', 'busybox', 'eoscprominence/testpi',
+          'https://example.org/images/analysis.sif')
+
+SITES = ('OpenStack-STFC', 'OpenStack-CESNET', 'OpenStack-INFN', 'OpenStack-CYFRONET')
+
+# Responses at least this large are gzip compressed if the client accepts it
+GZIP_THRESHOLD = 1024
+
+def _status(rng):
+    total = sum(weight for _, weight in STATUSES)
+    value = rng.uniform(0, total)
+    for status, weight in STATUSES:
+        value -= weight
+        if value <= 0:
+            return status
+    return STATUSES[-1][0]
+
+def synthetic_job(job_id, seed=0, now=None):
+    """
+    Return a realistic description of a job, which depends only on the id and seed
+    """
+    rng = random.Random(seed*1000003 + job_id)
+    if now is None:
+        now = time.time()
+
+    status = _status(rng)
+    create_time = int(now - rng.uniform(60, 30*86400))
+    nodes = rng.choice((1, 1, 1, 1, 2, 4))
+    job = {'id': job_id,
+           'name': 'job-%d' % job_id,
+           'status': status,
+           'resources': {'nodes': nodes,
+                         'cpus': rng.choice((1, 2, 4, 8)),
+                         'memory': rng.choice((1, 2, 4, 8, 16)),
+                         'disk': 10,
+                         'walltime': 720},
+           'labels': {'app': rng.choice(('sim', 'analysis', 'test')), 'batch': str(job_id % 7)},
+           'tasks': [{'image': rng.choice(IMAGES),
+                      'cmd': 'python run.py --seed %d --iterations %d' % (job_id, rng.randint(10, 100000)),
+                      'runtime': 'singularity',
+                      'workdir': '/tmp'}],
+           'policies': {'maximumRetries': 0, 'leaveInQueue': False},
+           'events': {'createTime': create_time}}
+
+    if status == 'idle':
+        return job
+
+    job['events']['startTime'] = create_time + rng.randint(5, 600)
+    job['execution'] = {'site': rng.choice(SITES),
+                        'cpu': {'vendor': 'GenuineIntel', 'model': 'Intel Xeon Processor (Skylake)', 'clock': 2494},
+                        'provisionedResources': {'cpus': job['resources']['cpus'],
+                                                 'memory': job['resources']['memory'],
+                                                 'disk': job['resources']['disk'],
+                                                 'nodes': nodes},
+                        'runtimeVersion': '3.8.7',
+                        'retries': 0}
+    if status == 'running':
+        return job
+
+    wall_time = rng.uniform(1, 36000)
+    job['events']['endTime'] = job['events']['startTime'] + int(wall_time)
+    job['execution']['tasks'] = [{'exitCode': 0 if status == 'completed' else rng.choice((1, 137)),
+                                  'retries': 0,
+                                  'imagePullTime': rng.uniform(0.5, 60),
+                                  'wallTimeUsage': wall_time,
+                                  'cpuTimeUsage': wall_time*rng.uniform(0.5, 1),
+                                  'maxResidentSetSizeKB': rng.randint(10000, 4000000)}]
+    if status != 'completed':
+        job['statusReason'] = rng.choice(('Job was killed by the user', 'Task failed', 'Walltime exceeded'))
+    return job
+
+def synthetic_workflow(workflow_id, jobs=10, seed=0, now=None):
+    """
+    Return a realistic description of a workflow, which depends only on the id and seed
+    """
+    rng = random.Random(seed*1000033 + workflow_id)
+    if now is None:
+        now = time.time()
+
+    status = _status(rng)
+    create_time = int(now - rng.uniform(60, 30*86400))
+    done = jobs if status == 'completed' else rng.randint(0, jobs)
+    failed = rng.randint(1, jobs - done) if status == 'failed' and done < jobs else 0
+    workflow = {'id': workflow_id,
+                'name': 'workflow-%d' % workflow_id,
+                'status': status,
+                'jobs': [{'name': 'step%d' % index,
+                          'resources': {'nodes': 1, 'cpus': 1, 'memory': 1, 'disk': 10, 'walltime': 60},
+                          'tasks': [{'image': rng.choice(IMAGES), 'cmd': 'step %d' % index, 'runtime': 'singularity'}]}
+                         for index in range(jobs)],
+                'dependencies': dict(('step%d' % index, ['step%d' % (index + 1)]) for index in range(jobs - 1)),
+                'events': {'createTime': create_time},
+                'progress': {'done': done, 'failed': failed, 'total': jobs}}
+    if status != 'idle':
+        workflow['events']['startTime'] = create_time + rng.randint(5, 600)
+    if status in TERMINAL_STATES:
+        workflow['events']['endTime'] = workflow['events']['startTime'] + rng.randint(60, 36000)
+    return workflow
+
+def _encode(data):
+    return json.dumps(data, separators=(',', ':')).encode()
+
+class _Collection(object):
+    """
+    Jobs or workflows, stored encoded together with the fields needed for filtering so that large
+    numbers of them use little memory
+    """
+    def __init__(self):
+        self._encoded = {}
+        self._index = {}
+        self._selected = {}
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self._encoded)
+
+    def put(self, item, workflow=None):
+        self._encoded[item['id']] = _encode(item)
+        self._index[item['id']] = (item['status'], item.get('name', ''), item.get('labels', {}), workflow,
+                                   item.get('events', {}).get('createTime'))
+        self._selected = {}
+        self.next_id = max(self.next_id, item['id'] + 1)
+
+    def get(self, item_id):
+        if item_id in self._encoded:
+            return json.loads(self._encoded[item_id].decode())
+        return None
+
+    def encoded(self, item_id):
+        return self._encoded[item_id]
+
+    def select(self, params):
+        """
+        Return the ids matching listing query parameters, in ascending order. Results are kept until
+        an item changes so that paging through a large listing is fast.
+        """
+        key = tuple(sorted((name, value) for name, value in params.items() if name not in ('offset', 'limit')))
+        if key not in self._selected:
+            self._selected[key] = self._select(params)
+        return self._selected[key]
+
+    def _select(self, params):
+        status = params.get('status')
+        num = int(params.get('num', 1))
+        constraints = {}
+        for constraint in params.get('constraint', '').split(','):
+            if '=' in constraint:
+                key, value = constraint.split('=', 1)
+                constraints[key] = value
+
+        filters = query.compile_filter(params['statuses'].split(',') if params.get('statuses') else None,
+                                       float(params['created_after']) if 'created_after' in params else None,
+                                       float(params['created_before']) if 'created_before' in params else None,
+                                       params['labels'].split(',') if params.get('labels') else None)
+
+        active = []
+        terminal = []
+        for item_id in sorted(self._index):
+            item_status, name, labels, workflow, created = self._index[item_id]
+            if params.get('workflow') == 'true' and str(workflow) != params.get('id'):
+                continue
+            if 'name' in params and name != params['name']:
+                continue
+            if any(labels.get(key) != value for key, value in constraints.items()):
+                continue
+            if status and item_status != status:
+                continue
+            if filters and not filters({'status': item_status, 'labels': labels, 'events': {'createTime': created}}):
+                continue
+            if item_status in TERMINAL_STATES:
+                terminal.append(item_id)
+            else:
+                active.append(item_id)
+
+        if params.get('workflow') == 'true':
+            return active + terminal if num < 0 else sorted(active + terminal[-num:])
+        elif params.get('all') == 'true':
+            return sorted(active + (terminal if num < 0 else terminal[-num:]))
+        elif params.get('completed') == 'true':
+            return terminal if num < 0 else terminal[-num:]
+        return active
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Handle a request to the fake server
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+
+        status, data, headers = self.server.fake.respond(method, url.path, params, body, self.headers)
+        self._send(status, data, headers)
+
+    def _send(self, status, data, headers):
+        if isinstance(data, bytes):
+            content_type = 'application/json'
+        elif isinstance(data, str):
+            data, content_type = data.encode(), 'text/plain'
+        else:
+            data, content_type = _encode(data), 'application/json'
+
+        headers = dict(headers or {})
+        if status == 200 and self.server.fake.etags and self.command == 'GET':
+            etag = '"%s"' % hashlib.sha1(data).hexdigest()
+            headers['ETag'] = etag
+            if self.headers.get('If-None-Match') == etag:
+                status, data = 304, b''
+
+        if len(data) >= GZIP_THRESHOLD and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data, 1)
+            headers['Content-Encoding'] = 'gzip'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeServer(object):
+    """
+    Local HTTP server implementing the PROMINENCE REST API. Each request is delayed by latency
+    seconds, or a random time in a (minimum, maximum) range, and a fraction error_rate of requests
+    fail with error_status. Errors can also be injected for the next requests using inject().
+    If token is specified requests must include it as a bearer token.
+    """
+    def __init__(self, jobs=100, workflows=10, jobs_per_workflow=10, latency=0, error_rate=0, error_status=503,
+                 seed=0, token=None, etags=True, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token = token
+        self.etags = etags
+        self.requests = []
+        self._rng = random.Random(seed)
+        self._injected = []
+        self._lock = threading.Lock()
+
+        now = time.time()
+        self.jobs = _Collection()
+        self.workflows = _Collection()
+        for workflow_id in range(1, workflows + 1):
+            self.workflows.put(synthetic_workflow(workflow_id, jobs_per_workflow, seed, now))
+        for job_id in range(1, jobs + 1):
+            # Some jobs belong to workflows
+            workflow = job_id % (10*workflows) + 1 if workflows else None
+            self.jobs.put(synthetic_job(job_id, seed, now), workflow if workflow and workflow <= workflows else None)
+
+        self.objects = {}
+        self.kv = {}
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        URL to use as PROMINENCE_URL
+        """
+        return 'http://%s:%d/v1' % self._server.server_address[:2]
+
+    def start(self):
+        """
+        Start serving requests in a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving requests
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def inject(self, status, count=1, path=None, retry_after=None):
+        """
+        Make the next count requests, optionally only those for a path, fail with a status code
+        """
+        headers = {}
+        if retry_after is not None:
+            headers['Retry-After'] = str(retry_after)
+        with self._lock:
+            self._injected.extend([(path, status, headers)]*count)
+
+    def _error(self, path):
+        with self._lock:
+            for index, (error_path, status, headers) in enumerate(self._injected):
+                if error_path is None or error_path == path:
+                    del self._injected[index]
+                    return (status, {'error': 'Injected error'}, headers)
+            if self.error_rate and self._rng.random() < self.error_rate:
+                return (self.error_status, {'error': 'Injected error'}, {})
+        return None
+
+    def respond(self, method, path, params, body, headers):
+        """
+        Return the status code, body and headers of the response to a request
+        """
+        with self._lock:
+            self.requests.append((method, path))
+
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            with self._lock:
+                latency = self._rng.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+        if path.startswith('/storage/'):
+            with self._lock:
+                self.objects[path[len('/storage/'):]] = {'size': len(body), 'lastModified': time.strftime('%Y-%m-%d %H:%M:%S')}
+            return (201, {}, {})
+
+        if not path.startswith('/v1/'):
+            return (404, {'error': 'Not found'}, {})
+        path = path[3:]
+
+        if self.token and headers.get('Authorization') != 'Bearer %s' % self.token:
+            return (401, {'error': 'Unauthorized'}, {})
+
+        error = self._error(path)
+        if error:
+            return error
+
+        parts = path.strip('/').split('/')
+        handler = getattr(self, '_%s' % parts[0], None)
+        if handler is None:
+            return (404, {'error': 'Not found'}, {})
+        with self._lock:
+            return handler(method, parts[1:], params, body)
+
+    def _collection_response(self, collection, method, parts, params, body, name):
+        if not parts:
+            if method == 'GET':
+                ids = collection.select(params)
+                if 'limit' in params:
+                    offset = int(params.get('offset', 0))
+                    ids = ids[offset:offset + int(params['limit'])]
+                if params.get('fields'):
+                    fields = params['fields'].split(',')
+                    return (200, [query.project(collection.get(item_id), fields) for item_id in ids], {})
+                return (200, b'[' + b','.join(collection.encoded(item_id) for item_id in ids) + b']', {})
+            elif method == 'POST':
+                item = json.loads(body.decode())
+                item['id'] = collection.next_id
+                item['status'] = 'idle'
+                item['events'] = {'createTime': int(time.time())}
+                collection.put(item)
+                return (201, {'id': item['id']}, {})
+            return (405, {'error': 'Method not allowed'}, {})
+
+        try:
+            item_id = int(parts[0])
+        except ValueError:
+            return (400, {'error': 'Invalid %s id' % name}, {})
+        item = collection.get(item_id)
+
+        if len(parts) == 1:
+            if method == 'GET':
+                if item and params.get('fields'):
+                    item = query.project(item, params['fields'].split(','))
+                return (200, [item] if item else [], {})
+            elif item is None:
+                return (400, {'error': 'No such %s' % name}, {})
+            elif method == 'DELETE':
+                if item['status'] not in TERMINAL_STATES:
+                    item['status'] = 'deleted'
+                    item['events']['endTime'] = int(time.time())
+                    collection.put(item)
+                return (200, {}, {})
+            elif method == 'PUT' and name == 'workflow':
+                item['status'] = 'running'
+                collection.put(item)
+                return (200, {'id': item_id}, {})
+        elif item is None:
+            return (400, {'error': 'No such %s' % name}, {})
+        elif parts[-1] in ('stdout', 'stderr') and method == 'GET':
+            text = ''.join('%s line %d from %s %d node %s\n' % (parts[-1], line, name, item_id, params.get('node', 0))
+                           for line in range(100))
+            return (200, text[int(params.get('offset', 0)):], {})
+        elif parts[1] == 'clone' and method == 'PUT':
+            item['id'] = collection.next_id
+            item['status'] = 'idle'
+            item['events'] = {'createTime': int(time.time())}
+            collection.put(item)
+            return (201, {'id': item['id']}, {})
+        elif parts[1] == 'remove' and method == 'PUT':
+            return (200, {}, {})
+        elif parts[1] == 'exec' and method == 'POST' and name == 'job':
+            return (200, 'Executed %s\n' % params.get('command', ''), {})
+        elif parts[1] == 'snapshot' and name == 'job':
+            if method == 'PUT':
+                return (200, '', {})
+            return (200, {'url': '%s/storage/snapshot-%d.tgz' % (self.url[:-3], item_id)}, {})
+
+        return (404, {'error': 'Not found'}, {})
+
+    def _jobs(self, method, parts, params, body):
+        return self._collection_response(self.jobs, method, parts, params, body, 'job')
+
+    def _workflows(self, method, parts, params, body):
+        return self._collection_response(self.workflows, method, parts, params, body, 'workflow')
+
+    def _data(self, method, parts, params, body):
+        if parts == ['upload'] and method == 'POST':
+            name = json.loads(body.decode())['filename']
+            return (201, {'url': '%s/storage/%s' % (self.url[:-3], name)}, {})
+        elif method == 'GET':
+            prefix = '/'.join(parts)
+            return (200, [dict(name=name, **info) for name, info in sorted(self.objects.items())
+                          if name.startswith(prefix)], {})
+        elif method == 'DELETE' and parts:
+            if self.objects.pop('/'.join(parts), None) is None:
+                return (400, {'error': 'No such object'}, {})
+            return (204, b'', {})
+        return (404, {'error': 'Not found'}, {})
+
+    def _kv(self, method, parts, params, body):
+        key = '/'.join(parts)
+        if method == 'GET' and params.get('list') == 'true':
+            return (200, sorted(name for name in self.kv if name.startswith(key)), {})
+        elif method == 'GET':
+            if key not in self.kv:
+                return (404, {'error': 'No such key'}, {})
+            return (200, self.kv[key], {})
+        elif method == 'POST':
+            self.kv[key] = body.decode()
+            return (201, {}, {})
+        elif method == 'DELETE':
+            for name in list(self.kv):
+                if name == key or (params.get('prefix') and name.startswith(key)):
+                    del self.kv[name]
+            return (200, {}, {})
+        return (404, {'error': 'Not found'}, {})
+
+    def _accounting(self, method, parts, params, body):
+        usage = {'users': {'user': {'numberOfJobs': len(self.jobs), 'cpuTime': 5*len(self.jobs), 'wallTime': 6*len(self.jobs)}}}
+        if params.get('by_group') == 'true':
+            usage['groups'] = {'group': usage['users']['user']}
+        return (200, {'usage': usage}, {})
+
+    def _resources(self, method, parts, params, body):
+        return (200, {'existing': [{'site': site, 'capacity': {'cpus': 64, 'memory': 256}, 'free': {'cpus': 16, 'memory': 64}}
+                                   for site in SITES]}, {})
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the PROMINENCE REST API')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--jobs', type=int, default=1000, help='Number of synthetic jobs')
+    parser.add_argument('--workflows', type=int, default=100, help='Number of synthetic workflows')
+    parser.add_argument('--latency', type=float, default=0, help='Delay in seconds before responding')
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0,
+                        help='Fraction of requests which fail')
+    parser.add_argument('--error-status', dest='error_status', type=int, default=503,
+                        help='Status code of failed requests')
+    parser.add_argument('--seed', type=int, default=0, help='Seed used to generate jobs and workflows')
+    args = parser.parse_args()
+
+    server = FakeServer(args.jobs, args.workflows, latency=args.latency, error_rate=args.error_rate,
+                        error_status=args.error_status, seed=args.seed, host=args.host, port=args.port)
+    print('Serving %d jobs and %d workflows, use PROMINENCE_URL=%s' % (args.jobs, args.workflows, server.url))
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import time
+
+from prominence import exceptions
+from prominence.cache import TERMINAL_STATES
+from prominence.workflow import Workflow
+
+__all__ = ['JobGroup', 'wait_all', 'as_completed', 'FIRST_COMPLETED', 'ALL_COMPLETED']
+
+FIRST_COMPLETED = 'FIRST_COMPLETED'
+ALL_COMPLETED = 'ALL_COMPLETED'
+
+class JobGroup(object):
+    """
+    Group of jobs and/or workflows whose status is polled together. Each poll lists the active jobs
+    and workflows once, and only jobs or workflows which are no longer active are described
+    individually. The polling interval increases while nothing changes.
+    """
+    def __init__(self, items, client=None, interval=5, max_interval=60, backoff=1.5):
+        self._items = list(items)
+        self._client = client
+        if not self._client and self._items:
+            self._client = self._items[0]._client
+        self._interval = interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+
+    @property
+    def items(self):
+        """
+        Return the jobs and workflows in the group
+        """
+        return self._items
+
+    def done(self):
+        """
+        Return the jobs and workflows known to be in a terminal state
+        """
+        return [item for item in self._items if item._status in TERMINAL_STATES]
+
+    def not_done(self):
+        """
+        Return the jobs and workflows not known to be in a terminal state
+        """
+        return [item for item in self._items if item._status not in TERMINAL_STATES]
+
+    def poll(self):
+        """
+        Update the status of all unfinished jobs and workflows, returning True if any changed
+        """
+        pending = self.not_done()
+        workflows = [item for item in pending if isinstance(item, Workflow)]
+        jobs = [item for item in pending if not isinstance(item, Workflow)]
+
+        changed = False
+        if jobs:
+            active = self._client.list_jobs()
+            changed = self._update(jobs, active, lambda id: self._client.describe_job(id)) or changed
+        if workflows:
+            active = self._client.list_workflows()
+            changed = self._update(workflows, active, lambda id: self._client.describe_workflow(id, False)) or changed
+
+        return changed
+
+    def _update(self, items, active, describe):
+        """
+        Update items from a list of active jobs or workflows, describing any which are not active
+        """
+        active = dict((data['id'], data) for data in active)
+        changed = False
+        for item in items:
+            data = None
+            if item.id in active:
+                status = active[item.id]['status']
+            else:
+                data = describe(item.id)
+                status = data['status']
+            if status != item._status:
+                changed = True
+            item._set_status(status, data)
+        return changed
+
+    def as_completed(self, timeout=0):
+        """
+        Iterate over the jobs and workflows, yielding each one as soon as it reaches a terminal state
+        """
+        start = time.time()
+        interval = self._interval
+        yielded = set()
+
+        while True:
+            for item in self.done():
+                if id(item) not in yielded:
+                    yielded.add(id(item))
+                    yield item
+
+            if len(yielded) == len(self._items):
+                return
+            if timeout > 0 and time.time() - start > timeout:
+                return
+
+            # Keep backing off if the server is unavailable, including when the circuit breaker is open
+            # or server errors persist after retries
+            try:
+                changed = self.poll()
+            except (exceptions.ConnectionError, exceptions.JobGetError, exceptions.WorkflowGetError):
+                changed = False
+
+            # Yield newly finished jobs and workflows immediately
+            if any(id(item) not in yielded for item in self.done()):
+                continue
+
+            # Back off while nothing is changing
+            if changed:
+                interval = self._interval
+            time.sleep(interval)
+            interval = min(interval*self._backoff, self._max_interval)
+
+    def wait(self, timeout=0, return_when=ALL_COMPLETED):
+        """
+        Wait for the jobs and workflows to complete, returning lists of those done and not done
+        """
+        for _ in self.as_completed(timeout):
+            if return_when == FIRST_COMPLETED:
+                break
+
+        return (self.done(), self.not_done())
+
+def wait_all(items, timeout=0, return_when=ALL_COMPLETED, client=None):
+    """
+    Wait for jobs and/or workflows to complete, returning lists of those done and not done
+    """
+    return JobGroup(items, client).wait(timeout, return_when)
+
+def as_completed(items, timeout=0, client=None):
+    """
+    Iterate over jobs and/or workflows, yielding each one as soon as it reaches a terminal state
+    """
+    return JobGroup(items, client).as_completed(timeout)
@@ -7,6 +7,9 @@ import time
 import requests
 
 from prominence import InputFile, JobPolicies, ProminenceClient, Resources, Task
+from prominence.cache import TERMINAL_STATES
+from prominence.logs import LogFollower
+from prominence.transport import create_transport
 
 def read_from_tarfile(content):
     """
@@ -18,19 +21,22 @@ def read_from_tarfile(content):
                 fileobj = tf.extractfile(entry)
                 return fileobj.read().decode()
 
-def get_or_download(url, save_as):
+def get_or_download(url, save_as, session=None):
     """
     Download from a URL into memory or save to disk
     """
+    if not session:
+        session = create_transport(retries=0)
+
     if not save_as:
         try:
-            response = requests.get(url)
+            response = session.get(url)
         except Exception as err:
             return False
         return response.text
     else:
         try:
-            response = requests.get(url, stream=True, timeout=30)
+            response = session.get(url, stream=True, timeout=30)
         except requests.exceptions.RequestException as err:
             return False
 
@@ -109,9 +115,12 @@ class Job(object):
     """
     Job
     """
-    def __init__(self, id=None):
+    def __init__(self, id=None, client=None):
         self._last_status_check = 0
-        self._client = ProminenceClient(authenticated=True)
+        if client:
+            self._client = client
+        else:
+            self._client = ProminenceClient(authenticated=True, cache=True)
         self._job = None
         self._tasks = []
         self._id = id
@@ -246,7 +255,7 @@ class Job(object):
         for output in job['outputFiles']:
             if output['name'] == name:
                 url = output['url']
-                return get_or_download(url, save_as)
+                return get_or_download(url, save_as, self._client.session)
 
         return False
 
@@ -258,7 +267,7 @@ class Job(object):
         for output in job['outputDirs']:
             if output['name'] == name:
                 url = output['url']
-                return get_or_download(url, save_as)
+                return get_or_download(url, save_as, self._client.session)
 
         return False
 
@@ -306,7 +315,7 @@ class Job(object):
         Update internal representation of job
         """
         # If the status is non-terminal, get the current job JSON
-        if self._status not in ('completed', 'failed', 'deleted', 'killed'):
+        if self._status not in TERMINAL_STATES:
             # Ensure we don't run this too frequently
             if time.time() - self._last_status_check > 5:
                 try:
@@ -319,6 +328,15 @@ class Job(object):
                 if 'status' in self._job:
                     self._status = self._job['status']
 
+    def _set_status(self, status, job=None):
+        """
+        Update the job status, and optionally the job JSON, obtained elsewhere
+        """
+        self._status = status
+        if job:
+            self._job = job
+        self._last_status_check = time.time()
+
     @property
     def status(self):
         """
@@ -333,7 +351,7 @@ class Job(object):
         """
         self._update()
 
-        if self._status in ('completed', 'failed', 'deleted', 'killed'):
+        if self._status in TERMINAL_STATES:
             return True
         return False
 
@@ -348,6 +366,13 @@ class Job(object):
             time.sleep(5)
         return
 
+    def on_status_change(self, callback, listener):
+        """
+        Call callback with the job and the event whenever the job status changes, using events
+        received by a prominence.listener.Listener
+        """
+        listener.register(self, callback)
+
     @property
     def events(self):
         """
@@ -389,6 +414,12 @@ class Job(object):
         """
         return self._client.stderr_job(self._id, node, offset)
 
+    def follow(self, streams=('stdout', 'stderr'), nodes=(0,)):
+        """
+        Yield (node, stream, text) as the job produces output until it has finished
+        """
+        return LogFollower(self._client, 'job', self._id, nodes, streams).follow()
+
     def execute(self, command):
         """
         Execute a command within a running job
@@ -403,9 +434,9 @@ class Job(object):
             response = self._client.get_snapshot_url(self._id)
             if 'url' in response:
                 if not save_as:
-                    return read_from_tarfile(get_or_download(response['url'], save_as))
+                    return read_from_tarfile(get_or_download(response['url'], save_as, self._client.session))
                 else:
-                    return get_or_download(response['url'], save_as)
+                    return get_or_download(response['url'], save_as, self._client.session)
 
         return None
 
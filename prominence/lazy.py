@@ -0,0 +1,19 @@
+import importlib.util
+import sys
+
+__all__ = ['lazy_import']
+
+def lazy_import(name):
+    """
+    Return a module which is only loaded when one of its attributes is first used
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,262 @@
+"""
+Local receiver for job and workflow state change events sent by webhook notifications
+
+Events are sent as an HTTP POST of a JSON object to the URL of the listener, e.g.
+
+    {"type": "job", "id": 12, "status": "completed", "event": "jobFinished"}
+
+where type is job or workflow, and defaults to workflow if the event name starts with workflow.
+The path of the URL always ends with a random token, so only senders which have been given the URL,
+normally via a Notification attached to a job or workflow, can deliver events.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import secrets
+import threading
+import time
+from urllib.parse import urlsplit
+
+from prominence import exceptions
+from prominence.cache import TERMINAL_STATES
+from prominence.notification import Notification
+
+__all__ = ['Listener']
+
+# Largest event accepted
+MAX_EVENT_SIZE = 65536
+
+def _kind(item):
+    """
+    Return whether a job or workflow object is a job or a workflow
+    """
+    from prominence.workflow import Workflow
+    return 'workflow' if isinstance(item, Workflow) else 'job'
+
+def _event_key(event):
+    """
+    Return the type and id of the job or workflow an event refers to
+    """
+    kind = event.get('type')
+    if kind not in ('job', 'workflow'):
+        kind = 'workflow' if str(event.get('event', '')).startswith('workflow') else 'job'
+    return (kind, int(event['id']))
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Handle an event sent to the listener
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if urlsplit(self.path).path.rstrip('/').rsplit('/', 1)[-1] != self.server.listener.token:
+            return self._send(404)
+        if length > MAX_EVENT_SIZE:
+            return self._send(413)
+
+        try:
+            event = json.loads(self.rfile.read(length).decode('utf-8'))
+            _event_key(event)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return self._send(400)
+
+        # Respond before running callbacks so that slow callbacks do not delay the sender
+        self._send(202)
+        self.server.listener.dispatch(event)
+
+    def _send(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+class Listener(object):
+    """
+    Local HTTP server receiving job and workflow state change events. Callbacks registered for a job
+    or workflow are called with the job or workflow and the event whenever its status changes, and
+    callback, if specified, is called for every event received. If no events arrive for
+    poll_interval seconds the registered jobs and workflows are polled together instead.
+    """
+    def __init__(self, host='127.0.0.1', port=0, url=None, client=None, poll_interval=60, callback=None):
+        self._client = client
+        self._poll_interval = poll_interval
+        self._callback = callback
+        self._items = {}
+        self._callbacks = {}
+        self._condition = threading.Condition()
+        self._last_event = time.time()
+        self._last_poll = time.time()
+        self.events = 0
+        self.polls = 0
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.listener = self
+        self._thread = None
+
+        # The URL seen by the sender may differ, e.g. behind a reverse proxy, but always includes the token
+        token = secrets.token_urlsafe(16)
+        if not url:
+            url = 'http://%s:%d' % self._server.server_address[:2]
+        self._url = '%s/%s' % (url.rstrip('/'), token)
+        self.token = token
+
+    @property
+    def url(self):
+        """
+        URL to which events should be sent
+        """
+        return self._url
+
+    def notification(self, event='jobFinished'):
+        """
+        Return a webhook notification sending events to the listener
+        """
+        return Notification(event, 'webhook', self._url)
+
+    def register(self, item, callback=None):
+        """
+        Receive events for a job or workflow, optionally calling callback with the job or workflow
+        and the event whenever its status changes
+        """
+        key = (_kind(item), int(item.id))
+        with self._condition:
+            if self._client is None:
+                self._client = item._client
+            items = self._items.setdefault(key, [])
+            if item not in items:
+                items.append(item)
+            if callback:
+                self._callbacks.setdefault(key, []).append((item, callback))
+
+    def unregister(self, item):
+        """
+        Stop receiving events for a job or workflow
+        """
+        key = (_kind(item), int(item.id))
+        with self._condition:
+            items = self._items.get(key, [])
+            if item in items:
+                items.remove(item)
+            if not items:
+                self._items.pop(key, None)
+            self._callbacks[key] = [entry for entry in self._callbacks.get(key, []) if entry[0] is not item]
+            if not self._callbacks[key]:
+                del self._callbacks[key]
+
+    def dispatch(self, event):
+        """
+        Update the status of the job or workflow an event refers to and run any callbacks
+        """
+        key = _event_key(event)
+        status = event.get('status')
+        with self._condition:
+            self._last_event = time.time()
+            self.events += 1
+            changed = [item for item in self._items.get(key, []) if status is None or item._status != status]
+            if status is not None:
+                for item in changed:
+                    item._set_status(status)
+            callbacks = [entry for entry in self._callbacks.get(key, []) if entry[0] in changed]
+            self._condition.notify_all()
+
+        if self._callback:
+            self._callback(event)
+        for item, callback in callbacks:
+            callback(item, event)
+
+    def pending(self):
+        """
+        Return the registered jobs and workflows not known to be in a terminal state
+        """
+        with self._condition:
+            return [item for items in self._items.values() for item in items if item._status not in TERMINAL_STATES]
+
+    def poll(self):
+        """
+        Update the status of all unfinished jobs and workflows by polling, running callbacks for any
+        which have changed
+        """
+        from prominence.group import JobGroup
+        pending = self.pending()
+        with self._condition:
+            self._last_poll = time.time()
+            self.polls += 1
+        if not pending:
+            return
+
+        before = [item._status for item in pending]
+        JobGroup(pending, self._client).poll()
+        for item, status in zip(pending, before):
+            if item._status != status:
+                key = (_kind(item), int(item.id))
+                event = {'type': key[0], 'id': key[1], 'status': item._status, 'polled': True}
+                with self._condition:
+                    callbacks = [callback for other, callback in self._callbacks.get(key, []) if other is item]
+                    self._condition.notify_all()
+                for callback in callbacks:
+                    callback(item, event)
+
+    def wait(self, timeout=0):
+        """
+        Wait until all registered jobs and workflows are in a terminal state, polling while no events
+        arrive. Returns False if the timeout was reached first.
+        """
+        start = time.time()
+
+        # Poll straight away, as jobs and workflows may have finished before they were registered
+        due = True
+        while True:
+            if due:
+                try:
+                    self.poll()
+                except (exceptions.ConnectionError, exceptions.JobGetError, exceptions.WorkflowGetError):
+                    pass
+
+            with self._condition:
+                if not self.pending():
+                    return True
+                now = time.time()
+                if timeout > 0 and now - start >= timeout:
+                    return False
+                deadline = max(self._last_event, self._last_poll) + self._poll_interval
+                if timeout > 0:
+                    deadline = min(deadline, start + timeout)
+                due = now >= deadline
+                if not due:
+                    self._condition.wait(deadline - now)
+
+    def start(self):
+        """
+        Receive events in a background thread
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve(self):
+        """
+        Receive events until interrupted
+        """
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        """
+        Stop receiving events
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
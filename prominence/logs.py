@@ -0,0 +1,90 @@
+import time
+
+from prominence.cache import TERMINAL_STATES
+
+__all__ = ['LogFollower']
+
+class LogFollower(object):
+    """
+    Follow the standard output and/or standard error of one or more nodes of a job, or of a job in a
+    workflow. Output is polled at an interval which is short while output is arriving and increases
+    while nothing changes, and the status is only checked occasionally rather than on every poll.
+    """
+    def __init__(self, client, resource, id, nodes=(0,), streams=('stdout', 'stderr'), job=None, instance=-1,
+                 interval=0.5, max_interval=10, backoff=1.5, status_interval=20):
+        self._client = client
+        self._resource = resource
+        self._id = id
+        self._job = job
+        self._instance = instance
+        self._interval = interval
+        self._max_interval = max_interval
+        self._backoff = backoff
+        self._status_interval = status_interval
+        self._offsets = dict(((node, stream), 0) for node in nodes for stream in streams)
+        self._sources = [(node, stream) for node in nodes for stream in streams]
+
+    def status(self):
+        """
+        Return the current status of the job or workflow
+        """
+        if self._resource == 'job':
+            data = self._client.describe_job(self._id, False)
+        else:
+            data = self._client.describe_workflow(self._id, False)
+        return data.get('status')
+
+    def poll(self):
+        """
+        Fetch any new output, returning a list of (node, stream, text)
+        """
+        output = []
+        for node, stream in self._sources:
+            text = getattr(self._client, '%s_generic' % stream)('%ss' % self._resource,
+                                                                self._id,
+                                                                node,
+                                                                self._job,
+                                                                self._instance,
+                                                                offset=self._offsets[(node, stream)])
+            if text:
+                self._offsets[(node, stream)] += len(text)
+                output.append((node, stream, text))
+        return output
+
+    def follow(self):
+        """
+        Yield (node, stream, text) as output is produced until the job or workflow has finished
+        """
+        # Wait for the job or workflow to start running
+        interval = self._interval
+        status = self.status()
+        while status in ('idle', 'pending'):
+            time.sleep(interval)
+            interval = min(interval*self._backoff, self._max_interval)
+            status = self.status()
+
+        if status == 'deleted':
+            return
+
+        interval = self._interval
+        checked = time.time()
+        while True:
+            output = self.poll()
+            for item in output:
+                yield item
+
+            # Output written before the job finished has now been fetched
+            if status in TERMINAL_STATES or status is None:
+                return
+
+            if output:
+                interval = self._interval
+            else:
+                interval = min(interval*self._backoff, self._max_interval)
+            time.sleep(interval)
+
+            if time.time() - checked >= self._status_interval:
+                status = self.status()
+                checked = time.time()
+                if status == 'deleted':
+                    return
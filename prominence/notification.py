@@ -1,10 +1,12 @@
 class Notification(object):
     """
-    Notification
+    Notification. The type is email or webhook; webhook notifications are sent to url, e.g. the URL
+    of a prominence.listener.Listener.
     """
-    def __init__(self, event=None, type=None):
+    def __init__(self, event=None, type=None, url=None):
         self._event = event
         self._type = type
+        self._url = url
 
     @property
     def event(self):
@@ -30,9 +32,26 @@ class Notification(object):
         """
         self._type = type
 
+    @property
+    def url(self):
+        """
+        """
+        return self._url
+
+    @url.setter
+    def url(self, url):
+        """
+        """
+        self._url = url
+
     def to_dict(self):
         """
         """
+        if self._type == 'webhook' and not self._url:
+            return None
         if self._event and self._type:
-            return {'event': self._event, 'type': self._type}
+            data = {'event': self._event, 'type': self._type}
+            if self._url:
+                data['url'] = self._url
+            return data
         return None
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import sys
+import threading
+import time
+
+__all__ = ['Profiler', 'enable', 'phase', 'add', 'iterate', 'record_request', 'report']
+
+class _TimedIterator(object):
+    """
+    Iterator recording the time spent obtaining items from another iterator, which is added to a
+    phase once all the items have been obtained
+    """
+    def __init__(self, profiler, name, iterable):
+        self._profiler = profiler
+        self._name = name
+        self._iterator = iter(iterable)
+        self.elapsed = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = time.time()
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._profiler.add(self._name, self.elapsed + time.time() - start)
+            raise
+        finally:
+            self.elapsed += time.time() - start
+
+    next = __next__
+
+class Profiler(object):
+    """
+    Accumulate the time spent in each phase of a command, and details of each HTTP request
+    """
+    def __init__(self):
+        self.enabled = False
+        self._start = time.time()
+        self._phases = OrderedDict()
+        self._requests = []
+        self._lock = threading.Lock()
+
+    def enable(self):
+        """
+        Start profiling
+        """
+        self.enabled = True
+        self._start = time.time()
+
+    def add(self, name, seconds):
+        """
+        Add time spent in a phase
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            count, total = self._phases.get(name, (0, 0))
+            self._phases[name] = (count + 1, total + seconds)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager measuring the time spent in a phase
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def iterate(self, name, iterable):
+        """
+        Return an iterator over iterable which adds the time spent obtaining the items, e.g. reading
+        and decoding a response as it arrives, to a phase. The time is available as its elapsed attribute.
+        """
+        return _TimedIterator(self, name, iterable)
+
+    def record_request(self, event, info):
+        """
+        Client hook recording the time spent in each HTTP request
+        """
+        if event != 'after':
+            return
+        self.add('request', info['latency']['total'])
+        with self._lock:
+            self._requests.append(info)
+
+    def report(self, stream=None):
+        """
+        Print a summary of the time spent in each phase
+        """
+        if not self.enabled:
+            return
+        if stream is None:
+            stream = sys.stderr
+
+        stream.write('\n')
+        for info in self._requests:
+            stream.write('%-6s %-40s %3s %10d B out %10d B in %8.3f s (server %.3f s)\n' %
+                         (info['method'],
+                          info['endpoint'][:40],
+                          info['status'] or '-',
+                          info['bytes_out'],
+                          info['bytes_in'],
+                          info['latency']['total'],
+                          info['latency']['server']))
+        if self._requests:
+            stream.write('\n')
+
+        stream.write('%-15s %6s %10s\n' % ('Phase', 'Calls', 'Time (s)'))
+        for name, (count, total) in self._phases.items():
+            stream.write('%-15s %6d %10.3f\n' % (name, count, total))
+        stream.write('%-15s %6s %10.3f\n' % ('total', '', time.time() - self._start))
+
+_profiler = Profiler()
+
+def enable():
+    """
+    Start profiling
+    """
+    _profiler.enable()
+
+def phase(name):
+    """
+    Return a context manager measuring the time spent in a phase
+    """
+    return _profiler.phase(name)
+
+def add(name, seconds):
+    """
+    Add time spent in a phase
+    """
+    _profiler.add(name, seconds)
+
+def iterate(name, iterable):
+    """
+    Return an iterator over iterable which adds the time spent obtaining the items to a phase
+    """
+    return _profiler.iterate(name, iterable)
+
+def record_request(event, info):
+    """
+    Client hook recording the time spent in each HTTP request
+    """
+    _profiler.record_request(event, info)
+
+def report(stream=None):
+    """
+    Print a summary of the time spent in each phase
+    """
+    _profiler.report(stream)
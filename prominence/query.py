@@ -0,0 +1,166 @@
+import calendar
+import heapq
+import re
+import time
+
+from prominence.cache import TERMINAL_STATES
+
+__all__ = ['project', 'get_field', 'matches', 'compile_filter', 'last_completed', 'parse_selector', 'parse_time',
+           'query_params']
+
+# Label selectors of the form key=value, key!=value or key
+SELECTOR = re.compile(r'^\s*([^=!\s]+)\s*(?:(!=|==|=)\s*(.*?))?\s*$')
+
+def _copy_field(source, target, path):
+    """
+    Copy a possibly nested field from one dict to another
+    """
+    key = path[0]
+    if key not in source:
+        return
+    value = source[key]
+    if len(path) == 1:
+        target[key] = value
+    elif isinstance(value, dict):
+        _copy_field(value, target.setdefault(key, {}), path[1:])
+    elif isinstance(value, list):
+        existing = target.setdefault(key, [{} for _ in value])
+        for item, projected in zip(value, existing):
+            if isinstance(item, dict) and isinstance(projected, dict):
+                _copy_field(item, projected, path[1:])
+
+def project(item, fields):
+    """
+    Return a copy of a job or workflow containing only the specified fields. Nested fields are
+    specified using dots, e.g. events.createTime, and apply to each element of lists, e.g. tasks.image.
+    """
+    if not fields:
+        return item
+    result = {}
+    for field in fields:
+        _copy_field(item, result, field.split('.'))
+    return result
+
+def get_field(item, field):
+    """
+    Return the value of a possibly nested field, or None if it does not exist
+    """
+    value = item
+    for key in field.split('.'):
+        if isinstance(value, list):
+            value = [element.get(key) for element in value if isinstance(element, dict)]
+        elif isinstance(value, dict):
+            value = value.get(key)
+        else:
+            return None
+    return value
+
+def parse_selector(selector):
+    """
+    Parse a label selector into (key, operator, value), where the operator is '=', '!=' or None
+    if the label only needs to exist
+    """
+    match = SELECTOR.match(selector)
+    if not match:
+        raise ValueError('Invalid label selector "%s"' % selector)
+    key, operator, value = match.groups()
+    if operator == '==':
+        operator = '='
+    return (key, operator, value)
+
+def parse_time(value):
+    """
+    Convert a time given as a unix epoch, a date or a date and time in UTC into a unix epoch
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ValueError('Invalid time "%s", must be a unix epoch or of the form YYYY-MM-DD [HH:MM:SS]' % value)
+
+def compile_filter(statuses=None, created_after=None, created_before=None, labels=None):
+    """
+    Return a function checking if a job or workflow matches filters on its status, creation time and
+    labels, or None if there are no filters. Times and label selectors are only parsed once.
+    """
+    if not statuses and created_after is None and created_before is None and not labels:
+        return None
+    statuses = set(statuses or ())
+    created_after = parse_time(created_after)
+    created_before = parse_time(created_before)
+    selectors = [parse_selector(selector) for selector in labels or ()]
+
+    def check(item):
+        if statuses and item.get('status') not in statuses:
+            return False
+
+        if created_after is not None or created_before is not None:
+            created = item.get('events', {}).get('createTime')
+            if created is None:
+                return False
+            if created_after is not None and created < created_after:
+                return False
+            if created_before is not None and created >= created_before:
+                return False
+
+        if selectors:
+            item_labels = item.get('labels', {})
+            for key, operator, value in selectors:
+                if operator is None and key not in item_labels:
+                    return False
+                elif operator == '=' and item_labels.get(key) != value:
+                    return False
+                elif operator == '!=' and item_labels.get(key) == value:
+                    return False
+
+        return True
+
+    return check
+
+def matches(item, statuses=None, created_after=None, created_before=None, labels=None):
+    """
+    Check if a job or workflow matches filters on its status, creation time and labels
+    """
+    check = compile_filter(statuses, created_after, created_before, labels)
+    return check is None or check(item)
+
+def last_completed(items, num):
+    """
+    Yield the jobs or workflows which are not in a terminal state as they are received, followed by
+    only the last num in a terminal state, i.e. those with the highest ids
+    """
+    kept = []
+    for index, item in enumerate(items):
+        if item.get('status') not in TERMINAL_STATES:
+            yield item
+        elif len(kept) < num:
+            heapq.heappush(kept, (item.get('id'), index, item))
+        else:
+            heapq.heappushpop(kept, (item.get('id'), index, item))
+    for _, _, item in sorted(kept):
+        yield item
+
+def query_params(fields=None, statuses=None, created_after=None, created_before=None, labels=None):
+    """
+    Return the query parameters used to ask the server to only return the specified fields of
+    jobs or workflows matching the filters
+    """
+    params = {}
+    if fields:
+        params['fields'] = ','.join(fields)
+    if statuses:
+        params['statuses'] = ','.join(statuses)
+    if created_after is not None:
+        params['created_after'] = int(parse_time(created_after))
+    if created_before is not None:
+        params['created_before'] = int(parse_time(created_before))
+    if labels:
+        params['labels'] = ','.join(labels)
+    return params
@@ -0,0 +1,280 @@
+from collections import OrderedDict
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+
+__all__ = ['Column', 'Table', 'LiveTable', 'JOB_COLUMNS', 'WORKFLOW_COLUMNS', 'OUTPUT_FORMATS', 'parse_columns',
+           'write_records', 'image_name', 'elapsed', 'datetime_format']
+
+# Maximum width of the command column
+CMD_MAX_WIDTH = 100
+
+# Number of rows used to determine column widths
+LOOKAHEAD = 500
+
+# Machine-readable output formats
+OUTPUT_FORMATS = ('json', 'jsonl', 'csv', 'tsv')
+
+def image_name(name):
+    """
+    Extract container image name for display purposes
+    """
+    if name.startswith('http'):
+        name = os.path.basename(name)
+        name = name[:name.find('?')]
+    return name
+
+def elapsed(job, now=None):
+    """
+    Print elapsed job runtime in a nice way
+    """
+    if 'startTime' in job['events']:
+        if 'endTime' in job['events']:
+            elapsed_time = job['events']['endTime'] - job['events']['startTime']
+        else:
+            elapsed_time = (now or time.time()) - job['events']['startTime']
+        days = int(elapsed_time/86400)
+        seconds = int(elapsed_time) % 86400
+        return '%d+%02d:%02d:%02d' % (days, seconds//3600, seconds//60 % 60, seconds % 60)
+
+    return ''
+
+# Formatted dates, by day since the epoch
+_dates = {}
+
+def datetime_format(epoch):
+    """
+    Convert a unix epoch in a formatted date/time string
+    """
+    day, seconds = divmod(int(epoch), 86400)
+    date = _dates.get(day)
+    if date is None:
+        date = _dates[day] = time.strftime('%Y-%m-%d', time.gmtime(day*86400))
+    return '%s %02d:%02d:%02d' % (date, seconds//3600, seconds//60 % 60, seconds % 60)
+
+def _task(item, key):
+    tasks = item.get('tasks')
+    if tasks:
+        return tasks[0].get(key, '')
+    return ''
+
+class Column(object):
+    """
+    Column of a table. The value of each cell is obtained by calling value with the item and the
+    time the table is rendered. Values longer than max_width are truncated to keep characters followed
+    by "...", by default so that they are max_width characters long.
+    """
+    def __init__(self, header, value, min_width=0, max_width=None, keep=None):
+        self.header = header
+        self.value = value
+        self.min_width = max(min_width, len(header))
+        self.max_width = max_width
+        self.keep = keep
+        if keep is None and max_width:
+            self.keep = max(max_width - 3, 0)
+
+    def cell(self, item, now):
+        text = self.value(item, now)
+        if self.max_width and len(text) > self.max_width:
+            text = '%s...' % text[:self.keep]
+        return text
+
+    def field(self, now=None):
+        """
+        Return the name and a function giving the untruncated value of the column, for use with
+        write_records
+        """
+        if now is None:
+            now = time.time()
+        return (self.header.lower(), lambda item: self.value(item, now))
+
+    def limit(self, max_width):
+        """
+        Return a copy of the column with a different maximum width
+        """
+        return Column(self.header, self.value, min(self.min_width, max_width), max_width)
+
+JOB_COLUMNS = OrderedDict((
+    ('id', Column('ID', lambda job, now: str(job['id']), 2)),
+    ('name', Column('NAME', lambda job, now: job.get('name', ''), 4)),
+    ('created', Column('CREATED', lambda job, now: datetime_format(job['events']['createTime']), 19)),
+    ('status', Column('STATUS', lambda job, now: job['status'], 6)),
+    ('elapsed', Column('ELAPSED', elapsed, 10)),
+    ('image', Column('IMAGE', lambda job, now: image_name(_task(job, 'image')), 5)),
+    ('cmd', Column('CMD', lambda job, now: _task(job, 'cmd'), 3, CMD_MAX_WIDTH, CMD_MAX_WIDTH)),
+    ('site', Column('SITE', lambda job, now: job.get('execution', {}).get('site', ''))),
+    ('nodes', Column('NODES', lambda job, now: str(job.get('resources', {}).get('nodes', '')))),
+    ('cpus', Column('CPUS', lambda job, now: str(job.get('resources', {}).get('cpus', '')))),
+    ('memory', Column('MEMORY', lambda job, now: str(job.get('resources', {}).get('memory', '')))),
+    ('labels', Column('LABELS', lambda job, now: ','.join('%s=%s' % item for item in sorted(job.get('labels', {}).items())))),
+))
+
+WORKFLOW_COLUMNS = OrderedDict((
+    ('id', Column('ID', lambda workflow, now: str(workflow['id']), 2)),
+    ('name', Column('NAME', lambda workflow, now: workflow['name'], 4)),
+    ('created', Column('CREATED', lambda workflow, now: datetime_format(workflow['events']['createTime']), 19)),
+    ('status', Column('STATUS', lambda workflow, now: workflow['status'], 6)),
+    ('elapsed', Column('ELAPSED', elapsed, 10)),
+    ('success', Column('SUCCESS', lambda workflow, now: '%d' % workflow['progress']['done'], 8)),
+    ('failed', Column('FAILED', lambda workflow, now: '%d' % workflow['progress']['failed'], 8)),
+    ('total', Column('TOTAL', lambda workflow, now: '%d' % workflow['progress']['total'], 8)),
+))
+
+# Columns shown by default
+DEFAULT_JOB_COLUMNS = 'id,name,created,status,elapsed,image,cmd'
+DEFAULT_WORKFLOW_COLUMNS = 'id,name,created,status,elapsed,success,failed,total'
+
+def parse_columns(spec, available):
+    """
+    Return the columns from a comma-separated list of names, each optionally followed by :width
+    to set the maximum width of the column
+    """
+    columns = []
+    for item in spec.split(','):
+        name, _, width = item.strip().partition(':')
+        if name not in available:
+            raise ValueError('Unknown column "%s", must be one of: %s' % (name, ', '.join(available)))
+        column = available[name]
+        if width:
+            try:
+                column = column.limit(int(width))
+            except ValueError:
+                raise ValueError('Invalid width "%s" for column "%s"' % (width, name))
+        columns.append(column)
+    return columns
+
+class Table(object):
+    """
+    Table printed as rows are received. Column widths are determined from the first rows only, so
+    memory use does not depend on the number of rows, and the value of each cell is only calculated
+    once. If all the rows fit within the lookahead they are sorted using key.
+    """
+    def __init__(self, columns, lookahead=LOOKAHEAD, key=None):
+        self._columns = columns
+        self._lookahead = lookahead
+        self._key = key
+
+    def render(self, items, stream=None):
+        """
+        Print the table
+        """
+        if stream is None:
+            stream = sys.stdout
+        now = time.time()
+        values = [column.value for column in self._columns]
+        capped = [(index, column) for index, column in enumerate(self._columns) if column.max_width]
+
+        def cells(item):
+            row = [value(item, now) for value in values]
+            for index, column in capped:
+                if len(row[index]) > column.max_width:
+                    row[index] = column.cell(item, now)
+            return row
+
+        items = iter(items)
+        head = list(itertools.islice(items, self._lookahead + 1))
+        if len(head) <= self._lookahead and self._key:
+            head.sort(key=self._key)
+        rows = [cells(item) for item in head]
+        del head
+
+        widths = [column.min_width for column in self._columns]
+        for row in rows:
+            widths = [max(width, len(cell)) for width, cell in zip(widths, row)]
+        line = '   '.join('%%-%ds' % width for width in widths) + '\n'
+
+        stream.write(line % tuple(column.header for column in self._columns))
+        for row in rows:
+            stream.write(line % tuple(row))
+        stream.flush()
+        del rows
+
+        for item in items:
+            stream.write(line % tuple(cells(item)))
+
+class LiveTable(object):
+    """
+    Table which is redrawn in place in a terminal. Only lines which have changed are written, and
+    columns only become wider, so unchanged rows stay where they are.
+    """
+    def __init__(self, columns, stream=None):
+        self._columns = columns
+        self._stream = stream
+        self._widths = None
+        self._lines = []
+
+    def update(self, items, title=''):
+        """
+        Redraw the table with the current items, returning the number of lines written
+        """
+        stream = self._stream or sys.stdout
+        now = time.time()
+        rows = [[column.cell(item, now) for column in self._columns] for item in items]
+
+        widths = [column.min_width for column in self._columns]
+        for row in rows:
+            widths = [max(width, len(cell)) for width, cell in zip(widths, row)]
+        redraw = self._widths is None or any(width > old for width, old in zip(widths, self._widths))
+        if redraw:
+            self._widths = widths
+        line = '   '.join('%%-%ds' % width for width in self._widths)
+
+        lines = [title, '', line % tuple(column.header for column in self._columns)]
+        lines.extend(line % tuple(row) for row in rows)
+
+        output = []
+        if redraw:
+            output.append('\x1b[H\x1b[2J')
+        changed = 0
+        for index, text in enumerate(lines):
+            if redraw or index >= len(self._lines) or self._lines[index] != text:
+                output.append('\x1b[%d;1H%s\x1b[K' % (index + 1, text))
+                changed += 1
+        if len(lines) < len(self._lines):
+            output.append('\x1b[%d;1H\x1b[J' % (len(lines) + 1))
+        output.append('\x1b[%d;1H' % (len(lines) + 1))
+
+        stream.write(''.join(output))
+        stream.flush()
+        self._lines = lines
+        return changed
+
+def write_records(records, output, columns=None, stream=None, single=False):
+    """
+    Write records in a machine-readable format as they are received. For csv and tsv columns is a
+    list of (name, function) giving the value of each field, by default the keys of the first
+    record. If single is set json output is a single object rather than an array.
+    """
+    if stream is None:
+        stream = sys.stdout
+
+    if output == 'jsonl':
+        for record in records:
+            stream.write(json.dumps(record) + '\n')
+    elif output == 'json':
+        if single:
+            for record in records:
+                stream.write(json.dumps(record, indent=2) + '\n')
+            return
+        separator = '[\n'
+        for record in records:
+            stream.write(separator + json.dumps(record, indent=2))
+            separator = ',\n'
+        stream.write('[]\n' if separator == '[\n' else '\n]\n')
+    elif output in ('csv', 'tsv'):
+        writer = csv.writer(stream, delimiter='\t' if output == 'tsv' else ',', lineterminator='\n')
+        records = iter(records)
+        if columns is None:
+            first = next(records, None)
+            if first is None:
+                return
+            columns = [(key, lambda record, key=key: record.get(key, '')) for key in first]
+            records = itertools.chain([first], records)
+        writer.writerow([name for name, _ in columns])
+        for record in records:
+            writer.writerow([value(record) for _, value in columns])
+    else:
+        raise ValueError('Unknown output format "%s", must be one of: %s' % (output, ', '.join(OUTPUT_FORMATS)))
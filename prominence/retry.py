@@ -0,0 +1,179 @@
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from prominence import exceptions
+
+__all__ = ['RetryPolicy', 'RetryBudget', 'CircuitBreaker']
+
+class RetryPolicy(object):
+    """
+    Decide whether a request should be retried and how long to wait first. Idempotent requests are
+    retried after connection errors and 502, 503 and 504 responses; any request is retried after a
+    429 response or a failure to connect, as the server has not processed it. Waits use exponential
+    backoff with full jitter, or the Retry-After header if present.
+    """
+    def __init__(self, retries=3, backoff_factor=0.5, max_backoff=30, max_retry_after=120,
+                 methods=('GET', 'HEAD', 'DELETE', 'OPTIONS'), statuses=(502, 503, 504)):
+        self.retries = retries
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._max_retry_after = max_retry_after
+        self._methods = methods
+        self._statuses = statuses
+
+    def should_retry(self, method, attempt, response=None, error=None):
+        """
+        Return True if a request should be retried after the specified attempt, counted from 0
+        """
+        if attempt >= self.retries:
+            return False
+
+        if error is not None:
+            if failed_to_connect(error):
+                return True
+            if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                return method in self._methods
+            return False
+
+        if response.status_code != 429 and (response.status_code not in self._statuses or method not in self._methods):
+            return False
+        delay = retry_after(response)
+        return delay is None or delay <= self._max_retry_after
+
+    def delay(self, attempt, response=None):
+        """
+        Return the number of seconds to wait before the next attempt
+        """
+        if response is not None:
+            delay = retry_after(response)
+            if delay is not None:
+                return min(delay, self._max_retry_after)
+        return random.uniform(0, min(self._max_backoff, self._backoff_factor*2**attempt))
+
+def failed_to_connect(error):
+    """
+    Return True if a request failed before a connection was established, e.g. because the connection
+    was refused or the host name could not be resolved, so that nothing was sent
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = error.args[0]
+    # urllib3 wraps the underlying error in MaxRetryError
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, NewConnectionError)
+
+def retry_after(response):
+    """
+    Return the number of seconds specified by the Retry-After header of a response, if any
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+class RetryBudget(object):
+    """
+    Limit retries to a fraction of requests so that retries cannot multiply the load on a server
+    which is already overloaded. Each request deposits ratio tokens and each retry withdraws one.
+    """
+    def __init__(self, ratio=0.2, minimum=10, maximum=100):
+        self._ratio = ratio
+        self._maximum = maximum
+        self._tokens = float(minimum)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """
+        Record a request
+        """
+        with self._lock:
+            self._tokens = min(self._tokens + self._ratio, self._maximum)
+
+    def withdraw(self):
+        """
+        Return True if a retry is permitted
+        """
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+        return False
+
+class CircuitBreaker(object):
+    """
+    Fail fast while an endpoint is unhealthy. After threshold consecutive failures the circuit opens
+    and requests fail immediately; after reset_timeout seconds a single trial request is allowed, and
+    the circuit closes again if it succeeds.
+    """
+    def __init__(self, threshold=5, reset_timeout=30):
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        Return the state of the circuit: closed, open or half-open
+        """
+        with self._lock:
+            if self._opened is None:
+                return 'closed'
+            if self._trial or time.time() - self._opened >= self._reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def allow(self):
+        """
+        Raise CircuitOpenError if a request should not be made
+        """
+        with self._lock:
+            if self._opened is None:
+                return
+            if not self._trial and time.time() - self._opened >= self._reset_timeout:
+                self._trial = True
+                return
+            remaining = max(self._reset_timeout - (time.time() - self._opened), 0)
+        raise exceptions.CircuitOpenError('PROMINENCE server unavailable after %d consecutive failures, '
+                                          'retrying in %d seconds' % (self._threshold, remaining))
+
+    def record_success(self):
+        """
+        Record a successful request
+        """
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def release(self):
+        """
+        Record that a request ended without a result, allowing another trial request
+        """
+        with self._lock:
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Record a failed request
+        """
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self._threshold:
+                self._opened = time.time()
+            self._trial = False
@@ -0,0 +1,228 @@
+import datetime
+import json
+import os
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+__all__ = ['create_transport', 'create_session', 'HTTPXTransport', 'FakeTransport', 'TRANSPORTS']
+
+# Available transports, the default can be selected using the PROMINENCE_TRANSPORT environment variable
+TRANSPORTS = ('requests', 'http2')
+
+# Size of chunks used when streaming request bodies
+CHUNK_SIZE = 1024*1024
+
+def create_session(pool_size=10, retries=3, backoff_factor=0.5):
+    """
+    Create a requests session with a keep-alive connection pool and retries
+    """
+    # Only requests which cannot create resources are retried after a response has been received,
+    # connection errors are retried for all methods as the request never reached the server
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset(['GET', 'HEAD', 'DELETE', 'OPTIONS']),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def create_transport(name=None, pool_size=10, retries=3, backoff_factor=0.5):
+    """
+    Create a transport, an object with the same interface as a requests session
+    """
+    if not name:
+        name = os.environ.get('PROMINENCE_TRANSPORT', 'requests')
+
+    if name == 'requests':
+        return create_session(pool_size, retries, backoff_factor)
+    elif name == 'http2':
+        return HTTPXTransport(pool_size, retries)
+
+    raise ValueError('Unknown transport "%s", must be one of: %s' % (name, ', '.join(TRANSPORTS)))
+
+class _StreamedContent(object):
+    """
+    Raw content of a streamed httpx response, as expected by requests
+    """
+    def __init__(self, response):
+        self._response = response
+
+    def stream(self, chunk_size, decode_content=True):
+        try:
+            for data in self._response.iter_bytes(chunk_size):
+                yield data
+        except httpx.HTTPError as err:
+            raise requests.exceptions.ConnectionError(err)
+
+    def close(self):
+        self._response.close()
+
+def _to_response(response, stream):
+    """
+    Convert an httpx response into a requests response
+    """
+    result = requests.models.Response()
+    result.status_code = response.status_code
+    result.headers = CaseInsensitiveDict(response.headers)
+    result.url = str(response.url)
+    result.reason = response.reason_phrase
+    result.encoding = response.charset_encoding
+    if stream:
+        result.raw = _StreamedContent(response)
+        result.elapsed = datetime.timedelta(0)
+    else:
+        result._content = response.content
+        result._content_consumed = True
+        result.elapsed = response.elapsed
+    return result
+
+class HTTPXTransport(object):
+    """
+    Transport using httpx which multiplexes concurrent requests to the same host over a single
+    HTTP/2 connection. Responses and errors are converted to their requests equivalents so that it
+    can be used in place of a requests session. Requires the optional httpx dependency.
+    """
+    def __init__(self, pool_size=10, retries=3, http2=True):
+        if httpx is None:
+            raise ImportError('The http2 transport requires httpx, install it using "pip install prominence[http2]"')
+
+        verify = os.environ.get('PROMINENCE_SSL_VERIFY') != 'False'
+        # Limits must be given to the transport, as the client ignores its own if a transport is specified
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = httpx.Client(http2=http2,
+                                    verify=verify,
+                                    transport=httpx.HTTPTransport(http2=http2,
+                                                                  verify=verify,
+                                                                  retries=retries,
+                                                                  limits=limits))
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None, stream=False, files=None,
+                auth=None, allow_redirects=True, **kwargs):
+        """
+        Make a request, accepting the same arguments as a requests session
+        """
+        content = None
+        if isinstance(data, (str, bytes)):
+            content, data = data, None
+        elif hasattr(data, 'read'):
+            # Stream file-like request bodies in chunks
+            reader = data
+            content, data = iter(lambda: reader.read(CHUNK_SIZE), b''), None
+            if hasattr(reader, '__len__'):
+                headers = dict(headers or {}, **{'Content-Length': str(len(reader))})
+
+        try:
+            request = self._client.build_request(method,
+                                                 url,
+                                                 params=params,
+                                                 content=content,
+                                                 data=data,
+                                                 files=files,
+                                                 headers=headers,
+                                                 timeout=timeout)
+            response = self._client.send(request, stream=stream, auth=auth, follow_redirects=allow_redirects)
+        except httpx.ConnectTimeout as err:
+            raise requests.exceptions.ConnectTimeout(err)
+        except httpx.TimeoutException as err:
+            raise requests.exceptions.Timeout(err)
+        except httpx.ConnectError as err:
+            raise requests.exceptions.ConnectionError(NewConnectionError(None, str(err)))
+        except httpx.HTTPError as err:
+            raise requests.exceptions.ConnectionError(err)
+
+        return _to_response(response, stream)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        """
+        Close all connections
+        """
+        self._client.close()
+
+class FakeTransport(object):
+    """
+    In-process transport for tests. Routes map a path relative to the base URL, or a (method, path)
+    tuple, to a (status code, body) or (status code, body, headers) tuple, or to a callable taking the
+    method, path and request keyword arguments and returning one. Bodies other than bytes or strings
+    are returned as JSON. Requests are recorded as (method, path) in calls.
+    """
+    def __init__(self, routes=None, base_url=None, latency=0):
+        self.routes = routes or {}
+        self.calls = []
+        self._base_url = base_url
+        self._latency = latency
+
+    def request(self, method, url, **kwargs):
+        """
+        Return the response for the matching route, or a 404 response
+        """
+        path = url.split('?')[0]
+        if self._base_url and path.startswith(self._base_url):
+            path = path[len(self._base_url):]
+        self.calls.append((method, path))
+
+        if self._latency:
+            time.sleep(self._latency)
+
+        route = self.routes.get((method, path), self.routes.get(path))
+        if route is None:
+            route = (404, {'error': 'Not found'})
+        elif callable(route):
+            route = route(method, path, kwargs)
+        status_code, body = route[:2]
+
+        response = requests.models.Response()
+        response.status_code = status_code
+        if len(route) > 2:
+            response.headers.update(route[2])
+        response.url = url
+        response.elapsed = datetime.timedelta(seconds=self._latency)
+        response._content_consumed = True
+        if isinstance(body, bytes):
+            response._content = body
+        elif isinstance(body, str):
+            response._content = body.encode()
+            response.encoding = 'utf-8'
+        else:
+            response._content = json.dumps(body).encode()
+            response.headers['Content-Type'] = 'application/json'
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        pass
@@ -0,0 +1,267 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import xml.etree.ElementTree as ElementTree
+import requests
+
+from prominence import exceptions
+
+__all__ = ['upload_blocks', 'upload_stream', 'create_tarball', 'UploadManifest']
+
+# Size of each block for block blob uploads
+BLOCK_SIZE = 8*1024*1024
+
+# Files at least this large are uploaded in parallel blocks where the storage supports it
+MULTIPART_THRESHOLD = 64*1024*1024
+
+# Largest file for which the checksum can be sent to the server (Python requests & urllib3 don't
+# support streaming uploads of files > 2 GB when additional data is specified)
+MAX_CHECKSUM_SIZE = 2147483647
+
+class HashingReader(object):
+    """
+    File wrapper which calculates the sha256 checksum of everything read through it
+    """
+    def __init__(self, fh, size):
+        self._fh = fh
+        self._size = size
+        self.sha256 = hashlib.sha256()
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        data = self._fh.read(size)
+        self.sha256.update(data)
+        return data
+
+class HashingWriter(object):
+    """
+    File wrapper which calculates the sha256 checksum of everything written through it
+    """
+    def __init__(self, fh):
+        self._fh = fh
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._fh.write(data)
+
+    def flush(self):
+        self._fh.flush()
+
+class UploadManifest(object):
+    """
+    Local record of the checksums of uploaded objects, and of local files, used to avoid uploading
+    identical content again
+    """
+    def __init__(self, filename=None):
+        if not filename:
+            filename = os.path.expanduser('~/.prominence/uploads')
+        self._filename = filename
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """
+        Read the manifest if necessary
+        """
+        if self._data is None:
+            try:
+                with open(self._filename) as fh:
+                    self._data = json.load(fh)
+            except (IOError, ValueError):
+                self._data = {}
+            self._data.setdefault('objects', {})
+            self._data.setdefault('files', {})
+        return self._data
+
+    def _save(self):
+        """
+        Write the manifest atomically
+        """
+        try:
+            directory = os.path.dirname(self._filename)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open('%s.tmp' % self._filename, 'w') as fh:
+                json.dump(self._data, fh)
+            os.chmod('%s.tmp' % self._filename, 0o600)
+            os.replace('%s.tmp' % self._filename, self._filename)
+        except (IOError, OSError):
+            pass
+
+    def file_checksum(self, filename):
+        """
+        Return the checksum of a local file if it is known and the file has not been modified
+        """
+        stat = os.stat(filename)
+        with self._lock:
+            entry = self._load()['files'].get(os.path.abspath(filename))
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['sha256']
+        return None
+
+    def object_checksum(self, name):
+        """
+        Return the checksum of the content last uploaded with the specified object name
+        """
+        with self._lock:
+            entry = self._load()['objects'].get(name)
+        if entry:
+            return entry['sha256']
+        return None
+
+    def record(self, name, filename, checksum):
+        """
+        Record that a local file with the specified checksum has been uploaded as an object
+        """
+        if not checksum:
+            return
+        stat = os.stat(filename)
+        with self._lock:
+            data = self._load()
+            data['objects'][name] = {'sha256': checksum, 'size': stat.st_size}
+            data['files'][os.path.abspath(filename)] = {'sha256': checksum,
+                                                        'size': stat.st_size,
+                                                        'mtime': stat.st_mtime_ns}
+            self._save()
+
+def create_tarball(directory, filename):
+    """
+    Create a gzipped tarball of a directory, returning its sha256 checksum. Entries are added in a
+    fixed order and no timestamp is stored in the gzip header, so an unchanged directory always
+    produces an identical tarball.
+    """
+    with open(filename, 'wb') as fh:
+        writer = HashingWriter(fh)
+        with gzip.GzipFile(filename='', mode='wb', fileobj=writer, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w') as tar:
+                tar.add(directory, arcname='.')
+    return writer.sha256.hexdigest()
+
+def _url_with(url, params):
+    """
+    Add query parameters to a presigned URL
+    """
+    separator = '&' if '?' in url else '?'
+    return url + separator + '&'.join('%s=%s' % (key, requests.utils.quote(value, safe='')) for key, value in params)
+
+def _block_id(fingerprint, index):
+    """
+    Return the id of a block. Ids include a fingerprint of the local file so that blocks from a
+    different version of the file are never reused.
+    """
+    return base64.b64encode(('%s-%08d' % (fingerprint, index)).encode()).decode()
+
+def _uncommitted_blocks(session, url, timeout):
+    """
+    Return the names and sizes of blocks already uploaded but not yet committed
+    """
+    try:
+        response = session.get(_url_with(url, [('comp', 'blocklist'), ('blocklisttype', 'uncommitted')]),
+                               timeout=timeout)
+    except requests.exceptions.RequestException:
+        return {}
+
+    if response.status_code != 200:
+        return {}
+
+    blocks = {}
+    try:
+        for block in ElementTree.fromstring(response.content).iter('Block'):
+            blocks[block.findtext('Name')] = int(block.findtext('Size'))
+    except (ElementTree.ParseError, TypeError, ValueError):
+        return {}
+    return blocks
+
+def _put_block(session, url, block_id, data, timeout, retries):
+    """
+    Upload a single block, retrying if necessary
+    """
+    headers = {'Content-MD5': base64.b64encode(hashlib.md5(data).digest()).decode()}
+    failures = 0
+    while True:
+        try:
+            response = session.put(_url_with(url, [('comp', 'block'), ('blockid', block_id)]),
+                                   data=data,
+                                   headers=headers,
+                                   timeout=timeout)
+            if response.status_code == 201:
+                return
+            error = 'Got status code %d from cloud storage when uploading block' % response.status_code
+        except requests.exceptions.RequestException as err:
+            error = err
+
+        failures += 1
+        if failures > retries:
+            raise exceptions.FileUploadError(error)
+
+def upload_blocks(session, url, filename, block_size=BLOCK_SIZE, concurrency=4, timeout=60, retries=3):
+    """
+    Upload a file to Azure blob storage as blocks in parallel. The file is read once, in order,
+    calculating its sha256 checksum while blocks are uploaded, and blocks left uncommitted by a
+    previous attempt to upload the same file are not uploaded again. Returns the checksum.
+    """
+    stat = os.stat(filename)
+    fingerprint = hashlib.sha1(('%d:%d:%d' % (stat.st_size, stat.st_mtime_ns, block_size)).encode()).hexdigest()[:16]
+    existing = _uncommitted_blocks(session, url, timeout)
+
+    sha256 = hashlib.sha256()
+    block_ids = []
+    with open(filename, 'rb') as fh, ThreadPoolExecutor(concurrency) as executor:
+        pending = set()
+        for index, data in enumerate(iter(lambda: fh.read(block_size), b'')):
+            sha256.update(data)
+            block_id = _block_id(fingerprint, index)
+            block_ids.append(block_id)
+            if existing.get(block_id) == len(data):
+                continue
+
+            # Limit the number of blocks held in memory
+            while len(pending) >= 2*concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+            pending.add(executor.submit(_put_block, session, url, block_id, data, timeout, retries))
+
+        for future in pending:
+            future.result()
+
+    body = '<?xml version="1.0" encoding="utf-8"?><BlockList>%s</BlockList>' % \
+           ''.join('<Latest>%s</Latest>' % block_id for block_id in block_ids)
+    try:
+        response = session.put(_url_with(url, [('comp', 'blocklist')]),
+                               data=body,
+                               headers={'x-ms-meta-sha256': sha256.hexdigest()},
+                               timeout=timeout)
+    except requests.exceptions.RequestException as err:
+        raise exceptions.ConnectionError(err)
+
+    if response.status_code != 201:
+        raise exceptions.FileUploadError('Got status code %d from cloud storage when committing blocks' % response.status_code)
+
+    return sha256.hexdigest()
+
+def upload_stream(session, url, filename, headers=None, timeout=60, retries=3):
+    """
+    Upload a file in a single streaming PUT, calculating its sha256 checksum in the same pass.
+    Returns the response and the checksum.
+    """
+    size = os.path.getsize(filename)
+    failures = 0
+    while True:
+        with open(filename, 'rb') as fh:
+            reader = HashingReader(fh, size)
+            try:
+                return (session.put(url, data=reader, headers=headers, timeout=timeout), reader.sha256.hexdigest())
+            except requests.exceptions.RequestException as err:
+                failures += 1
+                if failures > retries:
+                    raise exceptions.ConnectionError(err)
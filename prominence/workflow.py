@@ -1,6 +1,7 @@
 import time
 
 from prominence import ProminenceClient, WorkflowPolicies
+from prominence.cache import TERMINAL_STATES
 
 class JobFactory(object):
     """
@@ -15,9 +16,12 @@ class Workflow(object):
     """
     Workflow
     """
-    def __init__(self, id=None):
+    def __init__(self, id=None, client=None):
         self._last_status_check = 0
-        self._client = ProminenceClient(authenticated=True)
+        if client:
+            self._client = client
+        else:
+            self._client = ProminenceClient(authenticated=True, cache=True)
         self._jobs = []
         self._id = id
         self._name = ''
@@ -87,17 +91,23 @@ class Workflow(object):
     def create(self):
         self._id = self._client.create_workflow(self.to_dict())
 
+    def _set_status(self, status, workflow=None):
+        """
+        Update the workflow status obtained elsewhere
+        """
+        self._status = status
+        self._last_status_check = time.time()
+
     @property
     def status(self):
         """
         Get the workflow status
         """
-        if time.time() - self._last_status_check > 5:
+        # If the status is non-terminal, get the current workflow JSON but not too frequently
+        if self._status not in TERMINAL_STATES and time.time() - self._last_status_check > 5:
             try:
-                job = self._client.describe_job(self._id)
-            except Exception as err:
-                if 'No such workflow' in str(err):
-                    workflow = self._client.describe_workflow(self._id)
+                workflow = self._client.describe_workflow(self._id, False)
+            except Exception:
                 return False
             self._status = workflow['status']
             self._last_status_check = time.time()
@@ -108,7 +118,7 @@ class Workflow(object):
         """
         Return True if the workflow is in a terminal state
         """
-        if self.status in ('completed', 'failed', 'deleted', 'killed'):
+        if self.status in TERMINAL_STATES:
             return True
         return False
 
@@ -123,6 +133,13 @@ class Workflow(object):
             time.sleep(5)
         return
 
+    def on_status_change(self, callback, listener):
+        """
+        Call callback with the workflow and the event whenever the workflow status changes, using events
+        received by a prominence.listener.Listener
+        """
+        listener.register(self, callback)
+
     def to_dict(self):
         """
         Return a JSON description of the job
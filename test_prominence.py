@@ -1,13 +1,88 @@
 """Test PROMINENCE CLI"""
+import asyncio
+import gzip
+import hashlib
+import inspect
+import io
 import json
+import jwt
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
 import pytest
+import requests
+import urllib3
 from prominence.cli import main
-from prominence import Resources, JobPolicies, WorkflowPolicies, Notification, Task, Job, InputFile, Artifact, Workflow, Dependency, ParameterSweep, Zip, ParameterSet, Repeat
+from prominence import exceptions
+from prominence.cache import StateCache
+from prominence import auth
+from prominence import cli
+from prominence import client as client_module
+from prominence import download, logs, profile, retry, upload
+from prominence.download import DownloadManager
+from prominence.transport import FakeTransport, create_transport
+from prominence import AsyncProminenceClient, JobGroup, ProminenceClient, Resources, JobPolicies, WorkflowPolicies, Notification, Task, Job, InputFile, Artifact, Workflow, Dependency, ParameterSweep, Zip, ParameterSet, Repeat
 
 default_resources = {"nodes": 1, "disk": 10, "cpus": 1, "memory": 1}
 default_tasks = [{"image": "centos:7", "runtime": "singularity"}]
 default_tasks_1 = [{'image': 'centos:7', 'runtime': 'singularity', 'cmd': 'hostname'}]
 
+def isolate(monkeypatch, tmp_path):
+    """
+    Keep the cache and upload records out of the real home directory and bypass any running agent
+    """
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('PROMINENCE_AGENT', 'False')
+
+class FakeSession(object):
+    """
+    Session returning canned JSON responses keyed by URL path
+    """
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        path = url.split('/v1', 1)[-1]
+        self.calls.append((method, path))
+        status_code, body = self.responses[path]
+        response = requests.models.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body).encode()
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self):
+        pass
+
+class RangeSession(object):
+    """
+    Session serving a file which supports byte-range requests
+    """
+    def __init__(self, content, fail_after=None):
+        self.content = content
+        self.fail_after = fail_after
+        self.ranges = []
+
+    def get(self, url, headers=None, **kwargs):
+        response = requests.models.Response()
+        start, end = 0, len(self.content) - 1
+        response.status_code = 200
+        if headers and 'Range' in headers:
+            start, end = [int(x) for x in headers['Range'].replace('bytes=', '').split('-')]
+            self.ranges.append((start, end))
+            response.status_code = 206
+            response.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(self.content))
+        if self.fail_after is not None and end > 0 and start >= self.fail_after:
+            raise requests.exceptions.ConnectionError('Connection reset')
+        response.raw = io.BytesIO(self.content[start:end + 1])
+        return response
+
 def test_create(capsys):
     """
     Test basic job create
@@ -974,3 +1049,1084 @@ def test_python_workflow_repeat():
                                             'resources': default_resources}],
                                   'factories': [{'name': 'repeat', 'type': 'repeat', 'jobs': ['job'], 'num': 10}],
                                   'name': 'testwf5'}
+
+def test_python_client_session():
+    """
+    Client connection pool configuration
+    """
+    client = ProminenceClient(pool_size=4, retries=5)
+    adapter = client.session.get_adapter('https://localhost')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 0
+    assert client._retry.retries == 5
+
+def test_python_client_session_shared():
+    """
+    Jobs and workflows share the session of the client they are built on
+    """
+    client = ProminenceClient(authenticated=True)
+    assert Job(client=client)._client.session is client.session
+    assert Workflow(client=client)._client.session is client.session
+
+def test_python_async_client(monkeypatch):
+    """
+    Async client runs calls concurrently with bounded concurrency and the same exceptions
+    """
+    client = ProminenceClient(authenticated=True)
+    lock = threading.Lock()
+    state = {'current': 0, 'max': 0}
+
+    def describe_job(job_id, input_only=False, fields=None):
+        with lock:
+            state['current'] += 1
+            state['max'] = max(state['max'], state['current'])
+        time.sleep(0.01)
+        with lock:
+            state['current'] -= 1
+        if job_id == 0:
+            raise exceptions.JobGetError('No such job')
+        return {'id': job_id, 'status': 'running'}
+
+    monkeypatch.setattr(client, 'describe_job', describe_job)
+    monkeypatch.setattr(client, 'iter_jobs', lambda *args: iter([{'id': job_id} for job_id in range(5)]))
+
+    async def run():
+        async with AsyncProminenceClient(client=client, concurrency=4) as async_client:
+            jobs = await asyncio.gather(*[async_client.describe_job(job_id) for job_id in range(1, 21)])
+            with pytest.raises(exceptions.JobGetError):
+                await async_client.describe_job(0)
+            listed = [job['id'] async for job in async_client.iter_jobs(page_size=2)]
+        return jobs, listed
+
+    jobs, listed = asyncio.run(run())
+    assert [job['id'] for job in jobs] == list(range(1, 21))
+    assert 1 < state['max'] <= 4
+    assert listed == list(range(5))
+
+    # Methods take the same arguments as the blocking client, except for concurrency which is set
+    # for the async client as a whole
+    for name, method in vars(AsyncProminenceClient).items():
+        if not name.startswith('_') and callable(method) and hasattr(ProminenceClient, name):
+            expected = [parameter for parameter in inspect.signature(getattr(ProminenceClient, name)).parameters.values()
+                        if name != 'create_jobs' or parameter.name != 'concurrency']
+            assert list(inspect.signature(method).parameters.values()) == expected, name
+
+def test_python_create_jobs(monkeypatch):
+    """
+    Bulk job creation returns per-job results and errors in the original order
+    """
+    client = ProminenceClient(authenticated=True)
+
+    def create_job(job):
+        if job['name'] == 'bad':
+            raise exceptions.JobCreationError('Invalid job')
+        return int(job['name'])
+
+    monkeypatch.setattr(client, 'create_job', create_job)
+    jobs = ({'name': name} for name in ['1', 'bad', '3', '4'])
+    results = client.create_jobs(jobs, concurrency=2, rate=1000)
+    assert [job_id for job_id, _ in results] == [1, None, 3, 4]
+    assert isinstance(results[1][1], exceptions.JobCreationError)
+
+    # A malformed description only fails that job
+    monkeypatch.setattr(client, 'create_job', lambda job: int(job['name']))
+    results = client.create_jobs([{'name': '1'}, {}, {'name': '3'}], concurrency=2)
+    assert [job_id for job_id, _ in results] == [1, None, 3]
+    assert str(results[1][1]) == "Invalid job description: KeyError: 'name'"
+
+def test_run_batch(monkeypatch, tmp_path, capsys):
+    """
+    Test batch job submission from JSON lines and YAML documents
+    """
+    submitted = []
+
+    def create_job(self, job):
+        submitted.append(job)
+        return len(submitted)
+
+    monkeypatch.setattr(ProminenceClient, 'create_job', create_job)
+
+    jsonl = tmp_path / 'jobs.jsonl'
+    jsonl.write_text('{"name": "a", "tasks": [{"image": "centos:7"}]}\n\n{"name": "b", "tasks": [{"image": "centos:7"}]}\n')
+    main(["run", "--batch", "--concurrency=2", str(jsonl)])
+
+    yml = tmp_path / 'jobs.yaml'
+    yml.write_text('name: c\ntasks:\n- image: centos:7\n---\nname: d\ntasks:\n- image: centos:7\n  cmd: "a\\nb"\n')
+    main(["run", "--batch", str(yml)])
+
+    assert sorted(job['name'] for job in submitted) == ['a', 'b', 'c', 'd']
+    assert [job for job in submitted if job['name'] == 'd'][0]['tasks'][1]['cmd'] == 'b'
+    assert capsys.readouterr().out.count('Job created with id') == 4
+
+    # Jobs submitted before an invalid document are still reported
+    jsonl.write_text('{"name": "e", "tasks": [{"image": "centos:7"}]}\n{"name": "f", "jobs": []}\n')
+    with pytest.raises(SystemExit):
+        main(["run", "--batch", str(jsonl)])
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ['Job created with id 5 from document 1',
+                     'Error: document 2: only jobs can be submitted in batch mode']
+
+def test_python_cache(tmp_path):
+    """
+    Terminal records are frozen and only replaced by records with more detail
+    """
+    cache = StateCache(str(tmp_path / 'cache.db'))
+    cache.put_many('job', [{'id': 1, 'status': 'running'}, {'id': 2, 'status': 'completed'}])
+    assert cache.get('job', 1) == {'id': 1, 'status': 'running'}
+    assert cache.get('job', 1, detail=True) is None
+    assert cache.get_frozen('job', 1) is None
+    assert cache.get_frozen('job', 2) == {'id': 2, 'status': 'completed'}
+
+    cache.put('job', {'id': 2, 'status': 'completed', 'tasks': []}, detail=True)
+    cache.put('job', {'id': 2, 'status': 'completed'})
+    assert cache.get_frozen('job', 2, detail=True) == {'id': 2, 'status': 'completed', 'tasks': []}
+
+def test_python_cache_per_server(monkeypatch, tmp_path):
+    """
+    Jobs cached from one server are not returned for another
+    """
+    monkeypatch.setenv('HOME', str(tmp_path))
+    StateCache(url='https://a.test/v1').put('job', {'id': 1, 'status': 'completed'})
+    assert StateCache(url='https://a.test/v1/').get_frozen('job', 1) == {'id': 1, 'status': 'completed'}
+    assert StateCache(url='https://b.test/v1').get_frozen('job', 1) is None
+    assert oct(os.stat(str(tmp_path / '.prominence' / os.listdir(str(tmp_path / '.prominence'))[0])).st_mode & 0o777) == '0o600'
+
+def test_python_describe_cached(tmp_path):
+    """
+    Completed jobs are only fetched once
+    """
+    session = FakeSession({'/jobs/1': (200, [{'id': 1, 'status': 'completed', 'events': {}}]),
+                           '/jobs/2': (200, [{'id': 2, 'status': 'running', 'events': {}}])})
+    client = ProminenceClient(authenticated=True, session=session, cache=StateCache(str(tmp_path / 'cache.db')))
+    for _ in range(3):
+        assert client.describe_job(1)['status'] == 'completed'
+        assert client.describe_job(2)['status'] == 'running'
+    assert 'id' not in client.describe_job(1, input_only=True)
+    assert session.calls.count(('GET', '/jobs/1')) == 1
+    assert session.calls.count(('GET', '/jobs/2')) == 3
+
+def test_python_job_group():
+    """
+    Jobs are resolved using one listing per poll and yielded as they finish
+    """
+    states = {1: ['idle', 'running', 'completed'], 2: ['running', 'running', 'running', 'failed']}
+    calls = []
+
+    class Client(object):
+        def list_jobs(self):
+            calls.append('list')
+            return [{'id': id, 'status': states[id].pop(0)} for id in states if len(states[id]) > 1]
+
+        def describe_job(self, id):
+            calls.append(id)
+            return {'id': id, 'status': states[id][0]}
+
+    client = Client()
+    jobs = [Job(client=client), Job(client=client)]
+    jobs[0]._id = 1
+    jobs[1]._id = 2
+    group = JobGroup(jobs, interval=0.001)
+
+    assert [job.id for job in group.as_completed()] == [1, 2]
+    assert calls == ['list', 'list', 'list', 1, 'list', 2]
+    assert group.wait() == (jobs, [])
+
+    # Server errors and an open circuit breaker do not end the wait
+    errors = [exceptions.JobGetError('Unknown error'), exceptions.CircuitOpenError('Circuit open')]
+
+    class FailingClient(object):
+        def list_jobs(self):
+            if errors:
+                raise errors.pop(0)
+            return []
+
+        def describe_job(self, id):
+            return {'id': id, 'status': 'completed'}
+
+    job = Job(client=FailingClient())
+    job._id = 3
+    assert JobGroup([job], interval=0.001).wait() == ([job], [])
+    assert not errors
+
+def test_download_parallel_resume(monkeypatch, tmp_path):
+    """
+    Large files are downloaded using parallel ranges and interrupted downloads are resumed
+    """
+    monkeypatch.setattr(download, 'PARALLEL_THRESHOLD', 100)
+    monkeypatch.setattr(download, 'CHUNK_SIZE', 10)
+    content = os.urandom(1000)
+    checksum = hashlib.sha256(content).hexdigest()
+    filename = str(tmp_path / 'output.tgz')
+
+    session = RangeSession(content, fail_after=600)
+    with pytest.raises(exceptions.DownloadError):
+        download.download_file('https://storage/output.tgz', filename, session, streams=4, retries=0)
+    assert not os.path.exists(filename)
+    assert os.path.exists(filename + '.part.json')
+
+    session = RangeSession(content)
+    assert download.download_file('https://storage/output.tgz', filename, session, streams=4, checksum=checksum)
+    assert open(filename, 'rb').read() == content
+    assert not os.path.exists(filename + '.part')
+    assert not os.path.exists(filename + '.part.json')
+    assert (0, 249) not in session.ranges
+    assert (750, 999) in session.ranges
+
+    assert not download.download_file('https://storage/output.tgz', filename, session)
+    with pytest.raises(exceptions.DownloadError):
+        download.download_file('https://storage/output.tgz', filename, session, force=True, checksum='0')
+
+def test_download_manager(monkeypatch, tmp_path):
+    """
+    Download manager reports progress and records failures
+    """
+    content = os.urandom(500)
+    manager = DownloadManager(RangeSession(content, fail_after=0), concurrency=2)
+    manager.add('https://storage/a', str(tmp_path / 'a'))
+    reports = []
+    failures = manager.run(reports.append, interval=0.01)
+    assert [progress.filename for progress in failures] == [str(tmp_path / 'a')]
+    assert isinstance(failures[0].error, exceptions.DownloadError)
+
+    manager = DownloadManager(RangeSession(content), concurrency=2)
+    manager.add('https://storage/a', str(tmp_path / 'a'))
+    manager.add('https://storage/b', str(tmp_path / 'b'))
+    assert manager.run(reports.append, interval=0.01) == []
+    assert [progress.status for progress in manager.files] == ['done', 'done']
+    assert sum(progress.transferred for progress in manager.files) == 1000
+    assert reports[-1] is manager
+    assert manager.eta() == 0
+
+    # Unexpected errors are recorded as failures rather than lost in the thread pool
+    def replace(source, target):
+        raise OSError('Permission denied')
+
+    manager = DownloadManager(RangeSession(content), concurrency=2)
+    manager.add('https://storage/c', str(tmp_path / 'c'))
+    monkeypatch.setattr(os, 'replace', replace)
+    failures = manager.run(interval=0.01)
+    assert [progress.status for progress in manager.files] == ['failed']
+    assert isinstance(failures[0].error, exceptions.IOError)
+
+    monkeypatch.setattr(download, 'download_file', lambda *args, **kwargs: 1/0)
+    manager = DownloadManager(RangeSession(content))
+    manager.add('https://storage/d', str(tmp_path / 'd'))
+    assert isinstance(manager.run(interval=0.01)[0].error, ZeroDivisionError)
+
+def test_upload_blocks(monkeypatch, tmp_path):
+    """
+    Blocks are uploaded in parallel, uncommitted blocks are reused and the checksum is calculated
+    """
+    content = os.urandom(1000)
+    filename = tmp_path / 'input.tgz'
+    filename.write_bytes(content)
+
+    class BlobSession(object):
+        def __init__(self, uncommitted=None):
+            self.blocks = {}
+            self.uncommitted = uncommitted or {}
+            self.committed = None
+
+        def get(self, url, **kwargs):
+            response = requests.models.Response()
+            response.status_code = 200
+            response._content = ('<BlockList><UncommittedBlocks>%s</UncommittedBlocks></BlockList>' %
+                                 ''.join('<Block><Name>%s</Name><Size>%d</Size></Block>' % (name, len(data))
+                                         for name, data in self.uncommitted.items())).encode()
+            return response
+
+        def put(self, url, data=None, headers=None, **kwargs):
+            params = dict(item.split('=') for item in url.split('?')[1].split('&'))
+            response = requests.models.Response()
+            response.status_code = 201
+            if params['comp'] == 'block':
+                self.blocks[requests.utils.unquote(params['blockid'])] = data
+            else:
+                ids = re.findall('<Latest>(.*?)</Latest>', data)
+                blocks = dict(self.uncommitted, **self.blocks)
+                self.committed = b''.join(blocks[block_id] for block_id in ids)
+                self.sha256 = headers['x-ms-meta-sha256']
+            return response
+
+    url = 'https://example.blob.core.windows.net/container/input.tgz?sig=abc'
+    session = BlobSession()
+    checksum = upload.upload_blocks(session, url, str(filename), block_size=100, concurrency=3)
+    assert checksum == hashlib.sha256(content).hexdigest() == session.sha256
+    assert session.committed == content
+    assert len(session.blocks) == 10
+
+    uncommitted = dict(list(session.blocks.items())[:6])
+    session = BlobSession(uncommitted)
+    upload.upload_blocks(session, url, str(filename), block_size=100, concurrency=3)
+    assert session.committed == content
+    assert len(session.blocks) == 4
+
+def test_upload_dedup(monkeypatch, tmp_path):
+    """
+    Identical content is not uploaded again if the object still exists
+    """
+    monkeypatch.setenv('HOME', str(tmp_path))
+    directory = tmp_path / 'input'
+    directory.mkdir()
+    (directory / 'a.txt').write_text('hello')
+    (directory / 'b.txt').write_text('world')
+
+    first = upload.create_tarball(str(directory), str(tmp_path / 'first.tar.gz'))
+    second = upload.create_tarball(str(directory), str(tmp_path / 'second.tar.gz'))
+    assert first == second == hashlib.sha256((tmp_path / 'first.tar.gz').read_bytes()).hexdigest()
+
+    class StorageSession(FakeSession):
+        def __init__(self):
+            FakeSession.__init__(self, {})
+            self.objects = {}
+            self.checksums = []
+
+        def get(self, url, **kwargs):
+            self.responses['/data'] = (200, [{'name': name, 'size': size, 'lastModified': ''}
+                                             for name, size in self.objects.items()])
+            return self.request('GET', url, **kwargs)
+
+        def post(self, url, data=None, **kwargs):
+            self.calls.append(('POST', json.loads(data)['filename']))
+            self.checksums.append(json.loads(data)['checksum'])
+            response = requests.models.Response()
+            response.status_code = 201
+            response._content = json.dumps({'url': 'https://storage/%s' % json.loads(data)['filename']}).encode()
+            return response
+
+        def put(self, url, data=None, **kwargs):
+            self.objects[url.split('/')[-1]] = len(data.read())
+            response = requests.models.Response()
+            response.status_code = 201
+            return response
+
+    session = StorageSession()
+    client = ProminenceClient(session=session)
+    name = client.upload_content(str(tmp_path / 'first.tar.gz'), first, '.tar.gz')
+    assert name == '%s.tar.gz' % first
+    assert client.upload_content(str(tmp_path / 'second.tar.gz'), second, '.tar.gz') == name
+    assert [call for call in session.calls if call[0] == 'POST'] == [('POST', name)]
+
+    filename = tmp_path / 'input.txt'
+    filename.write_text('data')
+    assert client.upload('input.txt', str(filename))
+    assert ProminenceClient(session=session).upload('input.txt', str(filename))
+    assert len([call for call in session.calls if call == ('POST', 'input.txt')]) == 1
+
+    # Modified files and deleted objects are uploaded again
+    filename.write_text('changed')
+    client.upload('input.txt', str(filename))
+    del session.objects['input.txt']
+    client.upload('input.txt', str(filename))
+    assert len([call for call in session.calls if call == ('POST', 'input.txt')]) == 3
+
+    # Large files are checksummed after finding they are not going to blob storage
+    monkeypatch.setattr(client_module, 'MULTIPART_THRESHOLD', 3)
+    filename.write_text('large')
+    assert client.upload('large.txt', str(filename))
+    assert session.checksums[-2:] == [None, hashlib.sha256(b'large').hexdigest()]
+
+def test_log_follower(monkeypatch):
+    """
+    Output from all streams and nodes is followed with infrequent status checks
+    """
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+
+    class LogClient(object):
+        def __init__(self):
+            self.output = {(0, 'stdout'): ['a', '', 'b\nc', ''], (1, 'stdout'): ['x'],
+                           (0, 'stderr'): ['', 'err'], (1, 'stderr'): []}
+            self.statuses = ['pending', 'running', 'running', 'completed']
+            self.calls = []
+
+        def describe_job(self, id, input_only=False):
+            self.calls.append('describe')
+            return {'status': self.statuses.pop(0)}
+
+        def _get(self, stream, node, offset):
+            self.calls.append(stream)
+            chunks = self.output[(node, stream)]
+            return chunks.pop(0) if chunks else ''
+
+        def stdout_generic(self, type, id, node, job=None, instance=-1, offset=0):
+            return self._get('stdout', node, offset)
+
+        def stderr_generic(self, type, id, node, job=None, instance=-1, offset=0):
+            return self._get('stderr', node, offset)
+
+    client = LogClient()
+    clock = iter(range(0, 1000, 5))
+    monkeypatch.setattr(time, 'time', lambda: next(clock))
+    follower = logs.LogFollower(client, 'job', 1, nodes=(0, 1), status_interval=12)
+    output = list(follower.follow())
+
+    assert output == [(0, 'stdout', 'a'), (1, 'stdout', 'x'), (0, 'stderr', 'err'), (0, 'stdout', 'b\nc')]
+    assert client.calls.count('describe') == 4
+    assert client.calls.count('stdout') > client.calls.count('describe')
+    assert follower._offsets[(0, 'stdout')] == 4
+
+def test_python_client_hooks():
+    """
+    Hooks are fired before and after every request and can feed the profiler
+    """
+    session = FakeSession({'/jobs': (200, [{'id': 1, 'status': 'running'}]),
+                           '/jobs/2': (404, {})})
+    events = []
+    profiler = profile.Profiler()
+    profiler.enable()
+    client = ProminenceClient(session=session, hooks=[lambda event, info: events.append((event, dict(info)))])
+    client.add_hook(profiler.record_request)
+
+    client.list_jobs()
+    with pytest.raises(exceptions.ConnectionError):
+        client.describe_job(2)
+
+    assert [(event, info['method'], info['endpoint'], info['status']) for event, info in events] == \
+        [('before', 'GET', '/jobs', None), ('after', 'GET', '/jobs', 200),
+         ('before', 'GET', '/jobs/2', None), ('after', 'GET', '/jobs/2', 404)]
+    assert events[1][1]['bytes_in'] == len(json.dumps([{'id': 1, 'status': 'running'}]))
+
+    output = io.StringIO()
+    profiler.report(output)
+    assert re.search(r'^request\s+2\s', output.getvalue(), re.M)
+    assert 'GET    /jobs ' in output.getvalue()
+
+    # Time spent obtaining items from an iterator is recorded separately
+    def slow():
+        time.sleep(0.02)
+        yield 1
+
+    items = profiler.iterate('fetch', slow())
+    assert list(items) == [1] and items.elapsed >= 0.02
+    output = io.StringIO()
+    profiler.report(output)
+    assert re.search(r'^fetch\s+1\s', output.getvalue(), re.M)
+
+def test_python_fake_transport(monkeypatch, tmp_path):
+    """
+    The client, job and download code work with a transport other than a requests session
+    """
+    monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+    transport = FakeTransport({'/jobs/1': (200, [{'id': 1, 'status': 'running', 'events': {}}]),
+                               ('DELETE', '/jobs/1'): lambda method, path, kwargs: (200, {}),
+                               '/files/output.txt': (200, b'content')},
+                              base_url='http://prominence.test/v1')
+    client = ProminenceClient(session=transport)
+    assert client.describe_job(1)['status'] == 'running'
+    assert client.delete_job(1)
+    with pytest.raises(exceptions.ConnectionError):
+        client.describe_job(2)
+
+    url = 'http://prominence.test/v1/files/output.txt'
+    assert download.download_file(url, str(tmp_path / 'output.txt'), transport)
+    assert (tmp_path / 'output.txt').read_bytes() == b'content'
+    assert transport.calls[:3] == [('GET', '/jobs/1'), ('DELETE', '/jobs/1'), ('GET', '/jobs/2')]
+
+    assert isinstance(create_transport('requests'), requests.Session)
+    with pytest.raises(ValueError):
+        create_transport('unknown')
+
+def test_python_conditional_requests(monkeypatch):
+    """
+    Unchanged resources are served from the last response and large bodies are compressed
+    """
+    monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+    job = [{'id': 1, 'status': 'running', 'events': {}}]
+    requests_seen = []
+
+    def describe(method, path, kwargs):
+        requests_seen.append(kwargs['headers'])
+        if kwargs['headers'].get('If-None-Match') == '"v1"':
+            return (304, b'')
+        return (200, job, {'ETag': '"v1"'})
+
+    def create(method, path, kwargs):
+        requests_seen.append(kwargs['headers'])
+        return (201, {'id': len(json.loads(gzip.decompress(kwargs['data'])))})
+
+    transport = FakeTransport({'/jobs/1': describe, ('POST', '/workflows'): create},
+                              base_url='http://prominence.test/v1')
+
+    client = ProminenceClient(session=transport, compress=True)
+    for _ in range(3):
+        assert client.describe_job(1)['status'] == 'running'
+    assert [headers.get('If-None-Match') for headers in requests_seen] == [None, '"v1"', '"v1"']
+    assert all(headers['Accept-Encoding'] == 'gzip' for headers in requests_seen)
+
+    workflow = {'name': 'w', 'jobs': [{'name': 'x'*100000}]}
+    assert client.create_workflow(workflow) == len(workflow)
+    assert requests_seen[-1]['Content-Encoding'] == 'gzip'
+
+def test_python_iter_jobs(monkeypatch, capsys):
+    """
+    Listings are decoded incrementally and fetched in pages, with or without server-side paging
+    """
+    body = json.dumps([{'id': 1, 'name': 'café'}, {'id': 23}, {'id': 4.5}]).encode()
+    chunks = [body[i:i + 3] for i in range(0, len(body), 3)]
+    assert list(client_module.iter_json_array(chunks)) == [{'id': 1, 'name': 'café'}, {'id': 23}, {'id': 4.5}]
+    assert list(client_module.iter_json_array([b' [ ] '])) == []
+    with pytest.raises(ValueError):
+        list(client_module.iter_json_array([b'[{"id": 1}']))
+
+    monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+    jobs = [{'id': index, 'status': 'running', 'name': '', 'events': {'createTime': 0},
+             'tasks': [{'image': 'centos:7', 'cmd': 'hostname'}]} for index in range(1, 2501)]
+
+    def paged(method, path, kwargs):
+        offset, limit = kwargs['params']['offset'], kwargs['params']['limit']
+        return (200, jobs[offset:offset + limit])
+
+    transport = FakeTransport({'/jobs': paged}, base_url='http://prominence.test/v1')
+    client = ProminenceClient(session=transport)
+    assert [job['id'] for job in client.iter_jobs(page_size=1000)] == list(range(1, 2501))
+    assert len(transport.calls) == 3
+
+    transport = FakeTransport({'/jobs': (200, jobs[:1000])}, base_url='http://prominence.test/v1')
+    client = ProminenceClient(session=transport)
+    assert len(list(client.iter_jobs(page_size=1000))) == 1000
+    assert len(transport.calls) == 2
+
+    monkeypatch.setattr(ProminenceClient, 'iter_jobs', lambda self, *args: iter(reversed(jobs[:3])))
+    main(['list'])
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines] == ['ID', '1', '2', '3']
+
+def test_python_retries(monkeypatch):
+    """
+    Overloaded responses are retried with backoff within a budget, and the circuit breaker fails fast
+    """
+    monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    responses = [(503, {}, {'Retry-After': '7'}), (429, {}), (200, [{'id': 1, 'status': 'running'}])]
+    transport = FakeTransport({'/jobs/1': lambda method, path, kwargs: responses.pop(0),
+                               '/jobs': (503, {}),
+                               ('POST', '/jobs'): (503, {})},
+                              base_url='http://prominence.test/v1')
+    client = ProminenceClient(session=transport, retries=3, backoff_factor=1)
+
+    assert client.describe_job(1)['status'] == 'running'
+    assert sleeps[0] == 7 and 0 <= sleeps[1] <= 2
+
+    # Job creation is not idempotent so is not retried after a 503
+    with pytest.raises(exceptions.JobCreationError):
+        client.create_job({'name': 'test'})
+    assert transport.calls.count(('POST', '/jobs')) == 1
+
+    # Consecutive failures open the circuit
+    with pytest.raises(exceptions.JobGetError):
+        client.list_jobs()
+    calls = len(transport.calls)
+    with pytest.raises(exceptions.CircuitOpenError):
+        client.list_jobs()
+    assert len(transport.calls) == calls
+
+    budget = retry.RetryBudget(ratio=0.5, minimum=1)
+    assert budget.withdraw() and not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+    breaker = retry.CircuitBreaker(threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    breaker.allow()
+    with pytest.raises(exceptions.CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+    # Requests which were never sent are retried whatever the method
+    policy = retry.RetryPolicy()
+    refused = requests.exceptions.ConnectionError(
+        urllib3.exceptions.MaxRetryError(None, '/', urllib3.exceptions.NewConnectionError(None, 'refused')))
+    assert policy.should_retry('POST', 0, error=refused)
+    assert policy.should_retry('POST', 0, error=requests.exceptions.ConnectTimeout())
+    assert not policy.should_retry('POST', 0, error=requests.exceptions.ConnectionError('reset'))
+    assert policy.should_retry('GET', 0, error=requests.exceptions.ConnectionError('reset'))
+
+    # An unexpected error during the trial request allows another trial
+    client._breaker = retry.CircuitBreaker(threshold=1, reset_timeout=10)
+    client._breaker.record_failure()
+    monkeypatch.setattr(time, 'time', lambda: now + 22)
+    monkeypatch.setattr(client, '_send', lambda method, url, **kwargs: 1/0)
+    with pytest.raises(ZeroDivisionError):
+        client.list_jobs()
+    client._breaker.allow()
+
+def test_token_manager(monkeypatch, tmp_path):
+    """
+    The token file is only decoded when it changes, and is refreshed shortly before expiry
+    """
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.delenv('PROMINENCE_TOKEN')
+    monkeypatch.setenv('PROMINENCE_OIDC_CLIENT_ID', 'id')
+    monkeypatch.setenv('PROMINENCE_OIDC_CLIENT_SECRET', 'secret')
+    (tmp_path / '.prominence').mkdir()
+    filename = tmp_path / '.prominence' / 'token'
+
+    def make_token(expiry):
+        return jwt.encode({'exp': int(time.time() + expiry)}, 'x'*32, algorithm='HS256')
+
+    filename.write_text(json.dumps({'access_token': make_token(3600)}))
+    decoded = []
+    get_expiry = auth.get_expiry
+    monkeypatch.setattr(auth, 'get_expiry', lambda token: decoded.append(token) or get_expiry(token))
+
+    manager = auth.TokenManager()
+    token = manager.get()
+    assert manager.get() == token
+    assert len(decoded) == 1
+
+    # Tokens close to expiry are refreshed, keeping the refresh token
+    refreshed = make_token(7200)
+    transport = FakeTransport({'https://oidc.test/token': lambda method, path, kwargs:
+                               (200, {'access_token': refreshed}) if kwargs['data']['refresh_token'] == 'r1'
+                               else (400, {})})
+    monkeypatch.setenv('PROMINENCE_OIDC_URL', 'https://oidc.test')
+    filename.write_text(json.dumps({'access_token': make_token(60), 'refresh_token': 'r1'}))
+    os.utime(str(filename), ns=(0, 1))
+    manager = auth.TokenManager(session=transport)
+    assert manager.get() == refreshed
+    assert json.loads(filename.read_text()) == {'access_token': refreshed, 'refresh_token': 'r1'}
+    assert manager.get() == refreshed
+    assert len(transport.calls) == 1
+
+    # Failed refreshes are not retried on every request
+    current = make_token(60)
+    filename.write_text(json.dumps({'access_token': current, 'refresh_token': 'r2'}))
+    os.utime(str(filename), ns=(0, 3))
+    manager = auth.TokenManager(session=transport)
+    assert manager.get() == current
+    assert manager.get() == current
+    assert len(transport.calls) == 2
+
+    # Responses which are not JSON, e.g. error pages from a proxy, are token errors
+    transport = FakeTransport({'https://oidc.test/token': (200, '<html>Bad gateway</html>')})
+    manager = auth.TokenManager(session=transport)
+    assert manager.get() == current
+    assert len(transport.calls) == 1
+    with pytest.raises(exceptions.TokenError):
+        manager._refresh()
+
+    filename.write_text(json.dumps({'access_token': make_token(-10)}))
+    os.utime(str(filename), ns=(0, 2))
+    with pytest.raises(exceptions.TokenExpiredError):
+        manager.get()
+
+def test_cli_startup():
+    """
+    Importing the CLI does not load the client or third-party modules, and only the parser for the
+    command being run is created
+    """
+    script = ('import sys\n'
+              'from prominence.cli import main\n'
+              'try:\n'
+              '    main(["--version"])\n'
+              'except SystemExit:\n'
+              '    pass\n'
+              'print(" ".join(name for name, module in sys.modules.items()\n'
+              '               if type(module).__name__ != "_LazyModule"))\n')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    modules = subprocess.check_output([sys.executable, '-c', script], env=env, universal_newlines=True).split()
+    for name in ('requests', 'yaml', 'asyncio', 'prominence.client', 'prominence.job'):
+        assert name not in modules
+
+    parser = cli.create_parser('list')
+    assert list(parser._subparsers._group_actions[0].choices) == ['list']
+    assert sorted(cli.create_parser()._subparsers._group_actions[0].choices) == sorted(cli.COMMANDS)
+    assert cli.find_command(['--profile', 'list', 'jobs']) == 'list'
+    assert cli.find_command(['unknown']) is None
+
+    # Without a command only the names of the commands are needed
+    parser = cli.create_parser(names_only=True)
+    assert sorted(parser._subparsers._group_actions[0].choices) == sorted(cli.COMMANDS)
+    assert all(len(subparser._actions) == 1 for subparser in parser._subparsers._group_actions[0].choices.values())
+
+def test_agent(monkeypatch, tmp_path, capsys):
+    """
+    Requests are forwarded to a running agent, which coalesces identical concurrent requests
+    """
+    from prominence import agent
+    monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+    monkeypatch.setenv('PROMINENCE_AGENT_SOCKET', str(tmp_path / 'agent.sock'))
+    assert agent.connect() is None
+
+    transport = FakeTransport({'/jobs/1': (200, [{'id': 1, 'name': 'test', 'status': 'running', 'events': {}}])},
+                              base_url='http://prominence.test/v1',
+                              latency=0.2)
+    server = agent.Agent(ProminenceClient(session=transport), ttl=0)
+    thread = threading.Thread(target=server.serve)
+    thread.start()
+    try:
+        for _ in range(50):
+            if agent.connect():
+                break
+            time.sleep(0.05)
+        assert oct(os.stat(str(tmp_path / 'agent.sock')).st_mode & 0o777) == oct(0o600)
+
+        client = cli.get_client()
+        assert isinstance(client, agent.AgentClient)
+        assert client.status()['url'] == 'http://prominence.test/v1'
+
+        # A shell using a different server does not use the agent
+        monkeypatch.setenv('PROMINENCE_URL', 'http://other.test/v1')
+        assert agent.connect(url='http://other.test/v1') is None
+        assert isinstance(cli.get_client(), ProminenceClient)
+        monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(client.describe_job(1)['status']))
+                   for _ in range(5)]
+        for item in threads:
+            item.start()
+        for item in threads:
+            item.join()
+        assert results == ['running']*5
+        assert len(transport.calls) == 1
+        assert client.status()['coalesced'] == 4
+
+        with pytest.raises(exceptions.ConnectionError):
+            client.describe_job(2)
+        with pytest.raises(exceptions.ProminenceError):
+            client._call('delete_job', 1)
+        with pytest.raises(AttributeError):
+            client.delete_job
+
+        main(['describe', '--input', '1'])
+        assert '"name": "test"' in capsys.readouterr().out
+
+        # Unexpected errors are returned to every caller rather than leaving requests waiting
+        monkeypatch.setattr(server._client, 'describe_job', lambda *args, **kwargs: time.sleep(0.2) or 1/0)
+        errors = []
+
+        def describe():
+            try:
+                client.describe_job(3)
+            except exceptions.ProminenceError as err:
+                errors.append(str(err))
+
+        threads = [threading.Thread(target=describe) for _ in range(2)]
+        for item in threads:
+            item.start()
+        for item in threads:
+            item.join(5)
+        assert errors == ['Error in agent: division by zero']*2
+        assert not server._inflight
+    finally:
+        agent.AgentClient().stop()
+        thread.join(5)
+
+    assert not os.path.exists(str(tmp_path / 'agent.sock'))
+
+    # Each server has its own socket
+    monkeypatch.delenv('PROMINENCE_AGENT_SOCKET')
+    assert agent.socket_path('http://prominence.test/v1') == agent.socket_path('http://prominence.test/v1/')
+    assert agent.socket_path('http://prominence.test/v1') != agent.socket_path('http://other.test/v1')
+
+def test_fake_server(monkeypatch, tmp_path):
+    """
+    The client works against the local fake server, including paging, retries and conditional requests
+    """
+    isolate(monkeypatch, tmp_path)
+    from prominence.fakeserver import FakeServer
+    with FakeServer(jobs=2500, workflows=5) as server:
+        monkeypatch.setenv('PROMINENCE_URL', server.url)
+        client = ProminenceClient(backoff_factor=0)
+
+        jobs = list(client.iter_jobs('all', -1, page_size=1000))
+        assert [job['id'] for job in jobs] == list(range(1, 2501))
+        assert len([call for call in server.requests if call[1] == '/v1/jobs']) == 3
+        assert all(job['status'] in ('idle', 'running') for job in client.list_jobs())
+        assert len(client.list_jobs('completed', 10)) == 10
+        assert client.list_workflows('all', -1)[0]['progress']['total'] == 10
+
+        job_id = client.create_job({'name': 'test', 'tasks': [{'image': 'alpine', 'cmd': 'true'}]})
+        assert job_id == 2501
+        assert client.describe_job(job_id)['status'] == 'idle'
+        assert client.describe_job(job_id)['status'] == 'idle'
+        assert client.delete_job(job_id)
+        assert client.describe_job(job_id)['status'] == 'deleted'
+        assert client.stdout_job(1, 0, offset=14).startswith('from job 1')
+
+        server.inject(503, 2, path='/jobs/1')
+        assert client.describe_job(1)['id'] == 1
+        server.inject(500)
+        with pytest.raises(exceptions.JobGetError):
+            client.describe_job(1)
+
+        client.kv_set('a/b', 'value')
+        assert client.kv_list('a') == ['a/b']
+        assert client.kv_get('a/b') == 'value'
+        with pytest.raises(exceptions.NoSuchKey):
+            client.kv_get('missing')
+
+        (tmp_path / 'input.txt').write_bytes(b'data')
+        assert client.upload('input.txt', str(tmp_path / 'input.txt'))
+        assert client.list_objects(None)[0]['size'] == 4
+        assert 'users' in client.get_usage('2021-01-01', '2021-02-01', False, False)['usage']
+        assert len(client.resources()['existing']) == 4
+
+def test_render_table(monkeypatch, capsys, tmp_path):
+    """
+    Tables are printed with selected columns, width caps and widths from the first rows only
+    """
+    isolate(monkeypatch, tmp_path)
+    from prominence import render
+    jobs = [{'id': index, 'name': 'job%d' % index, 'status': 'running', 'events': {'createTime': 0},
+             'tasks': [{'image': 'centos:7', 'cmd': 'x'*index}]} for index in range(1, 21)]
+    columns = render.parse_columns('id,cmd:8,status', render.JOB_COLUMNS)
+    render.Table(columns, lookahead=5).render(iter(jobs))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == 'ID   CMD      STATUS '
+    assert lines[1] == '1    x        running'
+    assert lines[10] == '10   xxxxx...   running'
+    assert len(lines) == 21
+
+    with pytest.raises(ValueError):
+        render.parse_columns('id,unknown', render.JOB_COLUMNS)
+
+    # Commands are truncated after 100 characters
+    for length, cell in ((100, 'x'*100), (101, 'x'*100 + '...'), (103, 'x'*100 + '...')):
+        job = dict(jobs[0], tasks=[{'image': 'centos:7', 'cmd': 'x'*length}])
+        assert render.JOB_COLUMNS['cmd'].cell(job, 0) == cell
+
+    cli.list_jobs(reversed(jobs[:3]))
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == ['ID', 'NAME', 'CREATED', 'STATUS', 'ELAPSED', 'IMAGE', 'CMD']
+    assert [line.split()[0] for line in lines[1:]] == ['1', '2', '3']
+
+    monkeypatch.setattr(ProminenceClient, 'iter_jobs', lambda self, *args: iter(jobs[:2]))
+    main(['list', '--columns', 'name,status'])
+    assert capsys.readouterr().out.splitlines() == ['NAME   STATUS ', 'job1   running', 'job2   running']
+
+def test_output_formats(monkeypatch, capsys, tmp_path):
+    """
+    Listings and descriptions can be written as JSON lines, JSON, CSV or TSV
+    """
+    isolate(monkeypatch, tmp_path)
+    from prominence import render
+    from prominence.fakeserver import FakeServer
+    records = [{'a': 1, 'b': 'x,y'}, {'a': 2, 'b': 'z'}]
+    for output, expected in (('jsonl', '{"a": 1, "b": "x,y"}\n{"a": 2, "b": "z"}\n'),
+                             ('csv', 'a,b\n1,"x,y"\n2,z\n'),
+                             ('tsv', 'a\tb\n1\tx,y\n2\tz\n')):
+        stream = io.StringIO()
+        render.write_records(iter(records), output, stream=stream)
+        assert stream.getvalue() == expected
+    stream = io.StringIO()
+    render.write_records(iter(records), 'json', stream=stream)
+    assert json.loads(stream.getvalue()) == records
+    stream = io.StringIO()
+    render.write_records(iter([]), 'json', stream=stream)
+    assert json.loads(stream.getvalue()) == []
+
+    with FakeServer(jobs=20, workflows=2) as server:
+        monkeypatch.setenv('PROMINENCE_URL', server.url)
+        main(['list', '--all', '-n', '-1', '-o', 'jsonl'])
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(line)['id'] for line in lines] == list(range(1, 21))
+
+        main(['list', '--all', '-n', '-1', '--columns', 'id,status', '-o', 'csv'])
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == 'id,status' and len(lines) == 21
+
+        main(['describe', '3', '-o', 'tsv'])
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].split('\t')[:4] == ['id', 'name', 'created', 'status'] and lines[1].startswith('3\tjob-3\t')
+
+        main(['usage', '-o', 'jsonl', '2021-01-01', '2021-02-01'])
+        assert json.loads(capsys.readouterr().out)['numberOfJobs'] == 20
+
+def test_fields_and_filters(monkeypatch, capsys, tmp_path):
+    """
+    Field projection and filters are sent to the server and also applied by the client
+    """
+    isolate(monkeypatch, tmp_path)
+    from prominence import query
+    job = {'id': 1, 'status': 'running', 'labels': {'app': 'sim'}, 'events': {'createTime': 86400},
+           'tasks': [{'image': 'centos:7', 'cmd': 'a'}, {'image': 'alpine'}]}
+    assert query.project(job, ['id', 'events.createTime', 'tasks.image']) == \
+        {'id': 1, 'events': {'createTime': 86400}, 'tasks': [{'image': 'centos:7'}, {'image': 'alpine'}]}
+    assert query.get_field(job, 'tasks.image') == ['centos:7', 'alpine']
+    assert query.matches(job, statuses=['running', 'idle'], labels=['app=sim', 'app', 'batch!=1'])
+    assert not query.matches(job, labels=['app!=sim'])
+    assert query.matches(job, created_after='1970-01-02', created_before='1970-01-02 00:00:01')
+    assert not query.matches(job, created_after=86401)
+    assert query.parse_time('2021-01-01') == 1609459200
+
+    # The server ignores the parameters, so they are enforced by the client
+    requests_seen = []
+
+    def jobs(method, path, kwargs):
+        requests_seen.append(kwargs['params'])
+        return (200, [job, dict(job, id=2, status='failed'), dict(job, id=3, labels={})])
+
+    monkeypatch.setenv('PROMINENCE_URL', 'http://prominence.test/v1')
+    client = ProminenceClient(session=FakeTransport({'/jobs': jobs}, base_url='http://prominence.test/v1'))
+    assert client.list_jobs(fields=['id'], labels={'app': 'sim'}) == [{'id': 1}, {'id': 2}]
+    assert requests_seen[-1]['fields'] == 'id,labels' and requests_seen[-1]['labels'] == 'app=sim'
+    assert [item['id'] for item in client.iter_jobs('all', statuses=['failed'])] == [2]
+    assert requests_seen[-1]['statuses'] == 'failed'
+
+    # Servers which ignore filters apply the number of completed jobs first, so all are requested
+    states = ['completed', 'failed', 'running', 'failed', 'completed', 'killed']
+
+    def old_jobs(method, path, kwargs):
+        num = kwargs['params'].get('num', 1)
+        terminal = [{'id': index + 1, 'status': state} for index, state in enumerate(states) if state != 'running']
+        return (200, [{'id': 3, 'status': 'running'}] + (terminal if num < 0 else terminal[-num:]))
+
+    client = ProminenceClient(session=FakeTransport({'/jobs': old_jobs}, base_url='http://prominence.test/v1'))
+    assert [job['id'] for job in client.list_jobs('all', 1, statuses=['failed'])] == [4]
+    assert [job['id'] for job in client.list_jobs('all', 2, statuses=['failed', 'running'])] == [3, 2, 4]
+    assert [job for job in client.iter_jobs('completed', 2, fields=['id'], statuses=['failed', 'completed'])] == \
+        [{'id': 4}, {'id': 5}]
+    assert [job['id'] for job in client.list_jobs('all', 1)] == [3, 6]
+
+    from prominence.fakeserver import FakeServer
+    with FakeServer(jobs=200, workflows=2) as server:
+        monkeypatch.setenv('PROMINENCE_URL', server.url)
+        main(['list', '--status', 'failed,killed', '-n', '-1', '--label', 'app=sim', '--fields', 'id,status,labels.app',
+              '-o', 'csv'])
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == 'id,status,labels.app' and len(lines) > 1
+        assert all(line.split(',')[1] in ('failed', 'killed') and line.endswith(',sim') for line in lines[1:])
+
+        main(['describe', '5', '--fields', 'id,status', '-o', 'jsonl'])
+        assert sorted(json.loads(capsys.readouterr().out)) == ['id', 'status']
+
+def test_list_watch(monkeypatch, capsys, tmp_path):
+    """
+    Watching a listing only redraws changed rows and only fetches jobs which can still change
+    """
+    isolate(monkeypatch, tmp_path)
+    from prominence import render
+    stream = io.StringIO()
+    table = render.LiveTable(render.parse_columns('id,status', render.JOB_COLUMNS), stream)
+    jobs = [{'id': 1, 'status': 'idle'}, {'id': 2, 'status': 'running'}]
+    assert table.update(jobs, 'title') == 5
+    stream.seek(0)
+    stream.truncate()
+    assert table.update([jobs[0], dict(jobs[1], status='failed')], 'title') == 1
+    assert stream.getvalue() == '\x1b[5;1H2    failed \x1b[K\x1b[6;1H'
+
+    # Finished jobs are described once and then never fetched again
+    states = {1: 'completed', 2: 'running', 3: 'idle'}
+    calls = []
+
+    def list_items(status, statuses):
+        calls.append(status)
+        return [{'id': key, 'status': value} for key, value in states.items()
+                if status == 'all' or (value in ('idle', 'running')) == (status is None)]
+
+    def describe(key):
+        calls.append(key)
+        return {'id': key, 'status': states[key]}
+
+    listing = cli.watch_listing(list_items, describe, 'all')
+    assert [item['status'] for item in next(listing)] == ['completed', 'running', 'idle']
+    states[2] = 'failed'
+    assert [item['status'] for item in next(listing)] == ['completed', 'failed', 'idle']
+    assert [item['status'] for item in next(listing)] == ['completed', 'failed', 'idle']
+    assert calls == ['all', None, 2, None]
+
+    listing = cli.watch_listing(list_items, describe, 'completed')
+    assert [item['id'] for item in next(listing)] == [1, 2]
+
+    from prominence.fakeserver import FakeServer
+    with FakeServer(jobs=20, workflows=2) as server:
+        monkeypatch.setenv('PROMINENCE_URL', server.url)
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                raise KeyboardInterrupt
+
+        monkeypatch.setattr(time, 'sleep', sleep)
+        with pytest.raises(SystemExit):
+            main(['list', '--all', '-n', '-1', '--watch', '--interval', '2'])
+        output = capsys.readouterr().out
+        assert 'Every 2s: prominence list jobs' in output and output.count('\x1b[2J') == 1
+        assert sleeps == [2, 2]
+
+def test_listener(monkeypatch, capsys, tmp_path):
+    """
+    State change events sent to the listener run callbacks, with polling when no events arrive
+    """
+    isolate(monkeypatch, tmp_path)
+    from prominence import Listener, Notification
+    states = {1: 'running', 2: 'idle'}
+    calls = []
+
+    class Client(object):
+        def list_jobs(self):
+            calls.append('list')
+            return [{'id': id, 'status': status} for id, status in states.items() if status in ('idle', 'running')]
+
+        def describe_job(self, id):
+            calls.append(id)
+            return {'id': id, 'status': states[id]}
+
+    assert Notification('jobFinished', 'webhook').to_dict() is None
+    with Listener(client=Client(), poll_interval=0.05) as listener:
+        notification = listener.notification()
+        assert notification.to_dict() == {'event': 'jobFinished', 'type': 'webhook', 'url': listener.url}
+
+        jobs = [Job(id=1, client=listener._client), Job(id=2, client=listener._client)]
+        assert calls == [1, 2]
+        del calls[:]
+        seen = []
+        for job in jobs:
+            job.on_status_change(lambda job, event: seen.append((job.id, event['status'], 'polled' in event)), listener)
+
+        assert requests.post(listener.url, json={'id': 1, 'status': 'completed'}).status_code == 202
+        assert requests.post(listener.url, json={'id': 1, 'status': 'completed'}).status_code == 202
+        assert requests.post(listener.url + 'x', json={'id': 1}).status_code == 404
+        assert requests.post(listener.url, data='{').status_code == 400
+        for _ in range(100):
+            if listener.events == 2:
+                break
+            time.sleep(0.01)
+        assert jobs[0].done() and listener.events == 2 and calls == []
+
+        # No events arrive for the second job, so it is polled
+        states[2] = 'failed'
+        assert listener.wait(timeout=5)
+        assert seen == [(1, 'completed', False), (2, 'failed', True)]
+        assert calls == ['list', 2]
+
+    # A URL given for use behind a proxy still includes a random token
+    with Listener(url='https://proxy.test/hooks/') as listener:
+        assert re.match(r'^https://proxy\.test/hooks/[\w-]{16,}$', listener.url)
+        local = 'http://%s:%d' % listener._server.server_address[:2]
+        assert requests.post(local + '/hooks/', json={'id': 1}).status_code == 404
+        assert requests.post(local + '/hooks/' + listener.token, json={'id': 1}).status_code == 202
+
+    # Errors while polling are not raised by wait
+    class FailingClient(object):
+        def list_jobs(self):
+            return []
+
+        def describe_job(self, id):
+            raise exceptions.JobGetError('Job does not exist')
+
+    with Listener(client=FailingClient(), poll_interval=0.01) as listener:
+        job = Job(id=3, client=listener._client)
+        listener.register(job)
+        assert not listener.wait(timeout=0.1) and listener.polls > 1
+
+    from prominence.fakeserver import FakeServer
+    with FakeServer(jobs=20, workflows=0) as server:
+        monkeypatch.setenv('PROMINENCE_URL', server.url)
+        finished = [str(job['id']) for job in ProminenceClient().list_jobs('completed', -1)[:2]]
+        # Jobs which finished before listening are reported without waiting for the poll interval
+        start = time.time()
+        main(['listen', '--interval', '60'] + finished)
+        assert time.time() - start < 10
+        events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert sorted(str(event['id']) for event in events) == sorted(finished)